@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Benchmarks distributing AMIs with each strategy against a simulated EC2, so
+no AWS account is needed and nothing is spent. Every combination of the
+swept parameters is run in its own process, and one line of JSON per run is
+written with the wall-clock time, the API calls made by operation, how many
+calls were throttled and retried, and the peak resident memory. E.g.
+
+    python benchmarks/distribution.py --regions 5,20 --copy-duration 1 > results.jsonl
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from Queue import Empty
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from distami import backends, cli
+from distami.core import Distami
+from distami.polling import FixedPolicy
+from distami.simulator import SimulatedEC2
+
+# How often copies are polled, in seconds. Simulated copies are quick, so
+# polling as often as for real copies would swamp the results
+POLL_INTERVAL = 0.05
+MAX_POLL_INTERVAL = 1
+
+
+def run_serial(ec2, ami_ids, source_region, regions, journal):
+    ''' Copies, tags and shares each copy one after the other, as DistAMI did
+    before copies were scheduled '''
+
+    for ami_id in ami_ids:
+        distami = Distami(ami_id, source_region, FixedPolicy(POLL_INTERVAL))
+        distami.make_ami_public()
+        distami.make_snapshot_public()
+        for region in regions:
+            ami_cp = Distami(distami.copy_to_region(region), region, registry=distami.registry)
+            ami_cp.make_ami_public()
+            ami_cp.make_snapshot_public()
+
+
+def run_cli(ec2, ami_ids, source_region, regions, journal, *extra):
+    ''' Runs the distami command, as if from the shell '''
+
+    sys.argv = ['distami', '--region', source_region, '--to', ','.join(regions), '--journal', journal,
+                '--poll-interval', str(POLL_INTERVAL), '--max-poll-interval', str(MAX_POLL_INTERVAL)]
+    sys.argv.extend(extra)
+    sys.argv.extend(ami_ids)
+    try:
+        cli.run()
+    except SystemExit as e:
+        if e.code:
+            raise
+
+
+STRATEGIES = {
+    'serial': run_serial,
+    'pipelined': run_cli,
+    'parallel': lambda *args: run_cli(*(args + ('--parallel', ))),
+}
+
+
+def measure(case, results):
+    ''' Runs one case and puts its measurements on the results queue. Runs in
+    its own process, so the peak memory is that of this case alone '''
+
+    logging.basicConfig(level=logging.WARNING)
+    ec2 = SimulatedEC2(regions=case['regions'] + 1, copy_duration=case['copy_duration'], latency=case['latency'],
+                       throttle_rate=case['throttle_rate'], seed=case['seed'])
+    backends.set_backend(ec2)
+    regions = ec2.regions()
+    ami_ids = [ec2.add_image(regions[0], name='ami-%d' % n, description='Benchmark AMI %d' % n)
+               for n in range(case['amis'])]
+    ec2.calls.clear()
+
+    directory = tempfile.mkdtemp()
+    # Keep the simulated copy times out of the real ~/.distami
+    os.environ['DISTAMI_HOME'] = directory
+    error = None
+    start = time.time()
+    try:
+        STRATEGIES[case['strategy']](ec2, ami_ids, regions[0], regions[1:], os.path.join(directory, 'journal.jsonl'))
+    except Exception as e:
+        error = repr(e)
+    finally:
+        shutil.rmtree(directory)
+
+    result = dict(case)
+    result.update({
+        'seconds': round(time.time() - start, 3),
+        'calls': dict(ec2.calls),
+        'total_calls': sum(count for operation, count in ec2.calls.items() if operation != 'Connect'),
+        'throttled': sum(ec2.throttles.values()),
+        # ru_maxrss is in kilobytes on Linux
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'error': error,
+    })
+    results.put(result)
+
+
+def wait_for_result(case, process, results):
+    ''' The measurements of a case, or the case with an error if its process
+    died before sending them '''
+
+    while True:
+        try:
+            return results.get(timeout=1)
+        except Empty:
+            if process.is_alive():
+                continue
+        # It may have sent them just before exiting
+        try:
+            return results.get(timeout=1)
+        except Empty:
+            return dict(case, error='measuring process exited with code %s' % process.exitcode)
+
+
+def numbers(kind):
+    return lambda value: [kind(item) for item in value.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks AMI distribution strategies against a simulated EC2')
+    parser.add_argument('--strategies', type=lambda value: value.split(','), default=sorted(STRATEGIES),
+                        help='comma-separated strategies to run, from %s' % ', '.join(sorted(STRATEGIES)))
+    parser.add_argument('--regions', type=numbers(int), default=[2, 8, 24],
+                        help='comma-separated numbers of regions to copy to. The default is 2,8,24')
+    parser.add_argument('--amis', type=numbers(int), default=[1, 4],
+                        help='comma-separated numbers of AMIs to distribute. The default is 1,4')
+    parser.add_argument('--copy-duration', type=numbers(float), default=[0.5],
+                        help='comma-separated seconds each simulated copy takes. The default is 0.5')
+    parser.add_argument('--latency', type=numbers(float), default=[0.01],
+                        help='comma-separated seconds each simulated API call takes. The default is 0.01')
+    parser.add_argument('--throttle-rate', type=numbers(float), default=[0],
+                        help='comma-separated chances of an API call being throttled. The default is 0')
+    parser.add_argument('--seed', type=int, default=1,
+                        help='seeds the simulated throttling, so runs can be compared. The default is 1')
+    parser.add_argument('--output', metavar='FILE',
+                        help='append the results to FILE rather than writing them to stdout')
+    args = parser.parse_args()
+
+    unknown = set(args.strategies) - set(STRATEGIES)
+    if unknown:
+        parser.error('unknown strategies: %s' % ', '.join(sorted(unknown)))
+
+    out = open(args.output, 'a') if args.output else sys.stdout
+    for strategy, regions, amis, copy_duration, latency, throttle_rate in itertools.product(
+            args.strategies, args.regions, args.amis, args.copy_duration, args.latency, args.throttle_rate):
+        case = {'strategy': strategy, 'regions': regions, 'amis': amis, 'copy_duration': copy_duration,
+                'latency': latency, 'throttle_rate': throttle_rate, 'seed': args.seed}
+        results = multiprocessing.Queue()
+        process = multiprocessing.Process(target=measure, args=(case, results))
+        process.start()
+        result = wait_for_result(case, process, results)
+        process.join()
+        out.write(json.dumps(result, sort_keys=True) + '\n')
+        out.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import calendar
+import logging
+import re
+import threading
+import time
+
+from distami.backends import get_backend
+from distami.exceptions import *
+from distami.registry import Registry
+
+__all__ = ('Account', 'AssumeRoleBackend', 'ProfileBackend', 'AccountPool')
+log = logging.getLogger(__name__)
+
+ROLE_ARN = re.compile(r'^arn:aws[\w-]*:iam::(\d{12}):role/.+$')
+ACCOUNT_ID = re.compile(r'^\d{12}$')
+
+
+class Account(object):
+    ''' Another AWS account to distribute into, reached by assuming an IAM role
+    in it or through a boto profile with credentials for it '''
+
+    def __init__(self, account_id, role_arn=None, profile=None):
+        self.account_id = account_id
+        self.role_arn = role_arn
+        self.profile = profile
+
+    def __repr__(self):
+        return '<Account %s via %s>' % (self.account_id, self.role_arn or 'profile %s' % self.profile)
+
+    @classmethod
+    def parse(cls, spec):
+        ''' An account from a role ARN, such as
+        arn:aws:iam::123456789012:role/distami, or from PROFILE:ACCOUNT_ID
+        for a boto profile, since the account a profile is for cannot be
+        looked up '''
+
+        spec = spec.strip()
+        match = ROLE_ARN.match(spec)
+        if match:
+            return cls(match.group(1), role_arn=spec)
+        profile, _, account_id = spec.rpartition(':')
+        if profile and ACCOUNT_ID.match(account_id):
+            return cls(account_id, profile=profile)
+        raise DistamiException("Account '%s' is neither a role ARN nor PROFILE:ACCOUNT_ID" % spec)
+
+    def backend(self):
+        ''' A backend that connects to EC2 as this account '''
+
+        if self.role_arn:
+            return AssumeRoleBackend(self.role_arn)
+        return ProfileBackend(self.profile)
+
+
+def _assume_role(role_arn, session_name, duration):
+    from boto.exception import BotoServerError
+    from boto.sts import STSConnection
+    from boto.utils import parse_ts
+
+    try:
+        credentials = STSConnection().assume_role(role_arn, session_name, duration_seconds=duration).credentials
+    except BotoServerError as e:
+        raise DistamiException('Could not assume role %s: %s' % (role_arn, e.message or e.reason))
+    expires = calendar.timegm(parse_ts(credentials.expiration).timetuple())
+    return credentials.access_key, credentials.secret_key, credentials.session_token, expires
+
+
+def _connect(region, credentials):
+    from boto import ec2
+
+    access_key, secret_key, session_token = credentials[:3]
+    return ec2.connect_to_region(region, aws_access_key_id=access_key, aws_secret_access_key=secret_key,
+                                 security_token=session_token)
+
+
+class AssumeRoleBackend(object):
+    ''' Connects to EC2 with temporary credentials for a role, from STS
+    AssumeRole. The credentials are shared by every connection and renewed
+    refresh_before seconds before they expire, and each connection switches
+    to the renewed ones on its next call, so a distribution can outlast them.
+    The regions are the same as the process-wide backend's '''
+
+    def __init__(self, role_arn, session_name='distami', duration=3600, refresh_before=300, backend=None,
+                 assume_role=_assume_role, connect=_connect, clock=time.time):
+        self.role_arn = role_arn
+        self._session_name = session_name
+        self._duration = duration
+        self._refresh_before = refresh_before
+        self._backend = backend
+        self._assume_role = assume_role
+        self._connect = connect
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._credentials = None
+
+    def __repr__(self):
+        return '<AssumeRoleBackend %s>' % self.role_arn
+
+    def credentials(self):
+        ''' The (access key, secret key, session token, expiry time)
+        credentials, assuming the role again only if they are about to expire '''
+
+        with self._lock:
+            if self._credentials is None or self._credentials[3] - self._refresh_before <= self._clock():
+                log.debug('Assuming role %s', self.role_arn)
+                self._credentials = self._assume_role(self.role_arn, self._session_name, self._duration)
+            return self._credentials
+
+    def connect(self, region):
+        credentials = self.credentials()
+        conn = self._connect(region, credentials)
+        if conn is None:
+            return None
+        return _RenewingConnection(self, region, conn, credentials)
+
+    def regions(self):
+        return (self._backend or get_backend()).regions()
+
+
+class _RenewingConnection(object):
+    ''' An EC2 connection that reconnects whenever its backend renews its
+    credentials '''
+
+    def __init__(self, backend, region, conn, credentials):
+        self._backend = backend
+        self._region = region
+        self._conn = conn
+        self._credentials = credentials
+        self._lock = threading.Lock()
+        self.region = conn.region
+
+    def __repr__(self):
+        return 'Renewing%r' % (self._conn, )
+
+    def __getattr__(self, name):
+        credentials = self._backend.credentials()
+        with self._lock:
+            if credentials is not self._credentials:
+                log.debug('Reconnecting to %s with renewed credentials for %s', self._region, self._backend.role_arn)
+                self._conn = self._backend._connect(self._region, credentials)
+                self._credentials = credentials
+            return getattr(self._conn, name)
+
+
+class ProfileBackend(object):
+    ''' Connects to EC2 with the credentials of a boto profile, which boto
+    looks after itself. The regions are the same as the process-wide backend's '''
+
+    def __init__(self, profile, backend=None):
+        self.profile = profile
+        self._backend = backend
+
+    def __repr__(self):
+        return '<ProfileBackend %s>' % self.profile
+
+    def connect(self, region):
+        from boto import ec2
+        return ec2.connect_to_region(region, profile_name=self.profile)
+
+    def regions(self):
+        return (self._backend or get_backend()).regions()
+
+
+class AccountPool(object):
+    ''' Keeps one Registry per account, so each account's credentials are
+    fetched once and its connections to each region are shared by every copy
+    into that account. backend_for(account) makes each account's backend,
+    Account.backend() by default '''
+
+    def __init__(self, accounts, backend_for=None, ttl=60):
+        self.accounts = list(accounts)
+        self._backend_for = backend_for or (lambda account: account.backend())
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._registries = {}
+
+    def registry(self, account):
+        ''' The shared registry for an account, made on first use '''
+
+        with self._lock:
+            if account.account_id not in self._registries:
+                self._registries[account.account_id] = Registry(self._ttl, self._backend_for(account))
+            return self._registries[account.account_id]
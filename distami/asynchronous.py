@@ -0,0 +1,376 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import threading
+import time
+
+from Queue import Queue
+
+from distami.core import Distami
+from distami.exceptions import *
+from distami.polling import backoff, is_copy_limit_error, retry_copy, retry_throttled
+from distami.waiter import AmiWaiter
+
+__all__ = ('DistamiAsync', 'Future', 'CopyHandle', 'Executor', 'WaitLoop')
+log = logging.getLogger(__name__)
+
+
+class Future(object):
+    ''' The result of an operation that finishes in the background. Wait for
+    it with result(), or have a callback called with the future when it is
+    done, e.g. to hand it over to an event loop '''
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._done = False
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+
+    def done(self):
+        with self._condition:
+            return self._done
+
+    def result(self, timeout=None):
+        ''' Waits for the operation to finish and returns its result, or raises
+        its exception. Raises DistamiException if it is not done in time '''
+
+        self._wait(timeout)
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def exception(self, timeout=None):
+        ''' Waits for the operation to finish and returns its exception, or None '''
+
+        self._wait(timeout)
+        return self._exception
+
+    def add_done_callback(self, callback):
+        ''' Calls callback(future) once done, straight away if it already is '''
+
+        with self._condition:
+            if not self._done:
+                self._callbacks.append(callback)
+                return
+        self._call(callback)
+
+    def set_result(self, result):
+        self._finish(result, None)
+
+    def set_exception(self, exception):
+        self._finish(None, exception)
+
+    def _wait(self, timeout):
+        deadline = None if timeout is None else time.time() + timeout
+        with self._condition:
+            while not self._done:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    raise DistamiException('Timed out after %s seconds' % timeout)
+                # Wait in short steps so Ctrl-C still reaches the main thread
+                self._condition.wait(1 if remaining is None else min(1, remaining))
+
+    def _finish(self, result, exception):
+        with self._condition:
+            if self._done:
+                return
+            self._result = result
+            self._exception = exception
+            self._done = True
+            callbacks, self._callbacks = self._callbacks, []
+            self._condition.notify_all()
+        for callback in callbacks:
+            self._call(callback)
+
+    def _call(self, callback):
+        try:
+            callback(self)
+        except Exception:
+            log.exception('Callback %r of %r failed', callback, self)
+
+
+class CopyHandle(Future):
+    ''' A copy of an AMI to another region. Its result is the ID of the copy,
+    once it is available and tagged. ami_id is set as soon as it is started '''
+
+    def __init__(self, source_ami_id, region):
+        Future.__init__(self)
+        self.source_ami_id = source_ami_id
+        self.region = region
+        self.ami_id = None
+
+    def __repr__(self):
+        return '<CopyHandle %s to %s: %s>' % (self.source_ami_id, self.region, self.ami_id or 'not started')
+
+
+class Executor(object):
+    ''' Runs short blocking calls, such as starting a copy or changing
+    permissions, on a fixed number of worker threads '''
+
+    def __init__(self, workers=8):
+        self._queue = Queue()
+        for _ in range(workers):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+
+    def submit(self, func, *args, **kwargs):
+        ''' Calls func in the background and returns a Future of its result '''
+
+        future = Future()
+        self._queue.put((future, func, args, kwargs))
+        return future
+
+    def _work(self):
+        while True:
+            future, func, args, kwargs = self._queue.get()
+            try:
+                future.set_result(func(*args, **kwargs))
+            except Exception as e:
+                log.debug('%s failed', getattr(func, '__name__', func), exc_info=True)
+                future.set_exception(e)
+
+
+class WaitLoop(object):
+    ''' Waits for any number of AMIs on a single thread, polling them all
+    with one AmiWaiter, so each wait costs no more than a dict entry. It also
+    runs timers, so work can be put off without holding a thread '''
+
+    def __init__(self, policy=None):
+        self._policy = policy
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._added = []
+        self._timers = []
+        self._thread = None
+
+    def watch(self, conn, ami_id):
+        ''' Returns a Future of the image once it is available. It fails if
+        the image fails or cannot be found '''
+
+        future = Future()
+        with self._lock:
+            self._added.append((conn, ami_id, future))
+            self._start()
+        self._wake.set()
+        return future
+
+    def call_later(self, delay, func, region=None):
+        ''' Calls func on the wait loop's thread after delay seconds, or as
+        soon as an AMI watched in region is done if that is sooner. func must
+        not block, and should hand any calls off to an Executor '''
+
+        with self._lock:
+            self._timers.append((time.time() + delay, region, func))
+            self._start()
+        self._wake.set()
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _due(self, freed):
+        ''' Takes the timers that are due, and for each region in freed, once
+        for every AMI done there, the next timer waiting on it. Returns them
+        with when the next of the rest is due '''
+
+        now = time.time()
+        freed = list(freed)
+        due, rest = [], []
+        with self._lock:
+            for when, region, func in sorted(self._timers):
+                if when <= now:
+                    due.append(func)
+                elif region in freed:
+                    freed.remove(region)
+                    due.append(func)
+                else:
+                    rest.append((when, region, func))
+            self._timers = rest
+            return due, rest[0][0] if rest else None
+
+    def _run(self):
+        waiter = AmiWaiter(self._policy)
+        watching = {}
+        freed = []
+        next_poll = 0
+        while True:
+            with self._lock:
+                added, self._added = self._added, []
+                self._wake.clear()
+            due, next_timer = self._due(freed)
+            freed = []
+            for func in due:
+                try:
+                    func()
+                except Exception:
+                    log.exception('Timer %r failed', func)
+            for conn, ami_id, future in added:
+                waiter.add(conn, ami_id)
+                watching.setdefault((conn.region.name, ami_id), []).append(future)
+
+            # Poll straight away for new AMIs, and otherwise when the poll policy says
+            if watching and (added or time.time() >= next_poll):
+                finished = waiter.poll()
+
+                for region, ami_id in waiter.lost():
+                    freed.append(region)
+                    for future in watching.pop((region, ami_id)):
+                        future.set_exception(AmiNotFoundException(ami_id, region))
+                # Only the AMIs in a region that could not be polled are given up on
+                for region, ami_id, error in waiter.failed():
+                    for future in watching.pop((region, ami_id)):
+                        future.set_exception(error)
+                for image in finished:
+                    freed.append(image.region.name)
+                    for future in watching.pop((image.region.name, image.id)):
+                        if image.state == 'failed':
+                            future.set_exception(DistamiException(
+                                "AMI '%s' is in a failed state and will never be available" % image.id))
+                        else:
+                            future.set_result(image)
+                next_poll = time.time() + waiter.next_delay()
+                if freed:
+                    continue
+
+            # Sleep until the next poll or timer, or until there is something new
+            wake_at = [when for when in (next_poll if watching else None, next_timer) if when is not None]
+            self._wake.wait(max(0, min(wake_at) - time.time()) if wake_at else None)
+
+
+_executor = None
+_wait_loop = None
+_shared_lock = threading.Lock()
+
+
+def _shared():
+    global _executor, _wait_loop
+    with _shared_lock:
+        if _executor is None:
+            _executor = Executor()
+            _wait_loop = WaitLoop()
+        return _executor, _wait_loop
+
+
+class DistamiAsync(object):
+    ''' The non-blocking counterpart of Distami. Every method returns straight
+    away with a Future, and copy_to_region returns a CopyHandle. Waits for
+    copies all share one polling thread, however many there are, and the
+    other calls run on a small pool of threads.
+
+    Looking up the source AMI makes API calls, so it is wrapped around a
+    Distami that has already been loaded. load() does that in the background.
+    By default every DistamiAsync shares the same executor and wait loop '''
+
+    def __init__(self, distami, executor=None, wait_loop=None):
+        self._distami = distami
+        shared_executor, shared_wait_loop = _shared() if executor is None or wait_loop is None else (None, None)
+        self._executor = executor or shared_executor
+        self._wait_loop = wait_loop or shared_wait_loop
+
+    @classmethod
+    def load(cls, ami_id, ami_region, poll_policy=None, registry=None, executor=None, wait_loop=None,
+             extra_tags=None):
+        ''' Looks up the source AMI on the executor, and returns a Future of the
+        DistamiAsync for it. It fails if the AMI cannot be found '''
+
+        shared_executor, shared_wait_loop = _shared() if executor is None or wait_loop is None else (None, None)
+        executor = executor or shared_executor
+        wait_loop = wait_loop or shared_wait_loop
+        return executor.submit(lambda: cls(Distami(ami_id, ami_region, poll_policy, registry, extra_tags),
+                                           executor, wait_loop))
+
+    @property
+    def distami(self):
+        ''' The blocking Distami underneath '''
+
+        return self._distami
+
+    @property
+    def ami_id(self):
+        return self._distami.ami_id
+
+    @property
+    def region(self):
+        return self._distami.region
+
+    def make_ami_public(self):
+        return self._executor.submit(self._distami.make_ami_public)
+
+    def make_ami_non_public(self):
+        return self._executor.submit(self._distami.make_ami_non_public)
+
+    def share_ami_with_accounts(self, account_ids):
+        return self._executor.submit(self._distami.share_ami_with_accounts, account_ids)
+
+    def make_snapshot_public(self):
+        return self._executor.submit(self._distami.make_snapshot_public)
+
+    def make_snapshot_non_public(self):
+        return self._executor.submit(self._distami.make_snapshot_non_public)
+
+    def share_snapshot_with_accounts(self, account_ids):
+        return self._executor.submit(self._distami.share_snapshot_with_accounts, account_ids)
+
+    def apply_permissions(self, plan):
+        return self._executor.submit(self._distami.apply_permissions, plan)
+
+    def copy_to_region(self, region):
+        ''' Starts copying this AMI to another region, and returns a CopyHandle
+        that is done once the copy is available and tagged '''
+
+        handle = CopyHandle(self.ami_id, region)
+
+        def start():
+            # Throttled calls are retried on the executor, but a copy turned
+            # away by the copy limit is put back on the wait loop instead
+            self._executor.submit(self._distami.start_copy_to_region, region,
+                                  retry=retry_throttled).add_done_callback(started)
+
+        attempts = [0]
+
+        def started(future):
+            error = future.exception()
+            if error is not None and is_copy_limit_error(error) and attempts[0] + 1 < retry_copy.attempts:
+                attempts[0] += 1
+                delay = backoff(attempts[0], retry_copy.base, retry_copy.cap)
+                log.info('%s has as many copies in flight as allowed, trying %s again in %.0f seconds',
+                         region, self.ami_id, delay)
+                self._wait_loop.call_later(delay, start, region)
+                return
+            if error is not None:
+                handle.set_exception(error)
+                return
+            dest_conn, handle.ami_id = future.result()
+            self._wait_loop.watch(dest_conn, handle.ami_id).add_done_callback(available)
+
+        def available(future):
+            if future.exception() is not None:
+                handle.set_exception(future.exception())
+                return
+            tagged = self._executor.submit(self._distami.finish_copy_to_region, future.result())
+            tagged.add_done_callback(finished)
+
+        def finished(future):
+            if future.exception() is not None:
+                handle.set_exception(future.exception())
+            else:
+                handle.set_result(future.result())
+
+        start()
+        return handle
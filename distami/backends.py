@@ -0,0 +1,110 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import errno
+import json
+import logging
+import os
+import threading
+import time
+
+from distami import config
+from distami.exceptions import *
+
+__all__ = ('BotoBackend', 'get_backend', 'set_backend')
+log = logging.getLogger(__name__)
+
+
+class BotoBackend(object):
+    ''' Talks to the real EC2 API through boto. A backend is anything with
+    connect(region), returning an EC2 connection or None for an unknown
+    region, and regions(), returning the names of every region.
+
+    The region names are cached in cache_path, if given, for cache_ttl
+    seconds, since they hardly ever change '''
+
+    def __init__(self, cache_path=None, cache_ttl=config.REGION_CACHE_TTL, clock=time.time):
+        self._cache_path = cache_path
+        self._cache_ttl = cache_ttl
+        self._clock = clock
+
+    def connect(self, region):
+        from boto import ec2
+        return ec2.connect_to_region(region)
+
+    def regions(self):
+        regions = self._cached_regions()
+        if regions is None:
+            from boto import ec2
+            regions = [region.name for region in ec2.regions()]
+            self._cache_regions(regions)
+        return regions
+
+    def _cached_regions(self):
+        if not self._cache_path:
+            return None
+        try:
+            with open(self._cache_path) as fh:
+                cached = json.load(fh)
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                log.debug('Could not read region cache %s: %s', self._cache_path, e)
+            return None
+        except ValueError:
+            log.debug('Ignoring corrupt region cache %s', self._cache_path)
+            return None
+        if cached.get('time', 0) + self._cache_ttl < self._clock():
+            return None
+        return cached.get('regions')
+
+    def _cache_regions(self, regions):
+        if not self._cache_path:
+            return
+        try:
+            directory = os.path.dirname(self._cache_path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            # Write then rename, so a concurrent run never reads half a file
+            with open(self._cache_path + '.tmp', 'w') as fh:
+                json.dump({'time': self._clock(), 'regions': regions}, fh)
+            os.rename(self._cache_path + '.tmp', self._cache_path)
+        except (IOError, OSError) as e:
+            log.debug('Could not write region cache %s: %s', self._cache_path, e)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    ''' Gets the backend used by the whole process, boto unless another was
+    set. The boto backend caches the region names as the config file says '''
+
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            ttl = config.load_config().get('region_cache_ttl', config.REGION_CACHE_TTL)
+            if not str(ttl).isdigit():
+                raise DistamiException("region_cache_ttl must be a number of seconds, not '%s'" % ttl)
+            _backend = BotoBackend(os.path.join(config.get_distami_dir(), 'regions.json'), int(ttl))
+        return _backend
+
+
+def set_backend(backend):
+    ''' Swaps in another backend, such as a SimulatedEC2, for the whole process '''
+
+    global _backend
+    with _backend_lock:
+        log.debug('Using backend %r', backend)
+        _backend = backend
@@ -14,15 +14,15 @@
 
 import argparse
 import logging
+import os
 import sys
 
-from distami.core import Distami, Logging
-from distami import __version__, utils
+from distami import __version__, config
 from distami.exceptions import DistamiException
+from distami.journal import Journal
 
-from boto.utils import get_instance_metadata
-
-from multiprocessing import Pool
+# Anything that imports boto is imported only when it is needed, so that
+# --help, --version and bad arguments return straight away
 
 
 __all__ = ('run', )
@@ -34,41 +34,279 @@ def _fail(message="Unknown failure", code=1):
     sys.exit(code)
 
 
-def copy(param_array):
-    ''' Copies distami to the given region '''
+def reuse_existing_copies(tasks, journal):
+    ''' Looks for copies that already exist in the destination regions, and
+    records them in the journal so they are finished rather than copied again.
+    Each account's regions are searched with its own credentials '''
+    
+    from distami.index import CopyIndex
+    
+    by_account = {}
+    for distami, region in tasks:
+        by_account.setdefault(distami.account_id, []).append((distami, region))
     
-    distami = param_array[0]
-    to_region = param_array[1]
-    args = param_array[2]
-    copied_ami_id = distami.copy_to_region(to_region)
-    ami_cp = Distami(copied_ami_id, to_region)
+    for account_tasks in by_account.values():
+        index = CopyIndex(unique([distami for distami, region in account_tasks]))
+        index.build(unique([region for distami, region in account_tasks]))
+        
+        for distami, region in account_tasks:
+            step, copied_ami_id = journal.progress(distami.ami_id, region, distami.account_id)
+            image = index.find(distami.ami_id, region)
+            if step is not None or image is None:
+                continue
+            log.info('Reusing %s in %s, an existing copy of %s', image.id, destination(region, distami.account_id), distami.ami_id)
+            step = Journal.AVAILABLE if image.state == 'available' else Journal.STARTED
+            journal.record(distami.ami_id, region, step, image.id, distami.account_id)
 
-    if args.non_public:
-        distami.make_ami_non_public()
-        distami.make_snapshot_non_public()
-    else:
-        ami_cp.make_ami_public()
-        ami_cp.make_snapshot_public()
 
-    if args.accounts:
-        ami_cp.share_ami_with_accounts(args.accounts)
-        ami_cp.share_snapshot_with_accounts(args.accounts)
+def copy_into_accounts(distamis, pool, regions):
+    ''' The (distami, region) tasks that copy every AMI into every region of
+    every account in an AccountPool '''
+    
+    tasks = []
+    for account in pool.accounts:
+        registry = pool.registry(account)
+        for distami in distamis:
+            other = distami.in_account(account.account_id, registry)
+            tasks.extend((other, region) for region in regions)
+    return tasks
+
+
+def region_filters(args, settings):
+    ''' The partitions and excluded regions that --to all means, from the
+    command line or else the config '''
+    
+    partitions = config.split_list(args.partitions or settings.get('partitions'))
+    exclude = config.split_list(args.exclude if args.exclude is not None else settings.get('exclude'))
+    return partitions, exclude
+
+
+def regions_to_copy_to(args, ami_region, settings):
+    ''' The regions --to means, which may include the AMI's own region '''
+    
+    from distami import utils
+    
+    if args.to and args.to == 'none':
+        return []
+    elif args.to and args.to != 'all':
+        # TODO It is probably worth sanity checking this for typos
+        return args.to.split(',')
+    partitions, exclude = region_filters(args, settings)
+    return utils.get_regions_to_copy_to(ami_region, partitions=partitions, exclude=exclude)
+
+
+def prune(args, ami_region, settings):
+    ''' Deletes the copies the retention policy does not keep, in --region and
+    the --to regions, or only prints them with --dry-run '''
+    
+    from distami.prune import Pruner, RetentionPolicy, format_plan
+    
+    policy = RetentionPolicy(args.keep_last, args.keep_days, args.group_by)
+    regions = unique([ami_region] + regions_to_copy_to(args, ami_region, settings))
+    pruner = Pruner(rate=args.prune_rate, concurrency=args.concurrency)
+    plan = pruner.plan(regions, policy)
+    log.info('%d copies in %d regions are not kept by %s', len(plan), len(regions), policy)
+    if args.dry_run:
+        if plan:
+            print format_plan(plan)
+        return
+    failed = pruner.prune(plan)
+    if failed:
+        _fail('Could not delete %d of %d copies: %s' % (len(failed), len(plan), ', '.join(
+            '%s:%s' % (item.region, item.ami_id) for item in failed)))
+    log.info('Deleted %d copies', len(plan))
+
+
+def parse_accounts(accounts):
+    ''' The AWS Account IDs in a comma-separated list, without duplicates '''
+    
+    return unique([account_id.strip() for account_id in (accounts or '').split(',') if account_id.strip()])
+    
+
+def parse_tags(tags):
+    ''' The extra tags from KEY=VALUE strings, in a dict '''
+    
+    parsed = {}
+    for tag in tags or []:
+        key, sep, value = tag.partition('=')
+        if not sep or not key.strip():
+            raise DistamiException("Tag '%s' is not KEY=VALUE" % tag)
+        parsed[key.strip()] = value.strip()
+    return parsed
+    
+
+def save_copy_times(copy_times):
+    ''' Saves the measured copy times, which are only an optimization, so
+    failing to is not an error '''
+    
+    try:
+        copy_times.save()
+    except (IOError, OSError) as e:
+        log.warning('Could not save copy times: %s', e)
+
+
+def serve(args, metrics):
+    ''' Runs the job service until interrupted. Jobs are distributed with the
+    same limits, journal and regions as the command line's '''
+    
+    from distami.service import Service, serve
+    
+    host, _, port = args.serve.rpartition(':')
+    if not port.isdigit():
+        _fail('--serve must be [HOST:]PORT')
+    try:
+        settings = config.load_config()
+        journal = Journal(args.journal)
+        if args.resume:
+            journal.load()
+    except DistamiException as e:
+        _fail(e.message)
+    partitions, exclude = region_filters(args, settings)
+    service = Service(policy=poll_policy(args), journal=journal, concurrency=args.concurrency, per_region=args.per_region,
+                      partitions=partitions, exclude=exclude, metrics=metrics)
+    server = serve(service, (host or '127.0.0.1', int(port)))
+    log.info('Serving jobs on http://%s:%d/jobs', server.server_address[0], server.server_address[1])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        log.info('Stopped serving jobs')
+    finally:
+        export_metrics(metrics, args)
+    sys.exit(0)
+
+
+def destination(region, account_id=None):
+    ''' Where a copy goes: the region, prefixed by the account if it is not
+    the one running the distribution '''
     
+    return '%s/%s' % (account_id, region) if account_id else region
+
+
+def report(results):
+    ''' Logs the outcome of each copy and fails if any of them did not succeed '''
+    
+    for result in results:
+        to = destination(result.region, result.account_id)
+        if result.copied_from:
+            to += ' via %s' % result.copied_from
+        if result.succeeded:
+            log.info('Copied %s to %s as %s in %.0f seconds', result.source_ami_id, to, result.ami_id, result.duration)
+        else:
+            log.error('Copy of %s to %s failed: %s', result.source_ami_id, to, result.error)
+    
+    failed = ['%s:%s' % (result.source_ami_id, destination(result.region, result.account_id))
+              for result in results if not result.succeeded]
+    if failed:
+        _fail('%d of %d copies failed: %s' % (len(failed), len(results), ', '.join(failed)))
+
+
+def read_manifest(path):
+    ''' Reads AMI IDs from a manifest file, one per line. Blank lines and
+    lines starting with # are ignored '''
+    
+    try:
+        with open(path) as fh:
+            lines = [line.strip() for line in fh]
+    except IOError as e:
+        raise DistamiException("Could not read manifest '%s': %s" % (path, e.strerror))
+    return [line for line in lines if line and not line.startswith('#')]
+
+
+def unique(items):
+    ''' The items without duplicates, in their original order '''
+    
+    seen = set()
+    return [item for item in items if not (item in seen or seen.add(item))]
+
+
+def poll_policy(args):
+    ''' Builds the policy used to poll copies, from the command line arguments '''
+    
+    from distami.polling import AdaptivePolicy, FixedPolicy
+    
+    if args.poll == 'fixed':
+        return FixedPolicy(args.poll_interval)
+    return AdaptivePolicy(min_interval=args.poll_interval, max_interval=args.max_poll_interval)
+
+
+def export_metrics(metrics, args):
+    ''' Writes the timings of the run wherever the command line asked for them '''
+    
+    try:
+        if args.metrics:
+            metrics.write_json(args.metrics)
+            log.info('Wrote metrics to %s', args.metrics)
+        if args.prometheus:
+            metrics.write_prometheus(args.prometheus)
+            log.info('Wrote Prometheus metrics to %s', args.prometheus)
+    except (IOError, OSError) as e:
+        log.error('Could not write metrics: %s', e)
+
 
 def run():
     parser = argparse.ArgumentParser(description='Distributes an AMI by copying it to one, many, or all AWS regions, and by optionally making the AMIs and Snapshots public or shared with specific AWS Accounts.')
-    parser.add_argument('ami_id', metavar='AMI_ID', 
-                        help='the source AMI ID to distribute. E.g. ami-1234abcd')
+    parser.add_argument('ami_ids', metavar='AMI_ID', nargs='*',
+                        help='the source AMI IDs to distribute, all in the same region. E.g. ami-1234abcd')
+    parser.add_argument('--manifest', metavar='FILE',
+                        help='a file of more source AMI IDs to distribute, one per line')
     parser.add_argument('--region', metavar='REGION', 
-                        help='the region the AMI is in (default is current region of EC2 instance this is running on). E.g. us-east-1')
+                        help='the region the AMI is in (default is $AWS_DEFAULT_REGION, the region in ~/.distami/config, or the current region of the EC2 instance this is running on). E.g. us-east-1')
     parser.add_argument('--to', metavar='REGIONS', 
-                        help='comma-separated list of regions to copy the AMI to. The default is all regions. Specify "none" to prevent copying to other regions. E.g. us-east-1,us-west-1,us-west-2')
+                        help='comma-separated list of regions to copy the AMI to. The default is all regions in --partitions, less any --exclude. Specify "none" to prevent copying to other regions. E.g. us-east-1,us-west-1,us-west-2')
+    parser.add_argument('--partitions', metavar='PARTITIONS',
+                        help='comma-separated list of AWS partitions whose regions "all" regions means. The default is the partition of --region. E.g. aws,aws-us-gov')
+    parser.add_argument('--exclude', metavar='REGIONS',
+                        help='comma-separated list of regions, or patterns such as ap-*, that "all" regions leaves out')
+    parser.add_argument('--to-accounts', metavar='ACCOUNTS',
+                        help='comma-separated list of other AWS accounts to also copy the AMIs into, each an IAM role ARN to assume or a boto PROFILE:ACCOUNT_ID. The AMIs are shared with these accounts and copied into their --to regions and the source region. E.g. arn:aws:iam::123412341234:role/distami,prod:987698769876')
     parser.add_argument('--non-public', action='store_true', default=False, 
                         help='Copies the AMIs to other regions, but does not make the AMIs or snapshots public. Bad karma, but good for AMIs that need to be private/internal only')
     parser.add_argument('--accounts', metavar='AWS_ACCOUNT_IDs', 
                         help='comma-separated list of AWS Account IDs to share an AMI with. Assumes --non-public. Specify --to=none to share without copying.')
     parser.add_argument('-p', '--parallel', action='store_true', default=False, 
-                        help='Perform each copy to another region in parallel. The default is in serial which can take a long time')
+                        help='Also share the copies in parallel as they become available. Copies are always started up front and tagged as they land; without this they are shared one at a time')
+    parser.add_argument('--tag', metavar='KEY=VALUE', action='append', dest='tags',
+                        help='an extra tag to put on every copy and its snapshots, on top of the source tags and the distami:source-ami and distami:source-region tags recording where it came from. Can be given more than once')
+    parser.add_argument('--relay', action='store_true', default=False,
+                        help='copy to a region from a nearby region\'s copy, once that is available, instead of from the source region, wherever the copy times measured on past runs say it will finish sooner. Regions are near according to the affinity setting')
+    parser.add_argument('-c', '--concurrency', metavar='N', type=int,
+                        help='the maximum number of copies to have in flight at once; the rest are queued. The default is no limit')
+    parser.add_argument('--per-region', metavar='N', type=int,
+                        help='the maximum number of copies into any one region to have in flight at once; the rest are queued. Copies that EC2 rejects for being over its limit, or that are throttled, are retried with backoff. The default is no limit')
+    parser.add_argument('--poll', choices=('adaptive', 'fixed'), default='adaptive',
+                        help='how to poll copies while they complete. "adaptive" uses snapshot progress to poll more often near completion and backs off otherwise; "fixed" polls every --poll-interval seconds. The default is adaptive')
+    parser.add_argument('--poll-interval', metavar='SECONDS', type=float, default=5,
+                        help='the fixed poll interval, or the shortest adaptive poll interval. The default is 5')
+    parser.add_argument('--max-poll-interval', metavar='SECONDS', type=float, default=120,
+                        help='the longest adaptive poll interval. The default is 120')
+    parser.add_argument('--journal', metavar='FILE', default=os.path.join(config.get_distami_dir(), 'journal.jsonl'),
+                        help='where to record the progress of each copy. The default is ~/.distami/journal.jsonl')
+    parser.add_argument('--resume', action='store_true', default=False,
+                        help='carry on from where the journal says an earlier run of the same distribution got to, instead of starting every copy again')
+    parser.add_argument('--no-reuse', action='store_true', default=False,
+                        help='always copy, even when a region already has a copy of the AMI, tagged with its distami:source-ami tag or with the same name and description')
+    parser.add_argument('--progress', choices=('table', 'json'),
+                        help='show the progress of every copy: "table" redraws a table of regions with their progress, rate and ETA on stderr; "json" writes a line of JSON to stdout for every change. The default is to log')
+    parser.add_argument('--metrics', metavar='FILE',
+                        help='write how long each EC2 call and each stage took, per region, to FILE as JSON at the end of the run')
+    parser.add_argument('--prometheus', metavar='FILE',
+                        help='also write the metrics to FILE in the Prometheus text format, for the node exporter textfile collector')
+    parser.add_argument('--statsd', metavar='HOST[:PORT]',
+                        help='also send each metric to StatsD as it is recorded. The default port is 8125')
+    parser.add_argument('--prune', action='store_true', default=False,
+                        help='instead of distributing, delete the copies made by earlier distributions, with their snapshots, in --region and the --to regions, keeping those --keep-last and --keep-days say to. Only AMIs with the distami:source-ami tag are deleted. Failed copies are always deleted, but no others of a family with a copy still in flight')
+    parser.add_argument('--keep-last', metavar='N', type=int,
+                        help='with --prune, keep the newest N available copies of each family in each region, where N is at least 1. See --group-by')
+    parser.add_argument('--group-by', metavar='TAG', default='Name',
+                        help='with --prune, the tag whose value is shared by the copies of one family, such as every build of an image. Copies without it are grouped by the distami:source-ami tag. The default is Name')
+    parser.add_argument('--keep-days', metavar='DAYS', type=float,
+                        help='with --prune, keep every copy younger than DAYS')
+    parser.add_argument('--prune-rate', metavar='N', type=float, default=5,
+                        help='with --prune, make at most N delete calls per second in each region. The default is 5')
+    parser.add_argument('--dry-run', action='store_true', default=False,
+                        help='with --prune, print the copies that would be deleted, and delete nothing')
+    parser.add_argument('--serve', metavar='[HOST:]PORT', nargs='?', const='127.0.0.1:8353',
+                        help='run as a service instead: distribution jobs POSTed as JSON to /jobs are queued and run together, sharing connections and polling, and GET /jobs/ID shows how each is doing. The default address is 127.0.0.1:8353. There is no authentication, so keep it on localhost')
     parser.add_argument('-v', '--verbose', action='count', 
                         help='enable verbose output (-vvv for more)')
     parser.add_argument('--version', action='version', version='%(prog)s ' + __version__,
@@ -79,15 +317,57 @@ def run():
     if args.accounts:
         args.non_public = True
     
+    from distami import backends
+    from distami.accounts import Account, AccountPool
+    from distami.core import Distami, Logging, share_sources
+    from distami.fanout import CopyTimes, parse_affinity, plan_relays
+    from distami.metrics import InstrumentedBackend, StatsdSink, get_metrics
+    from distami.permissions import distribution_plans
+    from distami.pipeline import Pipeline
+    from distami.progress import get_progress
+    
     Logging().configure(args.verbose)
 
     log.debug("CLI parse args: %s", args)
+    
+    # Time every EC2 call, if the timings are going anywhere
+    metrics = get_metrics()
+    if args.statsd:
+        host, _, port = args.statsd.partition(':')
+        if port and not port.isdigit():
+            parser.error('--statsd must be HOST or HOST:PORT')
+        metrics.sinks.append(StatsdSink(host or 'localhost', int(port or 8125)))
+    instrumented = bool(args.metrics or args.prometheus or args.statsd)
+    if instrumented:
+        backends.set_backend(InstrumentedBackend(backends.get_backend(), metrics))
+
+    if args.serve:
+        serve(args, metrics)
+    
+    ami_ids = list(args.ami_ids)
+    if args.manifest:
+        try:
+            ami_ids.extend(read_manifest(args.manifest))
+        except DistamiException as e:
+            _fail(e.message)
+    ami_ids = unique(ami_ids)
+    if not ami_ids and not args.prune:
+        parser.error('at least one AMI_ID or a --manifest is required')
+    if args.prune and args.keep_last is None and args.keep_days is None:
+        parser.error('--prune needs --keep-last or --keep-days')
+    if args.keep_last is not None and args.keep_last < 1:
+        parser.error('--keep-last must be at least 1')
+
+    try:
+        settings = config.load_config()
+    except DistamiException as e:
+        _fail(e.message)
 
-    if args.region:
-        ami_region = args.region
-    else:
+    ami_region = args.region or config.get_default_region(settings)
+    if not ami_region:
         # If no region was specified, assume this is running on an EC2 instance
         # and work out what region it is in
+        from boto.utils import get_instance_metadata
         log.debug("Figure out which region I am running in...")
         instance_metadata = get_instance_metadata(timeout=5)
         log.debug('Instance meta-data: %s', instance_metadata)
@@ -98,41 +378,66 @@ def run():
         log.debug("Running in region: %s", ami_region)
 
     try:
-        distami = Distami(args.ami_id, ami_region)
-        if not args.non_public:
-            distami.make_ami_public()
-            distami.make_snapshot_public()
-        if args.accounts:
-            account_ids = args.accounts.split(',')
-            distami.share_ami_with_accounts(account_ids)
-            distami.share_snapshot_with_accounts(account_ids)
+        if args.prune:
+            prune(args, ami_region, settings)
+            sys.exit(0)
         
-        if args.to and args.to == 'none':
-            to_regions = []
-        elif args.to and args.to != 'all':
-            # TODO It is probably worth sanity checking this for typos
-            to_regions = args.to.split(',')
-        else:
-            to_regions = utils.get_regions_to_copy_to(ami_region)
+        journal = Journal(args.journal)
+        if args.resume:
+            journal.load()
+        
+        extra_tags = parse_tags(args.tags)
+        accounts = [Account.parse(spec) for spec in config.split_list(args.to_accounts)]
+        distamis = [Distami(ami_id, ami_region, poll_policy(args), extra_tags=extra_tags) for ami_id in ami_ids]
+        
+        # An AMI is already in its own region, so there is nothing to copy there
+        to_regions = unique(regions_to_copy_to(args, ami_region, settings))
+        if ami_region in to_regions:
+            log.info('Not copying to %s, the AMIs are already there', ami_region)
+            to_regions.remove(ami_region)
+        
+        # Work out the permissions once, then make only the changes each AMI
+        # and snapshot needs. The accounts copied into need the source AMIs
+        # shared with them, but their copies are shared like any other
+        source_plan, copy_plan = distribution_plans(args.non_public, parse_accounts(args.accounts), bool(to_regions or accounts),
+                                                    [account.account_id for account in accounts])
+        share_sources(distamis, source_plan, args.concurrency)
         
+        tasks = [(distami, region) for distami in distamis for region in to_regions]
+        if accounts:
+            # Each account has its own credentials and connections, shared by
+            # all its copies, which run alongside the rest
+            backend_for = lambda account: InstrumentedBackend(account.backend(), metrics) if instrumented else account.backend()
+            tasks.extend(copy_into_accounts(distamis, AccountPool(accounts, backend_for), [ami_region] + to_regions))
+        if not args.no_reuse:
+            reuse_existing_copies(tasks, journal)
+        
+        # Every copy is timed, so that later runs can plan relays from how
+        # long copies between each pair of regions really take
+        copy_times = CopyTimes(os.path.join(config.get_distami_dir(), 'copy_times.json'), parse_affinity(settings.get('affinity')))
+        copy_times.load()
+        relays = plan_relays(ami_region, to_regions, copy_times) if args.relay else None
+        for region, parent in sorted((relays or {}).items()):
+            log.info('Relaying the copies to %s through %s', region, parent)
+        
+        # Start every copy up front, then tag and share each one as soon as it lands
         if args.parallel:
-            # Get input to copy function 
-            param_array = zip([distami] * len(to_regions), to_regions, [args] * len(to_regions))
-            log.debug(param_array)
-
-            # Copy to regions in parallel
             log.info('Copying in parallel. Hold on to your hat...')
-            pool = Pool(processes=len(to_regions))
-            pool.map(copy, param_array)
-            pool.close()
-            pool.join()
-        else:
-            # Copy to regions one at a time
-            for region in to_regions:
-                copy([distami, region, args])
+        workers = max(1, len(set((distami.account_id, region) for distami, region in tasks))) if args.parallel else 1
+        progress = get_progress(args.progress)
+        pipeline = Pipeline(journal, lambda distami, copied_ami_id, region: distami.share_copy(copied_ami_id, region, copy_plan),
+                            poll_policy(args), args.concurrency, args.per_region, workers, progress=progress,
+                            copy_times=copy_times)
+        results = pipeline.run(tasks, relays)
+        if progress:
+            progress.close()
+        save_copy_times(copy_times)
+        report(results)
         
     except DistamiException as e:
         _fail(e.message)
+    finally:
+        export_metrics(metrics, args)
     
     log.info('AMI successfully distributed!')
     sys.exit(0)
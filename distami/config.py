@@ -0,0 +1,100 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import fnmatch
+import logging
+import os
+
+from ConfigParser import RawConfigParser, Error as ConfigError
+
+from distami.exceptions import *
+
+__all__ = ('get_distami_dir', 'load_config', 'get_default_region', 'partition_of', 'filter_regions')
+log = logging.getLogger(__name__)
+
+# Only the standard library is imported here, so the command line can read its
+# settings without paying for boto
+
+# The partitions of AWS, by region name prefix. Regions in other partitions
+# need separate accounts, so AMIs cannot be copied between them
+PARTITIONS = (
+    ('cn-', 'aws-cn'),
+    ('us-gov-', 'aws-us-gov'),
+    ('us-iso-', 'aws-iso'),
+    ('us-isob-', 'aws-iso-b'),
+)
+DEFAULT_PARTITION = 'aws'
+
+# Seconds the list of regions is cached for
+REGION_CACHE_TTL = 24 * 60 * 60
+
+
+def get_distami_dir():
+    ''' The directory DistAMI keeps its state in: $DISTAMI_HOME, or ~/.distami '''
+    
+    return os.environ.get('DISTAMI_HOME') or os.path.expanduser('~/.distami')
+
+
+def load_config(path=None):
+    ''' Reads the [distami] section of the config file, ~/.distami/config by
+    default, into a dict. A missing file is the same as an empty one. E.g.
+
+        [distami]
+        region = us-east-1
+        partitions = aws
+        exclude = ap-*, sa-east-1
+        region_cache_ttl = 86400
+        affinity = us-*, ca-*; eu-*
+    '''
+    
+    path = path or os.path.join(get_distami_dir(), 'config')
+    parser = RawConfigParser()
+    try:
+        parser.read(path)
+    except ConfigError as e:
+        raise DistamiException("Could not read config '%s': %s" % (path, e))
+    if not parser.has_section('distami'):
+        return {}
+    return dict(parser.items('distami'))
+
+
+def split_list(value):
+    ''' The items of a comma-separated setting '''
+    
+    return [item.strip() for item in (value or '').split(',') if item.strip()]
+
+
+def get_default_region(config):
+    ''' The region to use when none was given on the command line, from
+    $AWS_DEFAULT_REGION, $AWS_REGION or the config file, or None '''
+    
+    return os.environ.get('AWS_DEFAULT_REGION') or os.environ.get('AWS_REGION') or config.get('region') or None
+
+
+def partition_of(region):
+    ''' The AWS partition a region is in, e.g. aws-cn for cn-north-1 '''
+    
+    for prefix, partition in PARTITIONS:
+        if region.startswith(prefix):
+            return partition
+    return DEFAULT_PARTITION
+
+
+def filter_regions(regions, partitions, exclude=None):
+    ''' The regions in any of the given partitions that do not match any of the
+    exclude patterns, such as ap-* '''
+    
+    return [region for region in regions
+            if partition_of(region) in partitions
+            and not any(fnmatch.fnmatch(region, pattern) for pattern in exclude or [])]
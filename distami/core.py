@@ -12,144 +12,351 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
+import copy
 import logging
 import boto
 
-from boto import ec2
-
 from distami.exceptions import * 
 from distami import utils 
+from distami import permissions
+from distami.engine import ThreadPool
+from distami.index import SOURCE_AMI_TAG, SOURCE_REGION_TAG
+from distami.permissions import PermissionPlan
+from distami.polling import retry_copy, retry_throttled
+from distami.registry import get_registry
+from distami.waiter import ebs_snapshot_ids
 
-__all__ = ('Distami', 'Logging')
+__all__ = ('Distami', 'Logging', 'share_sources')
 log = logging.getLogger(__name__)
 
 
 class Distami(object):
-    def __init__(self, ami_id, ami_region):
+    def __init__(self, ami_id, ami_region, poll_policy=None, registry=None, extra_tags=None):
         self._ami_id = ami_id
         self._ami_region = ami_region
+        self._poll_policy = poll_policy
+        self._extra_tags = dict(extra_tags or {})
+        self._account_id = None
+        self._registry = registry or get_registry()
         
         log.info("Looking for AMI %s in region %s", self._ami_id, self._ami_region)
         try:
-            self._conn = ec2.connect_to_region(self._ami_region)
+            self._conn = self._registry.connection(self._ami_region)
         except boto.exception.NoAuthHandlerFound:
             log.error('Could not connect to region %s' % self._ami_region)
             log.critical('No AWS credentials found. To configure Boto, please read: http://boto.readthedocs.org/en/latest/boto_config_tut.html')
             raise DistamiException('No AWS credentials found.')            
-        self._image = utils.wait_for_ami_to_be_available(self._conn, self._ami_id)
+        self._load()
+        log.info("Found AMI %s with snapshots %s", self._ami_id, ', '.join(self._snapshot_ids.values()))
+
+    
+    @property
+    def ami_id(self):
+        return self._ami_id
+    
+    
+    @property
+    def region(self):
+        return self._ami_region
+    
+    
+    @property
+    def registry(self):
+        return self._registry
+    
+    
+    @property
+    def account_id(self):
+        ''' The other AWS account this copies into, or None for the account
+        that owns the AMI '''
+        
+        return self._account_id
+    
+    
+    @property
+    def image(self):
+        return self._image
+    
+    
+    @property
+    def copy_tags(self):
+        ''' The tags every copy of this AMI and its snapshots get on top of the
+        source tags: the lineage tags that record where the copy came from,
+        and any extra tags '''
+        
+        tags = {SOURCE_AMI_TAG: self._ami_id, SOURCE_REGION_TAG: self._ami_region}
+        tags.update(self._extra_tags)
+        return tags
+    
+    
+    def _load(self):
+        ''' Looks up the image, its launch permissions and its snapshot IDs '''
+        
+        self._image = self._registry.image(self._ami_region, self._ami_id)
+        if self._image.state != 'available':
+            self._image = utils.wait_for_ami_to_be_available(self._conn, self._ami_id, self._poll_policy)
+            self._registry.store_image(self._image)
         log.debug('AMI details: %s', vars(self._image))
         
         # Get current launch permissions
-        self._launch_perms = self._image.get_launch_permissions()
+        self._launch_perms = self._registry.launch_permissions(self._ami_region, self._ami_id)
         log.debug("Current launch permissions: %s", self._launch_perms)
         
-        # Figure out the underlying snapshot
-        ami = utils.get_ami(self._conn, self._ami_id)
-        bdm = self._image.block_device_mapping[ami.root_device_name]
-        log.debug('Block device mapping for %s: %s', ami.root_device_name, vars(bdm))
+        # Figure out the underlying snapshots, of the root device and of any
+        # data volumes
+        bdm = self._image.block_device_mapping[self._image.root_device_name]
+        log.debug('Block device mapping for %s: %s', self._image.root_device_name, vars(bdm))
         self._snapshot_id = bdm.snapshot_id
-
-        log.info("Found AMI %s with snapshot %s", self._ami_id, self._snapshot_id)
+        self._snapshot_ids = collections.OrderedDict(ebs_snapshot_ids(self._image))
+        
+        # The snapshots themselves are only looked up when first needed
+        self._snapshots = None
+    
+    
+    def refresh(self):
+        ''' Looks up the image, launch permissions and snapshot again, in case
+        they were changed by something other than this instance '''
+        
+        self._registry.invalidate(self._ami_region, self._ami_id)
+        for snapshot_id in self._snapshot_ids.values():
+            self._registry.invalidate(self._ami_region, snapshot_id)
+        self._load()
+    
+    
+    @property
+    def snapshot(self):
+        ''' The root device snapshot of the AMI, looked up once '''
+        
+        return self.snapshots[self._snapshot_id]
+    
+    
+    @property
+    def snapshot_ids(self):
+        ''' The snapshot ID of each EBS volume of the AMI, by device name '''
+        
+        return self._snapshot_ids
+    
+    
+    @property
+    def snapshots(self):
+        ''' Every EBS snapshot of the AMI by ID, all looked up once in one call '''
+        
+        if self._snapshots is None:
+            snapshot_ids = list(self._snapshot_ids.values())
+            snapshots = self._registry.snapshots(self._ami_region, snapshot_ids)
+            self._snapshots = dict(zip(snapshot_ids, snapshots))
+            log.debug('Snapshot details: %s', [vars(snapshot) for snapshot in snapshots])
+        return self._snapshots
 
     
     def make_ami_public(self):
         ''' Adds the 'all' group permission to the AMI, making it publicly accessible '''
         
         log.info('Making AMI %s public', self._ami_id)
-
-        if 'groups' in self._launch_perms and any("all" in groups for groups in self._launch_perms['groups']):
-            log.debug('AMI already public, nothing to do')
-            return True
-        
-        res = self._image.set_launch_permissions(group_names='all')
-        self._launch_perms = self._image.get_launch_permissions()
-        return res
+        return self.apply_launch_permissions(PermissionPlan(public=True))
     
     
     def make_ami_non_public(self):
         ''' Removes the 'all' group permission from the AMI '''
 
         log.info('Making AMI %s non-public', self._ami_id)
-
-        if 'groups' in self._launch_perms and any("all" in groups for groups in self._launch_perms['groups']):
-            res = self._image.remove_launch_permissions(group_names='all')
-            self._launch_perms = self._image.get_launch_permissions()
-            return res
-        
-        log.debug('AMI is already not public')
-        return True
+        return self.apply_launch_permissions(PermissionPlan(public=False))
     
     def share_ami_with_accounts(self, account_ids):
         ''' Shares an AMI with the supplied list of AWS Account IDs '''
         
         log.info('Sharing AMI %s with AWS Accounts %s', self._ami_id, account_ids)
-
-        res = self._image.set_launch_permissions(user_ids=account_ids)
-        self._launch_perms = self._image.get_launch_permissions()
-        return res
+        return self.apply_launch_permissions(PermissionPlan(account_ids=account_ids))
+    
+    def apply_launch_permissions(self, plan):
+        ''' Makes only the launch permission changes the AMI needs to match a
+        PermissionPlan. What the permissions will be afterwards is known, so
+        they are cached rather than read back '''
+        
+        if not plan.changes(self._launch_perms):
+            log.debug('Launch permissions of %s already match %s, nothing to do', self._ami_id, plan)
+            return True
+        
+        self._launch_perms = permissions.apply_image_permissions(self._conn, self._ami_id, plan, self._launch_perms)
+        self._registry.store(self._ami_region, 'launch_permissions', self._ami_id, self._launch_perms)
+        return True
        
     def make_snapshot_public(self):
-        ''' Makes a snapshot public '''
+        ''' Makes the snapshots public '''
         
-        snapshot = utils.get_snapshot(self._conn, self._snapshot_id)
-        log.debug('Snapshot details: %s', vars(snapshot))
-
-        log.info('Making snapshot %s public', self._snapshot_id)
-        return snapshot.share(groups=['all'])
+        log.info('Making snapshots %s public', ', '.join(self._snapshot_ids.values()))
+        return self.apply_snapshot_permissions(PermissionPlan(public=True))
     
     
     def make_snapshot_non_public(self):
-        ''' Removes the 'all' group permission from the snapshot '''
+        ''' Removes the 'all' group permission from the snapshots '''
         
-        snapshot = utils.get_snapshot(self._conn, self._snapshot_id)
-        log.debug('Snapshot details: %s', vars(snapshot))
-        
-        log.info('Making snapshot %s non-public', self._snapshot_id)
-        return snapshot.unshare(groups=['all'])
+        log.info('Making snapshots %s non-public', ', '.join(self._snapshot_ids.values()))
+        return self.apply_snapshot_permissions(PermissionPlan(public=False))
 
 
     def share_snapshot_with_accounts(self, account_ids):
-        ''' Shares a snapshot with the supplied list of AWS Account IDs '''
+        ''' Shares the snapshots with the supplied list of AWS Account IDs '''
         
-        snapshot = utils.get_snapshot(self._conn, self._snapshot_id)
-        log.debug('Snapshot details: %s', vars(snapshot))
-
-        log.info('Sharing snapshot %s with AWS Accounts %s', self._snapshot_id, account_ids)
-        return snapshot.share(user_ids=account_ids)
+        log.info('Sharing snapshots %s with AWS Accounts %s', ', '.join(self._snapshot_ids.values()), account_ids)
+        return self.apply_snapshot_permissions(PermissionPlan(account_ids=account_ids))
     
     
-    def copy_to_region(self, region):
-        ''' Copies this AMI to another region '''
+    def apply_snapshot_permissions(self, plan):
+        ''' Changes who can create volumes from each snapshot to match a
+        PermissionPlan. Only the snapshot IDs are needed, so the snapshots and
+        their current permissions are not looked up first. EC2 only takes one
+        snapshot per ModifySnapshotAttribute call '''
         
-        dest_conn = ec2.connect_to_region(region)
-        log.info('Copying AMI to %s', region)
-        cp_ami = dest_conn.copy_image(self._ami_region, self._ami_id, self._image.name, self._image.description)
-        copied_ami_id = cp_ami.image_id
+        for snapshot_id in self._snapshot_ids.values():
+            permissions.apply_snapshot_permissions(self._conn, snapshot_id, plan)
+        return True
+    
+    
+    def apply_permissions(self, plan):
+        ''' Applies a PermissionPlan to both the AMI and its snapshot '''
         
-        # Wait for AMI to finish copying before returning
-        copied_image = utils.wait_for_ami_to_be_available(dest_conn, copied_ami_id)
+        log.info('Applying %s to AMI %s and snapshots %s', plan, self._ami_id, ', '.join(self._snapshot_ids.values()))
+        self.apply_launch_permissions(plan)
+        self.apply_snapshot_permissions(plan)
+    
+    
+    def share_copy(self, copied_ami_id, region, plan):
+        ''' Applies a PermissionPlan to a copy of this AMI in another region '''
         
-        # Copy AMI tags to new AMI
-        log.info('Copying tags to %s in %s', copied_ami_id, region)
-        if self._image.tags:
-            dest_conn.create_tags(copied_ami_id, self._image.tags)
-        else:
-            log.info('AMI tags empty, nothing to copy')
+        Distami(copied_ami_id, region, registry=self._registry).apply_permissions(plan)
+    
+    
+    def in_account(self, account_id, registry):
+        ''' This AMI, copying into another AWS account through a registry with
+        that account's credentials. The AMI and its snapshots must be shared
+        with the account first. Their details are the ones looked up here,
+        since only the owner can read all of them '''
         
-        # Also copy snapshot tags to new snapshot
-        ami = utils.get_ami(self._conn, self._ami_id)
-        copied_snapshot_id = copied_image.block_device_mapping[ami.root_device_name].snapshot_id
-        snapshot = utils.get_snapshot(self._conn, self._snapshot_id)
-        log.info('Copying tags to %s in %s', copied_snapshot_id, region)
-
-        if snapshot.tags:
-            dest_conn.create_tags(copied_snapshot_id, snapshot.tags)
+        other = copy.copy(self)
+        other._snapshots = self.snapshots
+        other._account_id = account_id
+        other._registry = registry
+        return other
+    
+    
+    def start_copy_to_region(self, region, copy_from=None, retry=retry_copy):
+        ''' Starts copying this AMI to another region without waiting for the copy to finish.
+        copy_from is the (region, AMI ID) of an available copy to copy instead
+        of this AMI, to relay it through a nearer region. CopyImage is called
+        through retry, which by default waits out the region's copy limit.
+        Returns the connection to the destination region and the ID of the copied AMI '''
+        
+        dest_conn = self._registry.connection(region)
+        from_region, from_ami_id = copy_from or (self._ami_region, self._ami_id)
+        if copy_from:
+            log.info('Copying AMI to %s from its copy %s in %s', region, from_ami_id, from_region)
         else:
-            log.info('Snapshot tags empty, nothing to copy')
+            log.info('Copying AMI to %s', region)
+        cp_ami = retry(dest_conn.copy_image, from_region, from_ami_id, self._image.name, self._image.description)
+        return dest_conn, cp_ami.image_id
+    
+    
+    def finish_copy_to_region(self, copied_image):
+        ''' Copies the AMI and snapshot tags, along with the lineage and extra
+        tags, to a copy of this AMI that is now available '''
+        
+        region = copied_image.region.name
+        dest_conn = self._registry.connection(region)
+        copied_ami_id = copied_image.id
+        copy_tags = self.copy_tags
+        
+        # Each snapshot of the copy gets the tags of the snapshot of the same
+        # device here, and every one gets the lineage and extra tags. The
+        # source tags were read when this AMI was loaded, so this makes no
+        # Describe calls, and resources that end up with the same tags are
+        # tagged in one call
+        ami_tags = merge_tags(self._image.tags, copy_tags)
+        to_tag = [(copied_ami_id, ami_tags)]
+        copied_bdm = copied_image.block_device_mapping
+        for device, snapshot_id in self._snapshot_ids.items():
+            if device not in copied_bdm or not copied_bdm[device].snapshot_id:
+                log.warning('%s in %s has no snapshot for %s, so its tags are not copied', copied_ami_id, region, device)
+                continue
+            snapshot_tags = self.snapshots[snapshot_id].tags
+            to_tag.append((copied_bdm[device].snapshot_id, merge_tags(snapshot_tags, copy_tags)))
+        
+        for tags, resource_ids in group_by_tags(to_tag):
+            log.info('Copying tags to %s in %s', ', '.join(resource_ids), region)
+            retry_throttled(dest_conn.create_tags, resource_ids, tags)
+        
+        # Keep the copy, with its new tags, for whoever sets its permissions next
+        copied_image.tags.update(ami_tags)
+        self._registry.store_image(copied_image)
 
         log.info('Copy to %s complete', region)
         return copied_ami_id
+    
+    
+    def copy_is_tagged(self, copied_image):
+        ''' Whether a copy of this AMI already has every tag that
+        finish_copy_to_region would give it '''
+        
+        tags = copied_image.tags or {}
+        expected = merge_tags(self._image.tags, self.copy_tags)
+        return all(tags.get(key) == value for key, value in expected.items())
+    
+    
+    def get_copy(self, region, copied_ami_id):
+        ''' Looks up a copy of this AMI in another region '''
+        
+        return self._registry.image(region, copied_ami_id)
+    
+    
+    def wait_for_copy(self, region, copied_ami_id):
+        ''' Blocks until a copy of this AMI is available, and returns it '''
+        
+        dest_conn = self._registry.connection(region)
+        return utils.wait_for_ami_to_be_available(dest_conn, copied_ami_id, self._poll_policy)
+    
+    
+    def copy_to_region(self, region):
+        ''' Copies this AMI to another region '''
+        
+        dest_conn, copied_ami_id = self.start_copy_to_region(region)
+        
+        # Wait for AMI to finish copying before returning
+        copied_image = self.wait_for_copy(region, copied_ami_id)
+        return self.finish_copy_to_region(copied_image)
+
+
+
+def merge_tags(tags, extra_tags):
+    ''' The tags of a resource with the extra tags added, the extra tags
+    winning where both have the same key '''
+    
+    merged = dict(tags or {})
+    merged.update(extra_tags)
+    return merged
+
 
+def share_sources(distamis, plan, concurrency=None):
+    ''' Applies a PermissionPlan to every source AMI at once '''
+    
+    by_id = dict((distami.ami_id, distami) for distami in distamis)
+    tasks = [(distami.ami_id, distami.region) for distami in distamis]
+    results = ThreadPool(concurrency).run(lambda ami_id, region: by_id[ami_id].apply_permissions(plan), tasks)
+    
+    failed = ['%s: %s' % (result.source_ami_id, result.error) for result in results if not result.succeeded]
+    if failed:
+        raise DistamiException('Could not set permissions on %s' % ', '.join(failed))
+
+
+def group_by_tags(resources):
+    ''' Groups (resource ID, tags) pairs into (tags, resource IDs) pairs, one
+    for each different set of tags, leaving out resources with no tags '''
+    
+    groups = collections.OrderedDict()
+    for resource_id, tags in resources:
+        if tags:
+            groups.setdefault(tuple(sorted(tags.items())), []).append(resource_id)
+    return [(dict(tags), resource_ids) for tags, resource_ids in groups.items()]
 
 
 class Logging(object):
@@ -0,0 +1,111 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import threading
+import time
+
+from Queue import Queue, Empty
+
+__all__ = ('CopyResult', 'ThreadPool', 'run_in_threads')
+log = logging.getLogger(__name__)
+
+
+class CopyResult(object):
+    ''' The outcome of copying an AMI to a single region '''
+
+    def __init__(self, region, source_ami_id=None, account_id=None):
+        self.region = region
+        self.source_ami_id = source_ami_id
+        self.account_id = account_id
+        self.copied_from = None
+        self.ami_id = None
+        self.started = None
+        self.finished = None
+        self.error = None
+
+    def __repr__(self):
+        if self.succeeded:
+            return '<CopyResult %s: %s in %.0fs>' % (self.region, self.ami_id, self.duration)
+        return '<CopyResult %s: %r>' % (self.region, self.error)
+
+    @property
+    def succeeded(self):
+        return self.finished is not None and self.error is None
+
+    @property
+    def duration(self):
+        ''' Seconds the copy took, or None if it has not finished '''
+
+        if self.started is None or self.finished is None:
+            return None
+        return self.finished - self.started
+
+
+class ThreadPool(object):
+    ''' Calls a function for many (source AMI ID, region) tasks on a pool of
+    at most concurrency worker threads, one per task by default '''
+
+    def __init__(self, concurrency=None):
+        self._concurrency = concurrency
+
+    def run(self, func, tasks):
+        ''' Calls func(source_ami_id, region) for every (source_ami_id, region)
+        task and returns a CopyResult per task in the same order, with what
+        func returned as its ami_id. Any exception func raises is recorded on
+        the result rather than stopping the other tasks '''
+
+        results = [CopyResult(region, source_ami_id) for source_ami_id, region in tasks]
+        if not results:
+            return results
+
+        pending = Queue()
+        for result in results:
+            pending.put(result)
+
+        def worker():
+            while True:
+                try:
+                    result = pending.get_nowait()
+                except Empty:
+                    return
+                result.started = time.time()
+                try:
+                    result.ami_id = func(result.source_ami_id, result.region)
+                except Exception as e:
+                    log.debug('%s in %s failed', result.source_ami_id, result.region, exc_info=True)
+                    result.error = e
+                result.finished = time.time()
+
+        threads = []
+        for _ in range(min(self._concurrency or len(results), len(results))):
+            thread = threading.Thread(target=worker)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        # Join with a timeout so Ctrl-C still reaches the main thread
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(1)
+
+        return results
+
+
+def run_in_threads(func, regions, concurrency=None):
+    ''' Calls func(region) for every region on a pool of at most concurrency
+    worker threads, and returns a CopyResult per region in the same order '''
+
+    tasks = [(None, region) for region in regions]
+    return ThreadPool(concurrency).run(lambda source_ami_id, region: func(region), tasks)
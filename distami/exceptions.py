@@ -15,3 +15,12 @@
 class DistamiException(Exception):
     ''' Base Distami Exception '''
     pass
+
+
+class AmiNotFoundException(DistamiException):
+    ''' An AMI could not be found in a region '''
+    
+    def __init__(self, ami_id, region):
+        DistamiException.__init__(self, "Could not find AMI '%s' in region '%s'" % (ami_id, region))
+        self.ami_id = ami_id
+        self.region = region
@@ -0,0 +1,156 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import errno
+import fnmatch
+import json
+import logging
+import os
+import re
+import threading
+
+from distami.exceptions import *
+
+__all__ = ('CopyTimes', 'plan_relays', 'parse_affinity')
+log = logging.getLogger(__name__)
+
+# Rough seconds a copy takes between regions that have never been measured:
+# within a group of nearby regions, within a continent, and further
+NEAR_COPY_SECONDS = 300
+CONTINENT_COPY_SECONDS = 900
+FAR_COPY_SECONDS = 1800
+
+# The extra seconds a relayed copy takes, for noticing its source is
+# available and starting it, so a relay has to be clearly faster to be used
+RELAY_OVERHEAD = 60
+
+
+def parse_affinity(value):
+    ''' Groups of nearby regions from a setting such as
+    "us-*, ca-*; eu-*; ap-southeast-*", as lists of region patterns '''
+
+    return [[pattern.strip() for pattern in group.split(',') if pattern.strip()]
+            for group in (value or '').split(';') if group.strip()]
+
+
+class CopyTimes(object):
+    ''' How long copies from one region to another take, as measured on past
+    runs and kept in a JSON file, if a path is given. Pairs never measured
+    are estimated from how near the regions are: regions matching the same
+    group of patterns in affinity are near, and otherwise regions are near
+    if their names differ only in the number, e.g. ap-southeast-1 and
+    ap-southeast-2. Each new measurement is blended with the old ones, giving
+    it a weight of smoothing '''
+
+    def __init__(self, path=None, affinity=None, smoothing=0.3):
+        self._path = path
+        self._affinity = affinity or []
+        self._smoothing = smoothing
+        self._lock = threading.Lock()
+        self._times = {}
+
+    def load(self):
+        ''' Reads the times measured by earlier runs '''
+
+        if not self._path:
+            return
+        try:
+            with open(self._path) as fh:
+                times = json.load(fh)
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                return
+            raise DistamiException("Could not read copy times '%s': %s" % (self._path, e.strerror))
+        except ValueError:
+            log.warning('Ignoring corrupt copy times %s', self._path)
+            return
+        with self._lock:
+            for key, seconds in times.items():
+                from_region, _, to_region = key.partition(' ')
+                self._times[(from_region, to_region)] = seconds
+
+    def save(self):
+        ''' Writes the measured times, replacing the file in one go '''
+
+        if not self._path:
+            return
+        with self._lock:
+            times = dict(('%s %s' % key, seconds) for key, seconds in self._times.items())
+        directory = os.path.dirname(self._path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(self._path + '.tmp', 'w') as fh:
+            json.dump(times, fh, indent=2, sort_keys=True)
+        os.rename(self._path + '.tmp', self._path)
+
+    def record(self, from_region, to_region, seconds):
+        ''' Takes in how long a copy took '''
+
+        with self._lock:
+            old = self._times.get((from_region, to_region))
+            self._times[(from_region, to_region)] = seconds if old is None else \
+                old + self._smoothing * (seconds - old)
+
+    def measured(self, from_region, to_region):
+        ''' The measured seconds a copy takes, or None if it never has been '''
+
+        with self._lock:
+            return self._times.get((from_region, to_region))
+
+    def estimate(self, from_region, to_region):
+        ''' The seconds a copy is expected to take, measured or not '''
+
+        seconds = self.measured(from_region, to_region)
+        if seconds is not None:
+            return seconds
+        if self._group(from_region) == self._group(to_region):
+            return NEAR_COPY_SECONDS
+        if from_region.split('-')[0] == to_region.split('-')[0]:
+            return CONTINENT_COPY_SECONDS
+        return FAR_COPY_SECONDS
+
+    def _group(self, region):
+        for number, patterns in enumerate(self._affinity):
+            if any(fnmatch.fnmatch(region, pattern) for pattern in patterns):
+                return number
+        return re.sub(r'-\d+$', '', region)
+
+
+def plan_relays(source_region, regions, times, overhead=RELAY_OVERHEAD):
+    ''' Plans a tree of copies from the source region to every region, in
+    which a region copies from a nearer region's copy, once that is available,
+    when that is expected to finish sooner than copying from the source.
+    Returns the region each relayed region copies from; every other region
+    copies from the source. Regions are placed in the order they are expected
+    to finish, each under whichever placed region gets it there soonest '''
+
+    finish = {source_region: 0}
+    relays = {}
+    remaining = set(regions) - set([source_region])
+    while remaining:
+        best = None
+        for region in sorted(remaining):
+            for parent, parent_finish in sorted(finish.items()):
+                expected = parent_finish + times.estimate(parent, region)
+                if parent != source_region:
+                    expected += overhead
+                if best is None or expected < best[0]:
+                    best = (expected, region, parent)
+        expected, region, parent = best
+        finish[region] = expected
+        if parent != source_region:
+            log.debug('Relaying the copy to %s through %s, expected to finish after %.0f seconds', region, parent, expected)
+            relays[region] = parent
+        remaining.remove(region)
+    return relays
@@ -0,0 +1,82 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+
+from distami.engine import run_in_threads
+from distami.polling import retry_throttled
+
+__all__ = ('CopyIndex', 'SOURCE_AMI_TAG', 'SOURCE_REGION_TAG')
+log = logging.getLogger(__name__)
+
+# Tags recording which AMI a copy was made from
+SOURCE_AMI_TAG = 'distami:source-ami'
+SOURCE_REGION_TAG = 'distami:source-region'
+
+
+class CopyIndex(object):
+    ''' Finds copies of the source AMIs that already exist in the destination
+    regions, using one DescribeImages call per region '''
+
+    def __init__(self, sources):
+        self._sources = dict((distami.ami_id, distami) for distami in sources)
+        self._registry = sources[0].registry if sources else None
+        self._copies = {}
+
+    def build(self, regions):
+        ''' Indexes the AMIs this account owns in every region, in parallel '''
+
+        if not self._sources:
+            return
+        for result in run_in_threads(self.index_region, regions):
+            if not result.succeeded:
+                log.warning('Could not look for existing copies in %s: %s', result.region, result.error)
+
+    def index_region(self, region):
+        ''' Indexes the AMIs this account owns in one region, that have the
+        same name as any of the source AMIs '''
+
+        names = sorted(set(distami.image.name for distami in self._sources.values() if distami.image.name))
+        if not names:
+            return
+        conn = self._registry.connection(region)
+        images = retry_throttled(conn.get_all_images, owners=['self'], filters={'name': names})
+
+        for image in images:
+            source = self.source_of(image)
+            if source is None or image.state == 'failed':
+                continue
+            log.debug('Found %s in %s, a copy of %s', image.id, region, source.ami_id)
+            self._registry.store_image(image)
+            # Prefer a copy that is already available over one still in progress
+            existing = self._copies.get((source.ami_id, region))
+            if existing is None or existing.state != 'available':
+                self._copies[(source.ami_id, region)] = image
+
+    def source_of(self, image):
+        ''' The source AMI an image is a copy of, or None if it is not one '''
+
+        tags = image.tags or {}
+        if SOURCE_AMI_TAG in tags:
+            return self._sources.get(tags[SOURCE_AMI_TAG])
+        for distami in self._sources.values():
+            if image.id != distami.ami_id and image.name == distami.image.name \
+                    and image.description == distami.image.description:
+                return distami
+        return None
+
+    def find(self, source_ami_id, region):
+        ''' The existing copy of a source AMI in a region, or None '''
+
+        return self._copies.get((source_ami_id, region))
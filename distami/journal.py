@@ -0,0 +1,90 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import errno
+import json
+import logging
+import os
+import threading
+import time
+
+from distami.exceptions import *
+
+__all__ = ('Journal', )
+log = logging.getLogger(__name__)
+
+
+class Journal(object):
+    ''' Records each step of every copy as a line of JSON, so that an
+    interrupted distribution can be resumed without copying again. Without a
+    path nothing is written to disk '''
+
+    # The steps of a copy, in order
+    STARTED = 'started'
+    AVAILABLE = 'available'
+    TAGGED = 'tagged'
+    SHARED = 'shared'
+    STEPS = (STARTED, AVAILABLE, TAGGED, SHARED)
+
+    def __init__(self, path=None):
+        self._path = path
+        self._lock = threading.Lock()
+        self._progress = {}
+
+    def load(self):
+        ''' Reads the steps recorded by earlier runs '''
+
+        if not self._path:
+            return
+        try:
+            with open(self._path) as fh:
+                lines = fh.readlines()
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                return
+            raise DistamiException("Could not read journal '%s': %s" % (self._path, e.strerror))
+
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # Most likely the last line of a run that was killed mid-write
+                log.debug('Skipping unreadable journal line: %r', line)
+                continue
+            self._progress[(entry['source'], entry['region'], entry.get('account'))] = (entry['step'], entry['ami_id'])
+        log.debug('Loaded %d copies from journal %s', len(self._progress), self._path)
+
+    def progress(self, source_ami_id, region, account_id=None):
+        ''' The last step recorded for a copy and the ID of the copied AMI, or
+        (None, None) if the copy was never started. Copies into other accounts
+        are told apart by their account_id '''
+
+        with self._lock:
+            return self._progress.get((source_ami_id, region, account_id), (None, None))
+
+    def record(self, source_ami_id, region, step, ami_id, account_id=None):
+        ''' Records that a copy has completed a step '''
+
+        entry = {'time': time.time(), 'source': source_ami_id, 'region': region, 'step': step, 'ami_id': ami_id}
+        if account_id:
+            entry['account'] = account_id
+        with self._lock:
+            self._progress[(source_ami_id, region, account_id)] = (step, ami_id)
+            if not self._path:
+                return
+            directory = os.path.dirname(self._path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            with open(self._path, 'a') as fh:
+                fh.write(json.dumps(entry, sort_keys=True) + '\n')
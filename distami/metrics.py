@@ -0,0 +1,237 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+from contextlib import contextmanager
+
+from distami.polling import COPY_LIMIT_ERROR_CODES, THROTTLING_ERROR_CODES
+
+__all__ = ('Metrics', 'InstrumentedBackend', 'StatsdSink', 'get_metrics')
+log = logging.getLogger(__name__)
+
+# The EC2 API operation behind each connection method DistAMI calls
+OPERATIONS = {
+    'get_all_images': 'DescribeImages',
+    'get_all_snapshots': 'DescribeSnapshots',
+    'get_image_attribute': 'DescribeImageAttribute',
+    'modify_image_attribute': 'ModifyImageAttribute',
+    'modify_snapshot_attribute': 'ModifySnapshotAttribute',
+    'copy_image': 'CopyImage',
+    'create_tags': 'CreateTags',
+    'deregister_image': 'DeregisterImage',
+    'delete_snapshot': 'DeleteSnapshot',
+}
+
+# Outcomes that the caller retries after backing off
+RETRIED_OUTCOMES = THROTTLING_ERROR_CODES + COPY_LIMIT_ERROR_CODES
+
+
+def outcome_of(e):
+    ''' How a failed call turned out: its EC2 error code, or the exception class '''
+
+    return getattr(e, 'error_code', None) or e.__class__.__name__
+
+
+class OperationStats(object):
+    ''' The latency and outcomes of one operation in one region '''
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.outcomes = {}
+
+    def add(self, seconds, outcome):
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+        self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+
+    @property
+    def retried(self):
+        return sum(self.outcomes.get(outcome, 0) for outcome in RETRIED_OUTCOMES)
+
+
+class Metrics(object):
+    ''' Records how long each operation took in each region and how it turned
+    out, for EC2 API calls as well as the stages of a distribution, and
+    exports them at the end of a run. Sinks such as a StatsdSink are sent each
+    measurement as it is recorded '''
+
+    def __init__(self, sinks=None, clock=time.time):
+        self.sinks = list(sinks or [])
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, region, operation, seconds, outcome='ok'):
+        with self._lock:
+            self._stats.setdefault((region, operation), OperationStats()).add(seconds, outcome)
+        for sink in self.sinks:
+            try:
+                sink.record(region, operation, seconds, outcome)
+            except Exception as e:
+                # Metrics must never break a distribution
+                log.debug('Could not send metrics to %r: %s', sink, e)
+
+    @contextmanager
+    def timed(self, region, operation):
+        ''' Records the time taken by the block, and whether it raised '''
+
+        start = self._clock()
+        try:
+            yield
+        except Exception as e:
+            self.record(region, operation, self._clock() - start, outcome_of(e))
+            raise
+        self.record(region, operation, self._clock() - start)
+
+    def stats(self, region, operation):
+        ''' The OperationStats of an operation in a region, or None '''
+
+        with self._lock:
+            return self._stats.get((region, operation))
+
+    def to_dict(self):
+        ''' Every measurement, summarised per region and operation '''
+
+        with self._lock:
+            items = sorted(self._stats.items())
+        operations = []
+        for (region, operation), stats in items:
+            operations.append({
+                'region': region,
+                'operation': operation,
+                'count': stats.count,
+                'seconds_total': round(stats.total, 6),
+                'seconds_min': round(stats.min, 6),
+                'seconds_max': round(stats.max, 6),
+                'retried': stats.retried,
+                'outcomes': dict(stats.outcomes),
+            })
+        return {'operations': operations}
+
+    def write_json(self, path):
+        with open(path, 'w') as fh:
+            json.dump(self.to_dict(), fh, indent=2, sort_keys=True)
+            fh.write('\n')
+
+    def write_prometheus(self, path):
+        ''' Writes the measurements in the Prometheus text format, for the node
+        exporter's textfile collector. The file is replaced in one step so the
+        collector never reads half of it '''
+
+        lines = [
+            '# HELP distami_operation_seconds Time spent in each operation.',
+            '# TYPE distami_operation_seconds summary',
+        ]
+        outcomes = [
+            '# HELP distami_operation_total Operations by outcome.',
+            '# TYPE distami_operation_total counter',
+        ]
+        for entry in self.to_dict()['operations']:
+            labels = 'region="%s",operation="%s"' % (entry['region'], entry['operation'])
+            lines.append('distami_operation_seconds_sum{%s} %f' % (labels, entry['seconds_total']))
+            lines.append('distami_operation_seconds_count{%s} %d' % (labels, entry['count']))
+            for outcome, count in sorted(entry['outcomes'].items()):
+                outcomes.append('distami_operation_total{%s,outcome="%s"} %d' % (labels, outcome, count))
+
+        with open(path + '.tmp', 'w') as fh:
+            fh.write('\n'.join(lines + outcomes) + '\n')
+        os.rename(path + '.tmp', path)
+
+
+class StatsdSink(object):
+    ''' Sends each measurement to StatsD over UDP as it is recorded, as a
+    timer and a counter per outcome under distami.<region>.<operation> '''
+
+    def __init__(self, host='localhost', port=8125, prefix='distami'):
+        self.address = (host, port)
+        self.prefix = prefix
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def __repr__(self):
+        return '<StatsdSink %s:%d>' % self.address
+
+    def record(self, region, operation, seconds, outcome):
+        name = '%s.%s.%s' % (self.prefix, region.replace('.', '_'), operation)
+        payload = '%s:%d|ms\n%s.%s:1|c' % (name, seconds * 1000, name, outcome.replace('.', '_'))
+        self._socket.sendto(payload, self.address)
+
+
+class InstrumentedConnection(object):
+    ''' Wraps an EC2 connection, timing every API call made through it '''
+
+    def __init__(self, conn, metrics):
+        self._conn = conn
+        self._metrics = metrics
+        self.region = conn.region
+
+    def __repr__(self):
+        return 'Instrumented%r' % (self._conn, )
+
+    def __getattr__(self, name):
+        attr = getattr(self._conn, name)
+        if name not in OPERATIONS:
+            return attr
+        region = self.region.name
+        metrics = self._metrics
+
+        def call(*args, **kwargs):
+            with metrics.timed(region, OPERATIONS[name]):
+                return attr(*args, **kwargs)
+        call.__name__ = name
+        return call
+
+
+class InstrumentedBackend(object):
+    ''' Wraps a backend so that connecting to a region and every API call made
+    through its connections are recorded in the metrics '''
+
+    def __init__(self, backend, metrics=None):
+        self.backend = backend
+        self.metrics = metrics or get_metrics()
+
+    def __repr__(self):
+        return '<InstrumentedBackend %r>' % (self.backend, )
+
+    def connect(self, region):
+        with self.metrics.timed(region, 'Connect'):
+            conn = self.backend.connect(region)
+        return InstrumentedConnection(conn, self.metrics) if conn is not None else None
+
+    def regions(self):
+        return self.backend.regions()
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics():
+    ''' Gets the metrics shared by the whole process '''
+
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = Metrics()
+        return _metrics
@@ -0,0 +1,105 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+
+from distami.polling import retry_throttled
+
+__all__ = ('PermissionPlan', 'distribution_plans', 'apply_image_permissions', 'apply_snapshot_permissions')
+log = logging.getLogger(__name__)
+
+# The most account IDs sent in one Modify*Attribute call
+MAX_ACCOUNTS_PER_CALL = 100
+
+
+class PermissionPlan(object):
+    ''' Who should be able to launch an AMI and create volumes from its
+    snapshots. public is True to add the 'all' group, False to remove it, or
+    None to leave it alone; account_ids are added to whatever is there '''
+
+    def __init__(self, public=None, account_ids=None):
+        self.public = public
+        self.account_ids = sorted(set(account_ids or []))
+
+    def __repr__(self):
+        return '<PermissionPlan public=%s accounts=%d>' % (self.public, len(self.account_ids))
+
+    def changes(self, current=None):
+        ''' The (operation, user_ids, groups) calls needed to get from the
+        current permissions to the planned ones. Without the current
+        permissions every planned change is made, which is harmless since
+        adding or removing a permission twice has no effect '''
+
+        groups = (current or {}).get('groups', [])
+        user_ids = set((current or {}).get('user_ids', []))
+
+        changes = []
+        to_add = [account_id for account_id in self.account_ids if account_id not in user_ids]
+        add_groups = ['all'] if self.public and (current is None or 'all' not in groups) else None
+        for start in range(0, len(to_add), MAX_ACCOUNTS_PER_CALL):
+            # The group goes along with the first batch of accounts
+            changes.append(('add', to_add[start:start + MAX_ACCOUNTS_PER_CALL], add_groups))
+            add_groups = None
+        if add_groups:
+            changes.append(('add', None, add_groups))
+        if self.public is False and (current is None or 'all' in groups):
+            changes.append(('remove', None, ['all']))
+        return changes
+
+    def result(self, current):
+        ''' The permissions after the planned changes have been made '''
+
+        groups = set(current.get('groups', []))
+        if self.public:
+            groups.add('all')
+        elif self.public is False:
+            groups.discard('all')
+        permissions = {}
+        if groups:
+            permissions['groups'] = sorted(groups)
+        user_ids = set(current.get('user_ids', [])) | set(self.account_ids)
+        if user_ids:
+            permissions['user_ids'] = sorted(user_ids)
+        return permissions
+
+
+def distribution_plans(non_public, account_ids, copying, copied_into=None):
+    ''' The (source plan, copy plan) of a distribution. The copies are made
+    public unless non_public, and shared with account_ids either way.
+    Copying with non_public also takes away public access to the source
+    AMIs, which are shared with the accounts copied_into as well. copying is
+    whether anything is copied at all '''
+
+    copy_plan = PermissionPlan(public=None if non_public else True, account_ids=account_ids)
+    source_public = (False if copying else None) if non_public else True
+    source_plan = PermissionPlan(public=source_public, account_ids=list(account_ids or []) + list(copied_into or []))
+    return source_plan, copy_plan
+
+
+def apply_image_permissions(conn, ami_id, plan, current=None):
+    ''' Makes only the launch permission changes an AMI needs, and returns its
+    permissions afterwards '''
+
+    for operation, user_ids, groups in plan.changes(current):
+        log.debug('%s launch permissions of %s: accounts %s, groups %s', operation, ami_id, user_ids, groups)
+        retry_throttled(conn.modify_image_attribute, ami_id, 'launchPermission', operation, user_ids, groups)
+    return plan.result(current or {})
+
+
+def apply_snapshot_permissions(conn, snapshot_id, plan, current=None):
+    ''' Makes only the create volume permission changes a snapshot needs '''
+
+    for operation, user_ids, groups in plan.changes(current):
+        log.debug('%s create volume permissions of %s: accounts %s, groups %s', operation, snapshot_id, user_ids, groups)
+        retry_throttled(conn.modify_snapshot_attribute, snapshot_id, 'createVolumePermission', operation, user_ids, groups)
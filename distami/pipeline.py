@@ -0,0 +1,510 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import threading
+import time
+
+from Queue import Queue, Empty
+
+import boto
+
+from distami.engine import CopyResult, run_in_threads
+from distami.exceptions import *
+from distami.journal import Journal
+from distami.metrics import get_metrics
+from distami.polling import backoff, is_copy_limit_error, retry_copy, retry_throttled
+from distami.waiter import AmiWaiter
+
+__all__ = ('Pipeline', )
+log = logging.getLogger(__name__)
+
+
+class Pipeline(object):
+    ''' Distributes copies through a pipeline of stages joined by queues:
+
+    * start: calls CopyImage for every copy up front, holding back only those
+      over the overall or per-region limit of copies in flight, which counts
+      each account's copies into a region separately, and those relayed
+      through another region until the copy there is available. A copy
+      turned away by EC2's own copy limit goes back to wait for its region,
+      while copies into other regions carry on starting
+    * wait: one waiter polls every copy in flight, and passes each one on as
+      soon as it is available
+    * tag: copies the source, lineage and extra tags to each available copy,
+      with one tagger per destination account and region so they are all
+      tagged at once
+    * share: applies the launch and snapshot permissions to each tagged copy
+
+    Each stage works on a copy as soon as the previous stage hands it over,
+    so the distribution takes about as long as the slowest copy. The journal
+    records every step, and copies it says are part way through pick up
+    from the stage after the last one they finished. How long each copy
+    waited, and how long it took to tag and share, go in the metrics, and
+    every step of every copy is sent to the progress reporter, if any. How
+    long each copy took to become available is also recorded in copy_times,
+    if given, for planning relays on later runs.
+
+    run() distributes one batch of copies. A pipeline can also be kept
+    running with start(), given copies with submit() as they come, and
+    stopped with close(), so the limits and the waiter cover them all '''
+
+    def __init__(self, journal, share, policy=None, concurrency=None, per_region=None, workers=1, metrics=None,
+                 progress=None, copy_times=None):
+        self._journal = journal
+        self._share = share
+        self._policy = policy
+        self._concurrency = concurrency
+        self._per_region = per_region
+        self._workers = workers
+        self._metrics = metrics or get_metrics()
+        self._progress = progress
+        self._copy_times = copy_times
+
+    def run(self, tasks, relays=None):
+        ''' Distributes every (distami, region) task and returns a CopyResult
+        per task, in the same order, once they have all finished '''
+
+        # Tagging is a call or two per copy, so every region gets its own tagger
+        regions = len(set((distami.account_id, region) for distami, region in tasks))
+        self.start(max(self._workers, regions))
+        try:
+            return self.submit(tasks, relays)
+        finally:
+            self.close()
+
+    def start(self, taggers=None):
+        ''' Starts every stage, ready for submit(), with workers threads per
+        stage except for the one waiter and the taggers, by default workers '''
+
+        self._condition = threading.Condition()
+        self._closed = False
+        self._to_start = []
+        self._held = {}
+        self._copying = {}
+        self._in_flight = {}
+        self._limited = {}
+        self._limit_attempts = {}
+        self._copy_started = {}
+        self._copied_from = {}
+        self._started = Queue()
+        self._to_tag = Queue()
+        self._to_share = Queue()
+
+        self._starters = self._spawn(self._workers, self._start)
+        self._waiter = self._spawn(1, self._wait, len(self._starters))
+        self._taggers = self._spawn(taggers or self._workers, self._tag)
+        self._sharers = self._spawn(self._workers, self._share_copies)
+
+    def close(self):
+        ''' Waits for every copy submitted to finish, then stops the stages '''
+
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+        # Each stage is told there is nothing more to come once the stage
+        # before it has finished
+        self._join(self._starters + self._waiter)
+        for _ in self._taggers:
+            self._to_tag.put(None)
+        self._join(self._taggers)
+        for _ in self._sharers:
+            self._to_share.put(None)
+        self._join(self._sharers)
+
+    def submit(self, tasks, relays=None):
+        ''' Adds (distami, region) tasks to a started pipeline, alongside any
+        already in it, and returns a CopyResult per task, in the same order,
+        once the copies the journal says are available have been looked up.
+        wait() waits for them to finish. A task that fails at any stage has
+        the error recorded on its result; the others carry on.
+
+        A task for an AMI and region whose copy is already in flight waits
+        for that copy rather than starting another, and then tags and shares
+        it itself. So does a task whose copy the journal says is available,
+        unless the copy has since gone, when it is copied again.
+
+        relays maps a region to the region whose copy it should copy from,
+        as planned by fanout.plan_relays(). Such a copy starts once the copy
+        of the same AMI into that region is available, or copies from the
+        source if that one fails '''
+
+        results = []
+        journaled = {}
+        for distami, region in tasks:
+            journaled[(distami.ami_id, distami.account_id, region)] = \
+                self._journal.progress(distami.ami_id, region, distami.account_id)
+        copies = self._journaled_copies(tasks, journaled)
+
+        # Place every task before any stage can act on them, so a copy to
+        # relay through cannot finish before the copies relayed through it
+        # are held back for it
+        with self._condition:
+            for distami, region in tasks:
+                key = (distami.ami_id, distami.account_id, region)
+                result = CopyResult(region, distami.ami_id, distami.account_id)
+                result.started = time.time()
+                results.append(result)
+
+                step, copied_ami_id = journaled[key]
+                if step in (None, Journal.STARTED) and not self._lead(key, distami, result):
+                    log.info('%s is already being copied to %s, waiting for that copy', distami.ami_id, region)
+                elif step is None:
+                    parent = (distami.ami_id, distami.account_id, (relays or {}).get(region))
+                    parent_step, parent_ami_id = journaled.get(parent, (None, None))
+                    if parent not in journaled or parent_step in (Journal.AVAILABLE, Journal.TAGGED, Journal.SHARED):
+                        # Copy from the source, or from a copy that is already available
+                        self._to_start.append((distami, result, parent_ami_id and (parent[2], parent_ami_id)))
+                        result.copied_from = parent_ami_id and parent[2]
+                    else:
+                        self._held.setdefault(parent, []).append((distami, result))
+                elif step == Journal.STARTED:
+                    log.info('Waiting for %s in %s, started by an earlier run', copied_ami_id, region)
+                    self._claim(result)
+                    self._copy_started[(region, copied_ami_id)] = time.time()
+                    self._report('started', result, copied_ami_id)
+                    self._started.put((distami, result, copied_ami_id))
+                else:
+                    # Each task tags and shares the copy for itself, as the
+                    # tags and permissions of earlier tasks may not be the same
+                    copied_image = copies.get((distami.account_id, region, copied_ami_id))
+                    self._report('available', result, copied_ami_id)
+                    if step == Journal.AVAILABLE or copied_image is None or not distami.copy_is_tagged(copied_image):
+                        self._to_tag.put((distami, result, copied_ami_id, copied_image))
+                    else:
+                        self._to_share.put((distami, result, copied_ami_id))
+            self._condition.notify_all()
+
+        return results
+
+    def _journaled_copies(self, tasks, journaled):
+        ''' Looks up the copies the journal says are available, with one
+        DescribeImages call per account and region, and returns them by
+        (account ID, region, AMI ID). Any that have gone, or failed, are taken
+        out of journaled so they are copied again '''
+
+        wanted = {}
+        for distami, region in tasks:
+            step, copied_ami_id = journaled[(distami.ami_id, distami.account_id, region)]
+            if step in (Journal.AVAILABLE, Journal.TAGGED, Journal.SHARED):
+                registry, ami_ids = wanted.setdefault((distami.account_id, region), (distami.registry, set()))
+                ami_ids.add(copied_ami_id)
+        if not wanted:
+            return {}
+
+        copies = {}
+
+        def describe(slot):
+            account_id, region = slot
+            registry, ami_ids = wanted[slot]
+            conn = registry.connection(region)
+            for image in retry_throttled(conn.get_all_images, owners=['self'], filters={'image-id': sorted(ami_ids)}):
+                if image.state != 'failed':
+                    registry.store_image(image)
+                    copies[(account_id, region, image.id)] = image
+
+        for looked_up in run_in_threads(describe, sorted(wanted), self._workers):
+            account_id, region = looked_up.region
+            if not looked_up.succeeded:
+                # Trust the journal rather than copy again; the tag stage
+                # looks the copies up again
+                log.warning('Could not look up the copies in %s: %s', region, looked_up.error)
+                continue
+            for key, (step, copied_ami_id) in journaled.items():
+                if step in (Journal.AVAILABLE, Journal.TAGGED, Journal.SHARED) and key[1:] == looked_up.region \
+                        and (account_id, region, copied_ami_id) not in copies:
+                    log.info('%s in %s has gone since it was copied, so copying %s again', copied_ami_id, region, key[0])
+                    journaled[key] = (None, None)
+        return copies
+
+    def wait(self, results, timeout=None):
+        ''' Waits for every one of the results of submit() to finish, and
+        returns whether they have '''
+
+        deadline = None if timeout is None else time.time() + timeout
+        with self._condition:
+            while not all(result.finished is not None for result in results):
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                # Wait in short steps so Ctrl-C still reaches the main thread
+                self._condition.wait(1 if remaining is None else min(1, remaining))
+        return True
+
+    def _spawn(self, count, target, *args):
+        threads = []
+        for _ in range(count):
+            thread = threading.Thread(target=target, args=args)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        return threads
+
+    def _join(self, threads):
+        # Join with a timeout so Ctrl-C still reaches the main thread
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(1)
+
+    def _lead(self, key, distami, result):
+        ''' Makes a task the one to copy an AMI into a region, or, if another
+        task already is, has it follow that one's copy. Returns whether it
+        leads. Call with the condition held '''
+
+        if key in self._copying:
+            self._copying[key][1].append((distami, result))
+            return False
+        self._copying[key] = (result, [])
+        return True
+
+    def _followers(self, result):
+        ''' The tasks following a task's copy, which it no longer leads '''
+
+        with self._condition:
+            key = (result.source_ami_id, result.account_id, result.region)
+            if key not in self._copying or self._copying[key][0] is not result:
+                return []
+            return self._copying.pop(key)[1]
+
+    def _has_room(self, result):
+        if self._concurrency and sum(self._in_flight.values()) >= self._concurrency:
+            return False
+        if self._limited.get(self._slot(result), 0) > time.time():
+            return False
+        return not self._per_region or self._in_flight.get(self._slot(result), 0) < self._per_region
+
+    def _slot(self, result):
+        # EC2 limits copies in flight per account and region
+        return (result.account_id, result.region)
+
+    def _claim(self, result):
+        self._in_flight[self._slot(result)] = self._in_flight.get(self._slot(result), 0) + 1
+
+    def _release(self, result, limited_until=None):
+        with self._condition:
+            self._in_flight[self._slot(result)] -= 1
+            if limited_until is None:
+                # A copy leaving the region makes room under EC2's copy limit too
+                self._limited.pop(self._slot(result), None)
+            else:
+                self._limited[self._slot(result)] = limited_until
+            self._condition.notify_all()
+
+    def _requeue(self, item):
+        ''' Puts a copy turned away by EC2's copy limit back to wait for its
+        region, which is left alone until a copy there finishes or a backoff
+        passes. Returns False once the copy has been turned away too often '''
+
+        distami, result, copy_from = item
+        attempts = self._limit_attempts.get(result, 0) + 1
+        if attempts >= retry_copy.attempts:
+            return False
+        self._limit_attempts[result] = attempts
+        delay = backoff(attempts, retry_copy.base, retry_copy.cap)
+        log.info('%s has as many copies in flight as allowed, trying %s again in %.0f seconds',
+                 result.region, distami.ami_id, delay)
+        with self._condition:
+            self._to_start.append(item)
+        self._release(result, time.time() + delay)
+        return True
+
+    def _report(self, event, result, copied_ami_id):
+        if self._progress is not None:
+            self._progress.event(event, result.region, copied_ami_id, result.source_ami_id)
+
+    def _finish(self, result):
+        with self._condition:
+            result.finished = time.time()
+            self._condition.notify_all()
+
+    def _fail(self, result, error, copied_ami_id=None):
+        log.error('Copy of %s to %s failed: %s', result.source_ami_id, result.region, error)
+        log.debug('Copy of %s to %s failed', result.source_ami_id, result.region, exc_info=True)
+        result.error = error
+        self._finish(result)
+        self._report('failed', result, copied_ami_id)
+        self._relay(result)
+        # Tasks following a copy that will never be available fail with it
+        for distami, follower in self._followers(result):
+            self._fail(follower, error, copied_ami_id)
+
+    def _relay(self, result, copied_ami_id=None):
+        ''' Lets the copies held back to relay through this copy start, from
+        it if it is available, or from the source if it never will be '''
+
+        with self._condition:
+            held = self._held.pop((result.source_ami_id, result.account_id, result.region), [])
+            for distami, relayed in held:
+                if copied_ami_id:
+                    relayed.copied_from = result.region
+                else:
+                    log.info('Copying %s to %s from the source, since its copy in %s failed',
+                             result.source_ami_id, relayed.region, result.region)
+                self._to_start.append((distami, relayed, copied_ami_id and (result.region, copied_ami_id)))
+            if held:
+                self._condition.notify_all()
+
+    def _next_to_start(self):
+        ''' The first copy waiting to start whose region has room for it,
+        waiting while copies are held back to be relayed, or until the
+        pipeline is closed '''
+
+        with self._condition:
+            while self._to_start or self._held or not self._closed:
+                for item in self._to_start:
+                    if self._has_room(item[1]):
+                        self._to_start.remove(item)
+                        self._claim(item[1])
+                        return item
+                # Only the limits need checking again as time passes; anything
+                # else that makes room or adds copies notifies
+                self._condition.wait(1 if self._to_start else None)
+
+    def _start(self):
+        ''' Start stage: calls CopyImage for each copy as soon as there is room '''
+
+        while True:
+            item = self._next_to_start()
+            if item is None:
+                break
+            distami, result, copy_from = item
+            try:
+                # Rather than sleeping here while a region is at its copy
+                # limit, start copies into the other regions meanwhile
+                dest_conn, copied_ami_id = distami.start_copy_to_region(result.region, copy_from, retry_throttled)
+                self._journal.record(distami.ami_id, result.region, Journal.STARTED, copied_ami_id, distami.account_id)
+            except boto.exception.EC2ResponseError as e:
+                if is_copy_limit_error(e) and self._requeue(item):
+                    continue
+                self._release(result)
+                self._fail(result, e)
+                continue
+            except Exception as e:
+                self._release(result)
+                self._fail(result, e)
+                continue
+            self._copy_started[(result.region, copied_ami_id)] = time.time()
+            self._copied_from[(result.region, copied_ami_id)] = copy_from[0] if copy_from else distami.region
+            self._report('started', result, copied_ami_id)
+            self._started.put((distami, result, copied_ami_id))
+        self._started.put(None)
+
+    def _wait(self, starters):
+        ''' Wait stage: polls every copy in flight with one waiter, until all the
+        starters have finished and nothing is left in flight '''
+
+        waiter = AmiWaiter(self._policy, self._progress)
+        tracking = {}
+        while starters or len(waiter):
+            # Take on newly started copies, blocking only if there is nothing to poll
+            block = not len(waiter)
+            while starters:
+                try:
+                    # Every starter ends with None, so blocking cannot hang
+                    item = self._started.get(block)
+                except Empty:
+                    break
+                block = False
+                if item is None:
+                    starters -= 1
+                    continue
+                distami, result, copied_ami_id = item
+                waiter.add(distami.registry.connection(result.region), copied_ami_id)
+                # More than one task may be waiting for the same copy, such
+                # as those of jobs that found it in the journal
+                tracking.setdefault((result.region, copied_ami_id), []).append((distami, result))
+            if not len(waiter):
+                continue
+
+            finished = waiter.poll()
+
+            for region, copied_ami_id in waiter.lost():
+                self._waited(region, copied_ami_id, 'lost')
+                for distami, result in tracking.pop((region, copied_ami_id)):
+                    self._release(result)
+                    self._fail(result, AmiNotFoundException(copied_ami_id, region), copied_ami_id)
+
+            # Only the copies in a region that could not be polled are given up on
+            for region, copied_ami_id, error in waiter.failed():
+                self._waited(region, copied_ami_id, error.__class__.__name__)
+                for distami, result in tracking.pop((region, copied_ami_id)):
+                    self._release(result)
+                    self._fail(result, error, copied_ami_id)
+
+            for copied_image in finished:
+                region = copied_image.region.name
+                self._waited(region, copied_image.id, 'ok' if copied_image.state == 'available' else copied_image.state)
+                for distami, result in tracking.pop((region, copied_image.id)):
+                    self._release(result)
+                    if copied_image.state == 'failed':
+                        msg = "AMI '%s' is in a failed state and will never be available" % copied_image.id
+                        self._fail(result, DistamiException(msg), copied_image.id)
+                        continue
+                    self._journal.record(distami.ami_id, region, Journal.AVAILABLE, copied_image.id, distami.account_id)
+                    self._relay(result, copied_image.id)
+                    self._to_tag.put((distami, result, copied_image.id, copied_image))
+                    # Every task following this copy tags and shares it too
+                    for follower_distami, follower in self._followers(result):
+                        self._report('available', follower, copied_image.id)
+                        self._to_tag.put((follower_distami, follower, copied_image.id, copied_image))
+
+            if len(waiter):
+                time.sleep(waiter.next_delay())
+
+    def _waited(self, region, copied_ami_id, outcome):
+        started = self._copy_started.pop((region, copied_ami_id), None)
+        copied_from = self._copied_from.pop((region, copied_ami_id), None)
+        if started is None:
+            return
+        self._metrics.record(region, 'CopyWait', time.time() - started, outcome)
+        # Only copies started by this run were timed from the start
+        if self._copy_times is not None and copied_from and outcome == 'ok':
+            self._copy_times.record(copied_from, region, time.time() - started)
+
+    def _tag(self):
+        ''' Tag stage: copies the tags to each available copy '''
+
+        while True:
+            item = self._to_tag.get()
+            if item is None:
+                return
+            distami, result, copied_ami_id, copied_image = item
+            try:
+                with self._metrics.timed(result.region, 'Tag'):
+                    distami.finish_copy_to_region(copied_image or distami.get_copy(result.region, copied_ami_id))
+                self._journal.record(distami.ami_id, result.region, Journal.TAGGED, copied_ami_id, distami.account_id)
+            except Exception as e:
+                self._fail(result, e, copied_ami_id)
+                continue
+            self._to_share.put((distami, result, copied_ami_id))
+
+    def _share_copies(self):
+        ''' Share stage: applies the permissions to each tagged copy '''
+
+        while True:
+            item = self._to_share.get()
+            if item is None:
+                return
+            distami, result, copied_ami_id = item
+            try:
+                with self._metrics.timed(result.region, 'Share'):
+                    self._share(distami, copied_ami_id, result.region)
+                self._journal.record(distami.ami_id, result.region, Journal.SHARED, copied_ami_id, distami.account_id)
+            except Exception as e:
+                self._fail(result, e, copied_ami_id)
+                continue
+            result.ami_id = copied_ami_id
+            self._finish(result)
+            self._report('shared', result, copied_ami_id)
@@ -0,0 +1,191 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import random
+import time
+import boto
+
+__all__ = ('FixedPolicy', 'AdaptivePolicy', 'CopyProgress', 'Retry', 'backoff', 'parse_progress',
+           'is_throttling_error', 'is_copy_limit_error', 'retry_throttled', 'retry_copy')
+log = logging.getLogger(__name__)
+
+THROTTLING_ERROR_CODES = ('RequestLimitExceeded', 'Throttling')
+
+# Returned by CopyImage when a region already has as many copies in flight as
+# the account is allowed
+COPY_LIMIT_ERROR_CODES = ('ResourceLimitExceeded', )
+
+
+def backoff(attempt, base=1.0, cap=30.0, floor=0.0):
+    ''' Exponential backoff with full jitter for the given (1-based) attempt
+    number, never shorter than floor '''
+
+    ceiling = min(cap, base * 2 ** (attempt - 1))
+    return random.uniform(min(floor, ceiling), ceiling)
+
+
+def is_throttling_error(e):
+    ''' Whether an EC2ResponseError means the API is throttling us '''
+
+    return getattr(e, 'error_code', None) in THROTTLING_ERROR_CODES
+
+
+def is_copy_limit_error(e):
+    ''' Whether an EC2ResponseError means a region has as many copies in flight as allowed '''
+
+    return getattr(e, 'error_code', None) in COPY_LIMIT_ERROR_CODES
+
+
+class Retry(object):
+    ''' Calls a function, retrying with backoff when it fails with one of the
+    given EC2 error codes. Each call is made through inner, if given, so other
+    errors can be retried with a backoff of their own '''
+
+    def __init__(self, error_codes, attempts, base, cap, inner=None):
+        self.error_codes = error_codes
+        self.attempts = attempts
+        self.base = base
+        self.cap = cap
+        self.inner = inner
+
+    def __call__(self, func, *args, **kwargs):
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                if self.inner is not None:
+                    return self.inner(func, *args, **kwargs)
+                return func(*args, **kwargs)
+            except boto.exception.EC2ResponseError as e:
+                if getattr(e, 'error_code', None) not in self.error_codes or attempt >= self.attempts:
+                    raise
+                delay = backoff(attempt, self.base, self.cap)
+                log.debug('%s failed with %s, retrying in %.1f seconds', getattr(func, '__name__', func), e.error_code, delay)
+                time.sleep(delay)
+
+
+# For any call that may be throttled
+retry_throttled = Retry(THROTTLING_ERROR_CODES, attempts=8, base=1, cap=30)
+
+# For CopyImage, which may also have to wait for other copies to finish. Only
+# the copy limit gets the long backoff; throttling is retried as for any call
+retry_copy = Retry(COPY_LIMIT_ERROR_CODES, attempts=40, base=15, cap=120, inner=retry_throttled)
+
+
+def parse_progress(progress):
+    ''' Converts a snapshot progress string such as "45%" to an integer percentage '''
+
+    try:
+        return int(str(progress).rstrip('%'))
+    except ValueError:
+        return None
+
+
+class CopyProgress(object):
+    ''' Tracks the snapshot progress of a single copy to estimate its time remaining '''
+
+    def __init__(self, clock=time.time):
+        self._clock = clock
+        self.started = clock()
+        self.percent = None
+        self._first_sample = None
+        self._last_sample = None
+
+    def update(self, percent):
+        ''' Records a new progress percentage '''
+
+        if percent is None:
+            return
+        sample = (self._clock(), percent)
+        if self._first_sample is None:
+            self._first_sample = sample
+        self._last_sample = sample
+        self.percent = percent
+
+    def rate(self):
+        ''' Percentage points per second observed so far, or None if unknown '''
+
+        if self._first_sample is None or self._last_sample is self._first_sample:
+            return None
+        elapsed = self._last_sample[0] - self._first_sample[0]
+        gained = self._last_sample[1] - self._first_sample[1]
+        if elapsed <= 0 or gained <= 0:
+            return None
+        return gained / float(elapsed)
+
+    def eta(self):
+        ''' Estimated seconds until the copy completes, or None if unknown '''
+
+        if self.percent is not None and self.percent >= 100:
+            return 0.0
+        rate = self.rate()
+        if rate is None:
+            return None
+        remaining = (100 - self.percent) / rate
+        return max(0.0, remaining - (self._clock() - self._last_sample[0]))
+
+
+class FixedPolicy(object):
+    ''' Polls at a fixed interval '''
+
+    # Whether the waiter should look up snapshot progress for this policy
+    uses_progress = False
+
+    def __init__(self, interval=30):
+        self.interval = interval
+
+    def next_delay(self, etas):
+        return self.interval
+
+    def throttled(self):
+        pass
+
+
+class AdaptivePolicy(object):
+    ''' Polls often when a copy is close to completion, and backs off with jitter
+    while every copy is far away or its progress is unknown '''
+
+    uses_progress = True
+
+    def __init__(self, min_interval=5, max_interval=120, factor=2.0, jitter=0.2, eta_fraction=0.5):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.factor = factor
+        self.jitter = jitter
+        self.eta_fraction = eta_fraction
+        self._backoff = min_interval
+        self._throttled = False
+
+    def next_delay(self, etas):
+        ''' Returns how long to sleep before the next poll, given the estimated
+        seconds remaining (or None when unknown) of each pending copy '''
+
+        known = [eta for eta in etas if eta is not None]
+        if known and not self._throttled:
+            # Poll again once a fraction of the soonest copy's remaining time has passed
+            delay = min(known) * self.eta_fraction
+            self._backoff = self.min_interval
+        else:
+            delay = self._backoff
+            self._backoff = min(self.max_interval, self._backoff * self.factor)
+        self._throttled = False
+
+        delay *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        return min(self.max_interval, max(self.min_interval, delay))
+
+    def throttled(self):
+        ''' Backs off on the next poll after the API throttled this one '''
+
+        self._throttled = True
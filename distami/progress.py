@@ -0,0 +1,203 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import logging
+import sys
+import threading
+import time
+
+__all__ = ('Progress', 'JsonProgress', 'TableProgress', 'get_progress')
+log = logging.getLogger(__name__)
+
+
+class Progress(object):
+    ''' Keeps the latest state of every copy, from the events sent by the
+    pipeline and the waiter. Subclasses show it as it changes.
+
+    Events are 'started', 'progress', 'available', 'failed', 'lost' and
+    'shared'. A copy whose progress has not moved for stall_after seconds is
+    marked as stalled '''
+
+    # The state a copy is in after each event
+    STATES = {
+        'started': 'copying',
+        'progress': 'copying',
+        'available': 'tagging',
+        'failed': 'failed',
+        'lost': 'failed',
+        'shared': 'done',
+    }
+    FINISHED = ('failed', 'done')
+
+    def __init__(self, stall_after=600, clock=time.time):
+        self.stall_after = stall_after
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._copies = {}
+
+    def event(self, event, region, ami_id, source_ami_id=None, percent=None, rate=None, eta=None):
+        ''' Records something that happened to the copy ami_id in region '''
+
+        now = self._clock()
+        with self._lock:
+            # A copy that failed to start has no AMI ID of its own
+            copy = self._copies.setdefault((region, ami_id or source_ami_id), {
+                'region': region, 'ami_id': ami_id, 'source_ami_id': None, 'percent': None,
+                'rate': None, 'eta': None, 'changed': now})
+            copy['state'] = self.STATES[event]
+            copy['source_ami_id'] = source_ami_id or copy['source_ami_id']
+            if percent is not None and percent != copy['percent']:
+                copy['changed'] = now
+            copy['percent'] = 100 if event in ('available', 'shared') else percent if percent is not None else copy['percent']
+            copy['rate'] = rate
+            copy['eta'] = 0 if copy['state'] != 'copying' else eta
+            copy['stalled'] = copy['state'] == 'copying' and now - copy['changed'] >= self.stall_after
+            record = dict(copy, event=event, time=now)
+        del record['changed']
+        self.emit(record)
+
+    def copies(self):
+        ''' The latest state of every copy '''
+
+        with self._lock:
+            return [dict(copy) for copy in self._copies.values()]
+
+    def regions(self):
+        ''' A summary per region: how many copies are finished, the least
+        progress of any copy still going, the longest ETA, and whether any
+        copy has failed or stalled '''
+
+        regions = {}
+        for copy in self.copies():
+            region = regions.setdefault(copy['region'], {
+                'region': copy['region'], 'copies': 0, 'finished': 0, 'failed': 0,
+                'stalled': False, 'percent': None, 'eta': None, 'rate': None})
+            region['copies'] += 1
+            region['finished'] += copy['state'] in self.FINISHED
+            region['failed'] += copy['state'] == 'failed'
+            region['stalled'] = region['stalled'] or copy['stalled']
+            if copy['state'] == 'copying':
+                region['percent'] = _least(region['percent'], copy['percent'])
+                region['rate'] = _least(region['rate'], copy['rate'])
+                region['eta'] = _most(region['eta'], copy['eta'])
+        return [regions[name] for name in sorted(regions)]
+
+    def emit(self, record):
+        ''' Shows a change to a copy. Does nothing here '''
+
+    def close(self):
+        ''' Shows the final state, once the run is over '''
+
+
+def _least(a, b):
+    return b if a is None else a if b is None else min(a, b)
+
+
+def _most(a, b):
+    return b if a is None else a if b is None else max(a, b)
+
+
+class JsonProgress(Progress):
+    ''' Writes every event as a line of JSON, for CI systems and other tools '''
+
+    def __init__(self, stream=None, **kwargs):
+        Progress.__init__(self, **kwargs)
+        self._stream = stream or sys.stdout
+        self._write_lock = threading.Lock()
+
+    def emit(self, record):
+        line = json.dumps(record, sort_keys=True)
+        with self._write_lock:
+            self._stream.write(line + '\n')
+            self._stream.flush()
+
+
+class TableProgress(Progress):
+    ''' Shows a table with a row per region, redrawn in place on a terminal at
+    most every interval seconds. Elsewhere it is written out again at most
+    every quiet_interval seconds '''
+
+    def __init__(self, stream=None, interval=1, quiet_interval=60, **kwargs):
+        Progress.__init__(self, **kwargs)
+        self._stream = stream or sys.stderr
+        self._tty = hasattr(self._stream, 'isatty') and self._stream.isatty()
+        self._interval = interval if self._tty else quiet_interval
+        self._write_lock = threading.Lock()
+        self._drawn = 0
+        self._last_draw = None
+
+    def emit(self, record):
+        now = self._clock()
+        if self._last_draw is not None and now - self._last_draw < self._interval:
+            return
+        self._draw(now)
+
+    def close(self):
+        self._draw(self._clock())
+
+    def render(self):
+        ''' The lines of the table '''
+
+        lines = ['%-16s %7s %9s %7s %8s  %s' % ('REGION', 'COPIES', 'PROGRESS', 'RATE', 'ETA', 'STATUS')]
+        regions = self.regions()
+        for region in regions:
+            if region['failed']:
+                status = '%d failed' % region['failed']
+            elif region['finished'] == region['copies']:
+                status = 'done'
+            else:
+                status = 'copying'
+            if region['stalled']:
+                status += ', STALLED'
+            lines.append('%-16s %7s %9s %7s %8s  %s' % (
+                region['region'],
+                '%d/%d' % (region['finished'], region['copies']),
+                '-' if region['percent'] is None else '%d%%' % region['percent'],
+                '-' if region['rate'] is None else '%.1f%%/m' % (region['rate'] * 60),
+                _duration(region['eta']),
+                status))
+        finished = sum(region['finished'] for region in regions)
+        total = sum(region['copies'] for region in regions)
+        lines.append('%d of %d copies finished' % (finished, total))
+        return lines
+
+    def _draw(self, now):
+        lines = self.render()
+        with self._write_lock:
+            if self._tty and self._drawn:
+                # Move back up over the last table and clear it
+                self._stream.write('\x1b[%dA\x1b[J' % self._drawn)
+            self._stream.write('\n'.join(lines) + '\n')
+            self._stream.flush()
+            self._drawn = len(lines)
+            self._last_draw = now
+
+
+def _duration(seconds):
+    if seconds is None:
+        return '-'
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '%d:%02d:%02d' % (hours, minutes, seconds)
+
+
+def get_progress(kind, **kwargs):
+    ''' A reporter by name: 'table', 'json', or None for none '''
+
+    if kind == 'table':
+        return TableProgress(**kwargs)
+    if kind == 'json':
+        return JsonProgress(**kwargs)
+    return None
@@ -0,0 +1,232 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import calendar
+import logging
+import threading
+import time
+
+from distami.engine import run_in_threads
+from distami.exceptions import *
+from distami.index import SOURCE_AMI_TAG
+from distami.polling import retry_throttled
+from distami.registry import get_registry
+from distami.waiter import ebs_snapshot_ids
+
+__all__ = ('RetentionPolicy', 'PruneItem', 'Pruner', 'RateLimit', 'format_plan')
+log = logging.getLogger(__name__)
+
+DAY = 24 * 60 * 60
+
+# The states of a copy that has not finished copying yet
+IN_FLIGHT_STATES = ('pending', 'transient')
+
+
+def created_at(image):
+    ''' When an image was created, in seconds since the epoch, or None if
+    EC2 did not say '''
+
+    created = getattr(image, 'creationDate', None)
+    if not created:
+        return None
+    for fmt in ('%Y-%m-%dT%H:%M:%S.%fZ', '%Y-%m-%dT%H:%M:%SZ'):
+        try:
+            return calendar.timegm(time.strptime(created, fmt))
+        except ValueError:
+            continue
+    return None
+
+
+class RetentionPolicy(object):
+    ''' Which copies to keep: in each region, the keep_last newest available
+    copies of each family, and every available one younger than keep_days.
+    A family is the copies with the same value of the group_by tag, such as
+    a Name tag shared by every build of an image, which copies carry over
+    from their source. Copies without that tag are grouped by the source AMI
+    they were copied from. A copy is kept if either rule keeps it, and a
+    copy of unknown age is always kept.
+
+    Failed copies are never kept. The available copies of a family with a
+    copy still in flight are all kept, since that copy may yet fail and
+    leave fewer than keep_last available ones '''
+
+    def __init__(self, keep_last=None, keep_days=None, group_by='Name', clock=time.time):
+        if keep_last is None and keep_days is None:
+            raise DistamiException('A retention policy needs the number of copies or the days to keep')
+        if keep_last is not None and keep_last < 1:
+            raise DistamiException('A retention policy must keep at least the last copy')
+        self.keep_last = keep_last
+        self.keep_days = keep_days
+        self.group_by = group_by
+        self._clock = clock
+
+    def __repr__(self):
+        return '<RetentionPolicy keep_last=%s keep_days=%s group_by=%s>' % (self.keep_last, self.keep_days, self.group_by)
+
+    def family(self, image):
+        ''' The (tag, value) that groups an image with the others of its family '''
+
+        tags = image.tags or {}
+        if tags.get(self.group_by):
+            return (self.group_by, tags[self.group_by])
+        return (SOURCE_AMI_TAG, tags.get(SOURCE_AMI_TAG))
+
+    def expired(self, images):
+        ''' The images of one region that are not kept '''
+
+        families = {}
+        for image in images:
+            families.setdefault(self.family(image), []).append(image)
+
+        expired = []
+        for family, members in sorted(families.items()):
+            expired.extend(image for image in members if image.state == 'failed')
+            if any(image.state in IN_FLIGHT_STATES for image in members):
+                log.info('Keeping the copies of %s=%s until the one in flight is done', family[0], family[1])
+                continue
+
+            available = [image for image in members if image.state == 'available']
+            available.sort(key=lambda image: created_at(image) or float('inf'), reverse=True)
+            for number, image in enumerate(available):
+                created = created_at(image)
+                if created is None:
+                    continue
+                if self.keep_last is not None and number < self.keep_last:
+                    continue
+                if self.keep_days is not None and created > self._clock() - self.keep_days * DAY:
+                    continue
+                expired.append(image)
+        return expired
+
+
+class PruneItem(object):
+    ''' A copy to deregister, and the snapshots to delete along with it '''
+
+    def __init__(self, region, image):
+        self.region = region
+        self.ami_id = image.id
+        self.name = image.name
+        self.created = created_at(image)
+        self.snapshot_ids = [snapshot_id for device, snapshot_id in ebs_snapshot_ids(image)]
+        self.deleted = False
+        self.error = None
+
+    def __repr__(self):
+        return '<PruneItem %s in %s>' % (self.ami_id, self.region)
+
+
+class Pruner(object):
+    ''' Cleans up the copies DistAMI made: the AMIs this account owns with
+    the lineage tags DistAMI puts on every copy. Source AMIs, and anything
+    else without those tags, are never touched.
+
+    Each region is looked through and cleaned up on its own thread, at most
+    concurrency at once. Within a region, deletions are made at most rate per
+    second, and retried with backoff if they are throttled anyway '''
+
+    def __init__(self, registry=None, rate=5, concurrency=None):
+        self._registry = registry or get_registry()
+        self._rate = rate
+        self._concurrency = concurrency
+
+    def index(self, regions):
+        ''' Every copy DistAMI made in each region, from one filtered
+        DescribeImages call per region, in parallel. Regions that could not
+        be looked through are left out, with a warning '''
+
+        copies = {}
+
+        def index_region(region):
+            conn = self._registry.connection(region)
+            copies[region] = retry_throttled(conn.get_all_images, owners=['self'], filters={'tag-key': SOURCE_AMI_TAG})
+            log.debug('Found %d copies in %s', len(copies[region]), region)
+
+        for result in run_in_threads(index_region, regions, self._concurrency):
+            if not result.succeeded:
+                log.warning('Could not look for copies in %s: %s', result.region, result.error)
+        return copies
+
+    def plan(self, regions, policy):
+        ''' The PruneItems for every copy the policy does not keep, oldest
+        first in each region '''
+
+        plan = []
+        for region, images in sorted(self.index(regions).items()):
+            expired = sorted(policy.expired(images), key=created_at)
+            plan.extend(PruneItem(region, image) for image in expired)
+        return plan
+
+    def prune(self, plan):
+        ''' Deregisters each planned AMI and then deletes its snapshots, every
+        region in parallel. The outcome is recorded on each item; one that
+        fails does not stop the rest. Returns the items that failed '''
+
+        by_region = {}
+        for item in plan:
+            by_region.setdefault(item.region, []).append(item)
+
+        def prune_region(region):
+            conn = self._registry.connection(region)
+            limit = RateLimit(self._rate)
+            for item in by_region[region]:
+                try:
+                    limit.wait()
+                    retry_throttled(conn.deregister_image, item.ami_id)
+                    self._registry.invalidate(region, item.ami_id)
+                    for snapshot_id in item.snapshot_ids:
+                        limit.wait()
+                        retry_throttled(conn.delete_snapshot, snapshot_id)
+                        self._registry.invalidate(region, snapshot_id)
+                    item.deleted = True
+                    log.info('Deleted %s and snapshots %s in %s', item.ami_id, ', '.join(item.snapshot_ids), region)
+                except Exception as e:
+                    log.error('Could not delete %s in %s: %s', item.ami_id, region, e)
+                    item.error = e
+
+        for result in run_in_threads(prune_region, sorted(by_region), self._concurrency):
+            if not result.succeeded:
+                log.error('Could not prune %s: %s', result.region, result.error)
+                for item in by_region[result.region]:
+                    if not item.deleted and item.error is None:
+                        item.error = result.error
+        return [item for item in plan if not item.deleted]
+
+
+class RateLimit(object):
+    ''' Spaces out calls to at most rate per second '''
+
+    def __init__(self, rate, clock=time.time, sleep=time.sleep):
+        self._interval = 1.0 / rate if rate else 0
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._next = 0
+
+    def wait(self):
+        with self._lock:
+            now = self._clock()
+            if self._next > now:
+                self._sleep(self._next - now)
+                now = self._next
+            self._next = now + self._interval
+
+
+def format_plan(plan):
+    ''' The plan as text, one line per AMI, for a dry run '''
+
+    lines = []
+    for item in plan:
+        created = time.strftime('%Y-%m-%d', time.gmtime(item.created)) if item.created else '?'
+        lines.append('%-16s %-14s %s %s %s' % (item.region, item.ami_id, created, item.name, ' '.join(item.snapshot_ids)))
+    return '\n'.join(lines)
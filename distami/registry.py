@@ -0,0 +1,146 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import threading
+import time
+
+from distami.backends import get_backend
+from distami.exceptions import *
+from distami import utils
+from distami.polling import retry_throttled
+
+__all__ = ('Registry', 'get_registry')
+log = logging.getLogger(__name__)
+
+
+class Registry(object):
+    ''' Shares one EC2 connection per region, and caches image, snapshot and
+    launch permission lookups for a short time. Anything that changes a
+    resource must invalidate it afterwards. Connections come from the given
+    backend, or the process-wide one '''
+
+    def __init__(self, ttl=60, backend=None, clock=time.time):
+        self._ttl = ttl
+        self._backend = backend or get_backend()
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._conns = {}
+        self._cache = {}
+
+    @property
+    def backend(self):
+        return self._backend
+
+    def connection(self, region):
+        ''' Gets the shared connection to a region, connecting on first use '''
+
+        with self._lock:
+            if region not in self._conns:
+                log.debug('Connecting to %s', region)
+                conn = self._backend.connect(region)
+                if conn is None:
+                    raise DistamiException("Unknown region '%s'" % region)
+                self._conns[region] = conn
+            return self._conns[region]
+
+    def _lookup(self, region, kind, key):
+        ''' The cached value, or None if there is none or it has expired '''
+
+        with self._lock:
+            entry = self._cache.get((region, kind, key))
+        if entry and entry[0] > self._clock():
+            return entry[1]
+        return None
+
+    def _cached(self, region, kind, key, load):
+        value = self._lookup(region, kind, key)
+        if value is not None:
+            return value
+        value = load(self.connection(region))
+        self.store(region, kind, key, value)
+        return value
+
+    def store(self, region, kind, key, value):
+        ''' Caches a freshly looked up value '''
+
+        with self._lock:
+            self._cache[(region, kind, key)] = (self._clock() + self._ttl, value)
+
+    def image(self, region, ami_id):
+        ''' Gets an AMI, from the cache if it was looked up recently '''
+
+        return self._cached(region, 'image', ami_id, lambda conn: utils.get_ami(conn, ami_id))
+
+    def store_image(self, image):
+        ''' Caches an image that was looked up elsewhere, such as by a waiter '''
+
+        self.store(image.region.name, 'image', image.id, image)
+
+    def snapshots(self, region, snapshot_ids):
+        ''' Gets many snapshots in a region, in the same order, looking up all
+        those not cached recently with one DescribeSnapshots call '''
+
+        found = {}
+        for snapshot_id in snapshot_ids:
+            snapshot = self._lookup(region, 'snapshot', snapshot_id)
+            if snapshot is not None:
+                found[snapshot_id] = snapshot
+        missing = [snapshot_id for snapshot_id in snapshot_ids if snapshot_id not in found]
+        if missing:
+            conn = self.connection(region)
+            for snapshot in retry_throttled(conn.get_all_snapshots, filters={'snapshot-id': missing}):
+                self.store(region, 'snapshot', snapshot.id, snapshot)
+                found[snapshot.id] = snapshot
+            missing = [snapshot_id for snapshot_id in missing if snapshot_id not in found]
+            if missing:
+                raise DistamiException("Could not find snapshots %s in region '%s'" % (', '.join(missing), region))
+        return [found[snapshot_id] for snapshot_id in snapshot_ids]
+
+    def launch_permissions(self, region, ami_id):
+        ''' Gets the launch permissions of an AMI, from the cache if they were looked up recently '''
+
+        return self._cached(region, 'launch_permissions', ami_id,
+                            lambda conn: retry_throttled(conn.get_image_attribute, ami_id, 'launchPermission').attrs)
+
+    def invalidate(self, region, resource_id, kind=None):
+        ''' Forgets what is cached about a resource after it has been changed.
+        Only lookups of the given kind are forgotten, if one is given '''
+
+        with self._lock:
+            for cache_key in list(self._cache):
+                if cache_key[0] == region and cache_key[2] == resource_id and kind in (None, cache_key[1]):
+                    del self._cache[cache_key]
+
+    def clear(self):
+        ''' Forgets every cached lookup, keeping the connections '''
+
+        with self._lock:
+            self._cache.clear()
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    ''' Gets the registry shared by the whole process, starting a new one
+    whenever the process-wide backend has been swapped '''
+
+    global _registry
+    with _registry_lock:
+        backend = get_backend()
+        if _registry is None or _registry.backend is not backend:
+            _registry = Registry(backend=backend)
+        return _registry
@@ -0,0 +1,291 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import itertools
+import json
+import logging
+import re
+import threading
+import time
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from Queue import Queue
+from SocketServer import ThreadingMixIn
+
+from distami import utils
+from distami.core import Distami, share_sources
+from distami.exceptions import *
+from distami.journal import Journal
+from distami.permissions import distribution_plans
+from distami.pipeline import Pipeline
+from distami.registry import get_registry
+
+__all__ = ('Job', 'Service', 'serve')
+log = logging.getLogger(__name__)
+
+DEFAULT_ADDRESS = ('127.0.0.1', 8353)
+
+ACCOUNT_ID = re.compile(r'^\d{12}$')
+
+
+def _is_list_of(value, kind):
+    return isinstance(value, list) and all(isinstance(item, kind) for item in value)
+
+
+class Job(object):
+    ''' A distribution submitted to the service: the AMIs in region to copy
+    to the to_regions, with the same permissions the command line would set
+    for public, non_public and accounts '''
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+
+    def __init__(self, job_id, ami_ids, region, to_regions, non_public=False, account_ids=None, tags=None):
+        self.id = job_id
+        self.ami_ids = ami_ids
+        self.region = region
+        self.to_regions = to_regions
+        self.non_public = non_public or bool(account_ids)
+        self.account_ids = account_ids or []
+        self.tags = tags or {}
+        self.state = Job.QUEUED
+        self.error = None
+        self.copies = []
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self._done = threading.Event()
+
+    def __repr__(self):
+        return '<Job %s %s>' % (self.id, self.state)
+
+    @classmethod
+    def from_dict(cls, spec, job_id=None):
+        ''' A job from its JSON description, e.g.
+
+            {"ami_ids": ["ami-abcd1234"], "region": "us-east-1",
+             "to": ["us-west-1", "us-west-2"], "non_public": true,
+             "accounts": ["123412341234"], "tags": {"team": "infra"}}
+
+        "to" may also be "all", the default, or "none". Raises
+        DistamiException if any of it is not as above '''
+
+        if not isinstance(spec, dict):
+            raise DistamiException('A job must be a JSON object')
+        ami_ids = spec.get('ami_ids')
+        if not ami_ids or not _is_list_of(ami_ids, basestring):
+            raise DistamiException('ami_ids must be a list of at least one AMI ID')
+        if not spec.get('region') or not isinstance(spec['region'], basestring):
+            raise DistamiException('region is required')
+        to = spec.get('to', 'all')
+        if to not in ('all', 'none') and not _is_list_of(to, basestring):
+            raise DistamiException('to must be a list of regions, "all" or "none"')
+        accounts = spec.get('accounts') or []
+        if not _is_list_of(accounts, basestring) or not all(ACCOUNT_ID.match(account_id) for account_id in accounts):
+            raise DistamiException('accounts must be a list of 12-digit AWS Account IDs')
+        tags = spec.get('tags') or {}
+        if not isinstance(tags, dict) or not all(isinstance(value, basestring) for value in tags.values()):
+            raise DistamiException('tags must be an object of tag names to string values')
+        return cls(job_id, ami_ids, spec['region'], to, bool(spec.get('non_public')), accounts, tags)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'state': self.state,
+            'error': self.error,
+            'ami_ids': self.ami_ids,
+            'region': self.region,
+            'submitted': self.submitted,
+            'started': self.started,
+            'finished': self.finished,
+            'copies': [{
+                'source': result.source_ami_id,
+                'region': result.region,
+                'ami_id': result.ami_id,
+                'state': 'pending' if result.finished is None else Job.SUCCEEDED if result.succeeded else Job.FAILED,
+                'error': str(result.error) if result.error else None,
+            } for result in self.copies],
+        }
+
+    def wait(self, timeout=None):
+        ''' Waits for the job to finish, and returns whether it has '''
+
+        return self._done.wait(timeout)
+
+
+class Service(object):
+    ''' Runs distribution jobs as they are submitted, all through one
+    registry, so one connection per region and one cache, and one Pipeline,
+    so one set of copy limits and one waiter polling every copy of every job
+    with a DescribeImages call per region. However many jobs are running,
+    polling costs the same number of calls. workers is how many jobs are set
+    up at once, and how many threads each stage of the pipeline has; the
+    copies of every running job proceed together. A job for an AMI and
+    region that another job is copying, or has copied, uses that copy, but
+    gives it its own tags and permissions. journal, concurrency, per_region,
+    partitions and exclude are those of the command line '''
+
+    def __init__(self, registry=None, policy=None, journal=None, concurrency=None, per_region=None, workers=4,
+                 partitions=None, exclude=None, metrics=None):
+        self._registry = registry or get_registry()
+        self._policy = policy
+        self._concurrency = concurrency
+        self._partitions = partitions
+        self._exclude = exclude
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._jobs = {}
+        # Each job's copies are shared according to its own plan
+        self._copy_plans = {}
+        self._queue = Queue()
+
+        self._pipeline = Pipeline(journal or Journal(), self._share, policy, concurrency, per_region, workers, metrics)
+        # Tagging is a call or two per copy, so every region gets its own tagger
+        self._pipeline.start(max(workers, len(self._registry.backend.regions())))
+        for _ in range(workers):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+
+    def submit(self, spec):
+        ''' Queues a job from its JSON description and returns it. Raises
+        DistamiException, without queueing anything, if the job is not valid '''
+
+        job = Job.from_dict(spec)
+        with self._lock:
+            job.id = str(next(self._ids))
+            self._jobs[job.id] = job
+        log.info('Queued job %s: %s from %s', job.id, ', '.join(job.ami_ids), job.region)
+        self._queue.put(job)
+        return job
+
+    def job(self, job_id):
+        ''' A job by its ID, or None '''
+
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self):
+        ''' Every job, oldest first '''
+
+        with self._lock:
+            return sorted(self._jobs.values(), key=lambda job: int(job.id))
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            job.state = Job.RUNNING
+            job.started = time.time()
+            try:
+                self._run(job)
+                job.state = Job.SUCCEEDED if all(result.succeeded for result in job.copies) else Job.FAILED
+            except Exception as e:
+                log.debug('Job %s failed', job.id, exc_info=True)
+                job.error = str(e)
+                job.state = Job.FAILED
+            job.finished = time.time()
+            log.info('Job %s %s', job.id, job.state)
+            job._done.set()
+
+    def _run(self, job):
+        ''' Distributes a job, like the command line does, and waits for it '''
+
+        if job.to_regions == 'none':
+            to_regions = []
+        elif job.to_regions == 'all':
+            to_regions = utils.get_regions_to_copy_to(job.region, self._registry.backend, self._partitions, self._exclude)
+        else:
+            to_regions = [region for region in job.to_regions if region != job.region]
+
+        distamis = [Distami(ami_id, job.region, self._policy, self._registry, job.tags) for ami_id in job.ami_ids]
+        source_plan, copy_plan = distribution_plans(job.non_public, job.account_ids, bool(to_regions))
+        share_sources(distamis, source_plan, self._concurrency)
+
+        with self._lock:
+            for distami in distamis:
+                self._copy_plans[distami] = copy_plan
+        try:
+            job.copies = self._pipeline.submit([(distami, region) for distami in distamis for region in to_regions])
+            self._pipeline.wait(job.copies)
+        finally:
+            with self._lock:
+                for distami in distamis:
+                    del self._copy_plans[distami]
+
+    def _share(self, distami, copied_ami_id, region):
+        with self._lock:
+            plan = self._copy_plans[distami]
+        distami.share_copy(copied_ami_id, region, plan)
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    ''' The job API:
+
+    * POST /jobs queues a job, described by a JSON object
+    * GET /jobs lists every job
+    * GET /jobs/ID shows one job and each of its copies '''
+
+    JOB_PATH = re.compile(r'^/jobs/([^/]+)$')
+
+    def do_GET(self):
+        service = self.server.service
+        if self.path.rstrip('/') == '/jobs':
+            return self._send(200, [job.to_dict() for job in service.jobs()])
+        match = self.JOB_PATH.match(self.path)
+        job = service.job(match.group(1)) if match else None
+        if job is None:
+            return self._send(404, {'error': 'Not found'})
+        self._send(200, job.to_dict())
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/jobs':
+            return self._send(404, {'error': 'Not found'})
+        try:
+            length = int(self.headers.getheader('content-length') or 0)
+            job = self.server.service.submit(json.loads(self.rfile.read(length)))
+        except ValueError:
+            return self._send(400, {'error': 'The body must be JSON'})
+        except DistamiException as e:
+            return self._send(400, {'error': e.message})
+        except Exception:
+            log.exception('Could not queue a job')
+            return self._send(500, {'error': 'Internal error'})
+        self._send(202, job.to_dict())
+
+    def _send(self, status, body):
+        content = json.dumps(body, sort_keys=True)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        log.debug('%s %s', self.address_string(), format % args)
+
+
+def serve(service, address=DEFAULT_ADDRESS):
+    ''' Makes an HTTP server for the job API of a service. Call its
+    serve_forever() to run it. Only bind it to localhost: there is no
+    authentication '''
+
+    server = _Server(address, _Handler)
+    server.service = service
+    return server
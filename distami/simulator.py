@@ -0,0 +1,435 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import itertools
+import logging
+import random
+import threading
+import time
+
+from collections import Counter
+
+from boto.ec2.blockdevicemapping import BlockDeviceMapping, BlockDeviceType
+from boto.ec2.image import CopyImage, Image, ImageAttribute
+from boto.ec2.regioninfo import RegionInfo
+from boto.ec2.snapshot import Snapshot
+from boto.exception import EC2ResponseError
+
+__all__ = ('SimulatedEC2', 'SimulatedAccount', 'SimulatedConnection')
+log = logging.getLogger(__name__)
+
+# The regions simulated unless told otherwise
+DEFAULT_REGIONS = ('us-east-1', 'us-west-1', 'us-west-2', 'eu-west-1', 'eu-central-1',
+                   'ap-southeast-1', 'ap-southeast-2', 'ap-northeast-1', 'sa-east-1')
+
+ROOT_DEVICE_NAME = '/dev/sda1'
+DATA_DEVICE_NAMES = ['/dev/sd%s' % letter for letter in 'bcdefghijklmnop']
+
+# The account that connect() acts as, and that owns images unless told otherwise
+DEFAULT_ACCOUNT_ID = '111111111111'
+
+
+def ec2_error(code, status=400):
+    ''' An EC2ResponseError with the given error code, as boto would raise it '''
+
+    e = EC2ResponseError(status, 'Service Unavailable' if status == 503 else 'Bad Request')
+    e.error_code = code
+    return e
+
+
+def _as_list(values):
+    if values is None:
+        return None
+    if isinstance(values, basestring):
+        return [values]
+    return list(values)
+
+
+class _Resource(object):
+    ''' What the simulator knows about an image or snapshot '''
+
+    def __init__(self, resource_id, region, tags=None, owner=DEFAULT_ACCOUNT_ID):
+        self.id = resource_id
+        self.region = region
+        self.owner = owner
+        self.tags = dict(tags or {})
+        self.permissions = {}
+        self.started = None
+        self.finishes = None
+        self.fails = False
+
+
+class SimulatedEC2(object):
+    ''' An in-memory stand-in for EC2 in many regions, for running whole
+    distributions without the network or an AWS bill. It is a backend, so it
+    can be swapped in for boto with backends.set_backend() or passed to a
+    Registry, and it counts every API call made against it.
+
+    * regions: the region names, or how many made-up regions to simulate
+    * copy_duration: seconds a CopyImage takes to complete, or a function of
+      the destination region returning them
+    * latency: seconds every API call takes, or a function of the operation
+      name returning them
+    * throttle_rate: the chance any API call fails with RequestLimitExceeded
+    * failure_rate: the chance a copy ends up failed instead of available
+    * copy_limit: how many copies may be in progress in a region at once
+      before CopyImage fails with ResourceLimitExceeded, like EC2's own limit
+    * seed: seeds the random throttling and failures, for repeatable runs
+
+    Connections act as one account, and account() gives a backend acting as
+    another. An account sees the images and snapshots it owns, and those
+    shared with it or made public, and can only change its own '''
+
+    def __init__(self, regions=DEFAULT_REGIONS, copy_duration=0, latency=0, throttle_rate=0, failure_rate=0,
+                 copy_limit=None, seed=None, clock=time.time, sleep=time.sleep):
+        if isinstance(regions, int):
+            regions = ['sim-%d' % n for n in range(1, regions + 1)]
+        self._regions = list(regions)
+        self.copy_duration = copy_duration
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.failure_rate = failure_rate
+        self.copy_limit = copy_limit
+        self.clock = clock
+        self.sleep = sleep
+        self.calls = Counter()
+        self.throttles = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._conns = {}
+        self._images = {}
+        self._snapshots = {}
+        self._injected = []
+
+    def __repr__(self):
+        return '<SimulatedEC2 %d regions>' % len(self._regions)
+
+    def regions(self):
+        return list(self._regions)
+
+    def connect(self, region, account_id=DEFAULT_ACCOUNT_ID):
+        ''' Connects to a simulated region, or returns None for an unknown one
+        just like boto.ec2.connect_to_region() '''
+
+        if region not in self._regions:
+            return None
+        with self._lock:
+            self.calls['Connect'] += 1
+            return self._conns.setdefault((account_id, region), SimulatedConnection(self, region, account_id))
+
+    def account(self, account_id):
+        ''' A backend whose connections act as another account '''
+
+        return SimulatedAccount(self, account_id)
+
+    def add_image(self, region, name='my-ami', description='My AMI', tags=None, snapshot_tags=None, state='available',
+                  data_volumes=0, owner=DEFAULT_ACCOUNT_ID, created=None):
+        ''' Registers an AMI in a region, to distribute from, with a root
+        snapshot and the given number of data volume snapshots. Every snapshot
+        gets the snapshot_tags. An AMI added in any state other than available
+        stays in it. created is when it was created, now by default. Returns
+        the AMI ID '''
+
+        with self._lock:
+            number = next(self._ids)
+            image = _Resource('ami-%08x' % number, region, tags, owner)
+            image.created = self.clock() if created is None else created
+            image.name = name
+            image.description = description
+            image.state = state
+            image.snapshots = self._new_snapshots(number, region, 1 + data_volumes, snapshot_tags, owner)
+            self._images[image.id] = image
+            return image.id
+
+    def _new_snapshots(self, number, region, count, tags=None, owner=DEFAULT_ACCOUNT_ID):
+        ''' Creates a snapshot for the root and each data volume of an image,
+        returning them as (device name, snapshot) pairs '''
+
+        snapshots = []
+        for device in [ROOT_DEVICE_NAME] + DATA_DEVICE_NAMES[:count - 1]:
+            snapshot = _Resource('snap-%08x' % number, region, tags, owner)
+            self._snapshots[snapshot.id] = snapshot
+            snapshots.append((device, snapshot))
+            number = next(self._ids)
+        return snapshots
+
+    def inject(self, operation, error_code, region=None, count=1):
+        ''' Makes the next count calls of an operation, such as 'CopyImage',
+        fail with the given error code, in one region or any '''
+
+        with self._lock:
+            self._injected.append([operation, region, error_code, count])
+
+    def images(self, region=None):
+        ''' The IDs of every AMI, or of those in one region '''
+
+        with self._lock:
+            return sorted(image.id for image in self._images.values() if region in (None, image.region))
+
+    def call(self, operation, region):
+        ''' Accounts for an API call: waits out the latency, then fails it if
+        an error was injected or it is unluckily throttled '''
+
+        latency = self.latency(operation) if callable(self.latency) else self.latency
+        if latency:
+            self.sleep(latency)
+        with self._lock:
+            self.calls[operation] += 1
+            for injected in self._injected:
+                if injected[0] == operation and injected[1] in (None, region):
+                    injected[3] -= 1
+                    if not injected[3]:
+                        self._injected.remove(injected)
+                    raise ec2_error(injected[2])
+            if self.throttle_rate and self._random.random() < self.throttle_rate:
+                self.throttles[operation] += 1
+                raise ec2_error('RequestLimitExceeded', 503)
+
+    def _advance(self, resource):
+        ''' Brings a copy up to date with the clock '''
+
+        if resource.finishes is not None and self.clock() >= resource.finishes:
+            resource.finishes = None
+            if hasattr(resource, 'state'):
+                resource.state = 'failed' if resource.fails else 'available'
+
+    def _progress(self, snapshot):
+        if snapshot.finishes is None:
+            return 100
+        duration = snapshot.finishes - snapshot.started
+        return min(99, int(100 * (self.clock() - snapshot.started) / duration)) if duration else 99
+
+    def _find(self, resources, resource_id, region, code):
+        resource = resources.get(resource_id)
+        if resource is None or resource.region != region:
+            raise ec2_error(code)
+        self._advance(resource)
+        return resource
+
+
+class SimulatedAccount(object):
+    ''' A backend for another account in the same SimulatedEC2 '''
+
+    def __init__(self, ec2, account_id):
+        self.ec2 = ec2
+        self.account_id = account_id
+
+    def __repr__(self):
+        return '<SimulatedAccount %s>' % self.account_id
+
+    def regions(self):
+        return self.ec2.regions()
+
+    def connect(self, region):
+        return self.ec2.connect(region, self.account_id)
+
+
+class SimulatedConnection(object):
+    ''' The subset of boto.ec2.connection.EC2Connection that DistAMI uses,
+    against one region of a SimulatedEC2, acting as one account. Lookups
+    return fresh boto objects, as boto itself does '''
+
+    def __init__(self, ec2, region, account_id=DEFAULT_ACCOUNT_ID):
+        self.ec2 = ec2
+        self.region = RegionInfo(name=region)
+        self.account_id = account_id
+
+    def __repr__(self):
+        return 'SimulatedConnection:%s' % self.region.name
+
+    def _visible(self, resource):
+        ''' Whether this account owns a resource or it is shared with it '''
+
+        return resource.owner == self.account_id or self.account_id in resource.permissions.get('user_ids', ()) \
+            or 'all' in resource.permissions.get('groups', ())
+
+    def _find(self, resources, resource_id, code, region=None, owned=False):
+        ''' Finds a resource this account can see, and if owned is set, change '''
+
+        resource = self.ec2._find(resources, resource_id, region or self.region.name, code)
+        if not self._visible(resource):
+            raise ec2_error(code)
+        if owned and resource.owner != self.account_id:
+            raise ec2_error('AuthFailure')
+        return resource
+
+    def _image(self, image):
+        result = Image(self)
+        result.id = image.id
+        result.name = image.name
+        result.description = image.description
+        result.state = image.state
+        result.owner_id = image.owner
+        result.creationDate = time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(image.created))
+        result.root_device_type = 'ebs'
+        result.root_device_name = ROOT_DEVICE_NAME
+        result.block_device_mapping = BlockDeviceMapping()
+        for device, snapshot in image.snapshots:
+            result.block_device_mapping[device] = BlockDeviceType(snapshot_id=snapshot.id)
+        result.tags.update(image.tags)
+        return result
+
+    def _snapshot(self, snapshot):
+        result = Snapshot(self)
+        result.id = snapshot.id
+        result.status = 'completed' if snapshot.finishes is None else 'pending'
+        result.progress = '%d%%' % self.ec2._progress(snapshot)
+        result.tags.update(snapshot.tags)
+        return result
+
+    def get_all_images(self, image_ids=None, owners=None, executable_by=None, filters=None, dry_run=False):
+        self.ec2.call('DescribeImages', self.region.name)
+        region = self.region.name
+        image_ids = _as_list(image_ids)
+        owners = _as_list(owners)
+        filters = dict((key, _as_list(values)) for key, values in (filters or {}).items())
+        with self.ec2._lock:
+            if image_ids:
+                images = [self._find(self.ec2._images, ami_id, 'InvalidAMIID.NotFound') for ami_id in image_ids]
+            else:
+                images = [image for image in self.ec2._images.values() if image.region == region and self._visible(image)]
+            results = []
+            for image in images:
+                self.ec2._advance(image)
+                if owners == ['self'] and image.owner != self.account_id:
+                    continue
+                if 'image-id' in filters and image.id not in filters['image-id']:
+                    continue
+                if 'name' in filters and image.name not in filters['name']:
+                    continue
+                if 'state' in filters and image.state not in filters['state']:
+                    continue
+                if any(key.startswith('tag:') and image.tags.get(key[4:]) not in values for key, values in filters.items()):
+                    continue
+                if 'tag-key' in filters and not any(key in image.tags for key in filters['tag-key']):
+                    continue
+                results.append(self._image(image))
+            return results
+
+    def get_all_snapshots(self, snapshot_ids=None, owner=None, restorable_by=None, filters=None, dry_run=False):
+        self.ec2.call('DescribeSnapshots', self.region.name)
+        region = self.region.name
+        snapshot_ids = _as_list(snapshot_ids) or _as_list((filters or {}).get('snapshot-id'))
+        with self.ec2._lock:
+            if snapshot_ids is None:
+                snapshots = [snapshot for snapshot in self.ec2._snapshots.values() if snapshot.region == region]
+            elif filters:
+                snapshots = [self.ec2._snapshots[snapshot_id] for snapshot_id in snapshot_ids
+                             if self.ec2._snapshots.get(snapshot_id) and self.ec2._snapshots[snapshot_id].region == region]
+            else:
+                snapshots = [self._find(self.ec2._snapshots, snapshot_id, 'InvalidSnapshot.NotFound')
+                             for snapshot_id in snapshot_ids]
+            snapshots = [snapshot for snapshot in snapshots if self._visible(snapshot)
+                         and (owner != 'self' or snapshot.owner == self.account_id)]
+            for snapshot in snapshots:
+                self.ec2._advance(snapshot)
+            return [self._snapshot(snapshot) for snapshot in snapshots]
+
+    def get_image_attribute(self, image_id, attribute='launchPermission', dry_run=False):
+        self.ec2.call('DescribeImageAttribute', self.region.name)
+        with self.ec2._lock:
+            image = self._find(self.ec2._images, image_id, 'InvalidAMIID.NotFound', owned=True)
+            result = ImageAttribute()
+            result.name = attribute
+            result.attrs = dict((key, sorted(values)) for key, values in image.permissions.items() if values)
+            return result
+
+    def _modify(self, resource, operation, user_ids, groups):
+        for key, values in (('user_ids', _as_list(user_ids)), ('groups', _as_list(groups))):
+            current = resource.permissions.setdefault(key, set())
+            if operation == 'add':
+                current.update(values or [])
+            else:
+                current.difference_update(values or [])
+
+    def modify_image_attribute(self, image_id, attribute='launchPermission', operation='add', user_ids=None,
+                               groups=None, product_codes=None, dry_run=False):
+        self.ec2.call('ModifyImageAttribute', self.region.name)
+        with self.ec2._lock:
+            image = self._find(self.ec2._images, image_id, 'InvalidAMIID.NotFound', owned=True)
+            self._modify(image, operation, user_ids, groups)
+        return True
+
+    def modify_snapshot_attribute(self, snapshot_id, attribute='createVolumePermission', operation='add',
+                                  user_ids=None, groups=None, dry_run=False):
+        self.ec2.call('ModifySnapshotAttribute', self.region.name)
+        with self.ec2._lock:
+            snapshot = self._find(self.ec2._snapshots, snapshot_id, 'InvalidSnapshot.NotFound', owned=True)
+            self._modify(snapshot, operation, user_ids, groups)
+        return True
+
+    def copy_image(self, source_region, source_image_id, name=None, description=None, client_token=None, dry_run=False):
+        self.ec2.call('CopyImage', self.region.name)
+        ec2 = self.ec2
+        region = self.region.name
+        duration = ec2.copy_duration(region) if callable(ec2.copy_duration) else ec2.copy_duration
+        with ec2._lock:
+            source = self._find(ec2._images, source_image_id, 'InvalidAMIID.NotFound', source_region)
+            # Copying an AMI shared with this account needs its snapshots shared too
+            if not all(self._visible(snapshot) for device, snapshot in source.snapshots):
+                raise ec2_error('AuthFailure')
+            if ec2.copy_limit is not None:
+                in_progress = 0
+                for image in ec2._images.values():
+                    if image.region == region:
+                        ec2._advance(image)
+                        in_progress += image.state == 'pending'
+                if in_progress >= ec2.copy_limit:
+                    raise ec2_error('ResourceLimitExceeded')
+
+            number = next(ec2._ids)
+            image = _Resource('ami-%08x' % number, region, owner=self.account_id)
+            image.name = name if name is not None else source.name
+            image.description = description if description is not None else source.description
+            image.state = 'pending'
+            image.created = ec2.clock()
+            image.snapshots = ec2._new_snapshots(number, region, len(source.snapshots), owner=self.account_id)
+            image.started = ec2.clock()
+            image.finishes = image.started + duration
+            for device, snapshot in image.snapshots:
+                snapshot.started, snapshot.finishes = image.started, image.finishes
+            image.fails = bool(ec2.failure_rate) and ec2._random.random() < ec2.failure_rate
+            ec2._images[image.id] = image
+            log.debug('Simulating copy of %s to %s as %s, taking %.1f seconds', source_image_id, region, image.id, duration)
+
+        result = CopyImage()
+        result.image_id = image.id
+        return result
+
+    def deregister_image(self, image_id, delete_snapshot=False, dry_run=False):
+        self.ec2.call('DeregisterImage', self.region.name)
+        with self.ec2._lock:
+            image = self._find(self.ec2._images, image_id, 'InvalidAMIID.NotFound', owned=True)
+            del self.ec2._images[image.id]
+        return True
+
+    def delete_snapshot(self, snapshot_id, dry_run=False):
+        self.ec2.call('DeleteSnapshot', self.region.name)
+        with self.ec2._lock:
+            snapshot = self._find(self.ec2._snapshots, snapshot_id, 'InvalidSnapshot.NotFound', owned=True)
+            # Like EC2, a snapshot cannot go while an AMI still uses it
+            if any(snapshot is used for image in self.ec2._images.values() for device, used in image.snapshots):
+                raise ec2_error('InvalidSnapshot.InUse')
+            del self.ec2._snapshots[snapshot.id]
+        return True
+
+    def create_tags(self, resource_ids, tags, dry_run=False):
+        self.ec2.call('CreateTags', self.region.name)
+        with self.ec2._lock:
+            for resource_id in _as_list(resource_ids):
+                resources = self.ec2._images if resource_id.startswith('ami-') else self.ec2._snapshots
+                code = 'InvalidAMIID.NotFound' if resource_id.startswith('ami-') else 'InvalidSnapshot.NotFound'
+                self._find(resources, resource_id, code, owned=True).tags.update(tags)
+        return True
@@ -15,15 +15,19 @@
 import logging
 import time
 import boto
-from boto import ec2
 
+from distami import config
+from distami.backends import get_backend
 from distami.exceptions import * 
+from distami.polling import backoff, retry_throttled
+from distami.waiter import AmiWaiter
 
 log = logging.getLogger(__name__)
 
 
-def get_ami(conn, ami_id):
-    ''' Gets a single AMI as a boto.ec2.image.Image object '''
+def get_ami(conn, ami_id, sleep=time.sleep):
+    ''' Gets a single AMI as a boto.ec2.image.Image object, retrying with
+    sleep while it cannot be found '''
     
     attempts = 0
     max_attempts = 5
@@ -31,13 +35,16 @@ def get_ami(conn, ami_id):
         try:
             attempts += 1
             images = conn.get_all_images(ami_id)
+            break
         except boto.exception.EC2ResponseError:
             msg = "Could not find AMI '%s' in region '%s'" % (ami_id, conn.region.name)
             if attempts < max_attempts:
                 # The API call to initiate an AMI copy is not blocking, so the
-                # copied AMI may not be available right away
-                log.debug(msg + ' so waiting 5 seconds and retrying')
-                time.sleep(5)
+                # copied AMI may not be available right away. Wait at least as
+                # long as a fixed 5 second retry would have
+                delay = backoff(attempts, base=5, floor=5)
+                log.debug('%s so waiting %.1f seconds and retrying', msg, delay)
+                sleep(delay)
             else:
                 raise DistamiException(msg)
     
@@ -53,7 +60,7 @@ def get_snapshot(conn, snapshot_id):
     ''' Gets a single snapshot as a boto.ec2.snapshot.Snapshot object '''
     
     try:
-        snapshots = conn.get_all_snapshots(snapshot_id)
+        snapshots = retry_throttled(conn.get_all_snapshots, snapshot_id)
     except boto.exception.EC2ResponseError:
         msg = "Could not snapshot '%s' in region '%s'" % (snapshot_id, conn.region.name)
         raise DistamiException(msg)
@@ -66,37 +73,29 @@ def get_snapshot(conn, snapshot_id):
     return snapshots[0]
 
 
-def get_regions_to_copy_to(source_region):
-    ''' Gets the list of regions to copy an AMI to '''
+def get_regions_to_copy_to(source_region, backend=None, partitions=None, exclude=None):
+    ''' Gets the list of regions to copy an AMI to: every region in the given
+    partitions, by default just the partition of the source region, that is
+    not excluded '''
     
-    regions = []
-    for region in ec2.regions():
-        if region.name == source_region:
-            continue
-        # Filter out GovCloud
-        if region.name == 'us-gov-west-1':
-            continue
-        # Filter out China
-        if region.name == 'cn-north-1':
-            continue
-        regions.append(region.name)
-        
-    return regions
+    partitions = partitions or [config.partition_of(source_region)]
+    regions = config.filter_regions((backend or get_backend()).regions(), partitions, exclude)
+    return [region for region in regions if region != source_region]
 
 
-def wait_for_ami_to_be_available(conn, ami_id):
-    ''' Blocking wait until the AMI is available '''
+def wait_for_ami_to_be_available(conn, ami_id, policy=None):
+    ''' Blocking wait until the AMI is available, polling according to the given policy '''
     
     ami = get_ami(conn, ami_id)
     log.debug('AMI details: %s', vars(ami))
     
-    while ami.state != 'available':
-        log.info("%s in %s not available, waiting...", ami_id, conn.region.name)
-        time.sleep(30)
-        ami = get_ami(conn, ami_id)
+    if ami.state not in ('available', 'failed'):
+        waiter = AmiWaiter(policy)
+        waiter.add(conn, ami_id)
+        ami = next(waiter.wait())
         
-        if ami.state == 'failed':
-            msg = "AMI '%s' is in a failed state and will never be available" % ami_id
-            raise DistamiException(msg)
+    if ami.state == 'failed':
+        msg = "AMI '%s' is in a failed state and will never be available" % ami_id
+        raise DistamiException(msg)
     
-    return ami
\ No newline at end of file
+    return ami
@@ -0,0 +1,213 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import copy
+import logging
+import time
+
+from distami.exceptions import *
+from distami.polling import AdaptivePolicy, CopyProgress, is_throttling_error, parse_progress
+
+__all__ = ('AmiWaiter', 'ebs_snapshot_ids', 'root_snapshot_id')
+log = logging.getLogger(__name__)
+
+
+def root_snapshot_id(image):
+    ''' The snapshot ID of an image's root device, or None if it is not known yet '''
+
+    bdm = getattr(image, 'block_device_mapping', None) or {}
+    device = bdm.get(getattr(image, 'root_device_name', None))
+    return getattr(device, 'snapshot_id', None)
+
+
+def ebs_snapshot_ids(image):
+    ''' The (device name, snapshot ID) of every EBS volume of an image that has
+    a snapshot, root device first '''
+
+    bdm = getattr(image, 'block_device_mapping', None) or {}
+    root = getattr(image, 'root_device_name', None)
+    devices = sorted(bdm, key=lambda device: (device != root, device))
+    return [(device, bdm[device].snapshot_id) for device in devices if getattr(bdm[device], 'snapshot_id', None)]
+
+
+class AmiWaiter(object):
+    ''' Waits for many AMIs at once, using one DescribeImages call per region
+    per poll, or per region and account when copies were made with the
+    connections of more than one account. If given a Progress, it is sent the state of every AMI on every
+    poll, and snapshot progress is always polled for it '''
+
+    # How many polls an AMI may go unseen before giving up on it. The API call
+    # to initiate an AMI copy is not blocking, so a copy may not show up
+    # straight away
+    max_missing_polls = 5
+    # How many polls of a region may fail in a row before giving up on the
+    # AMIs in it. The others are still waited for
+    max_failed_polls = 5
+
+    def __init__(self, policy=None, progress=None):
+        # Policies keep backoff state, so each waiter gets its own copy
+        self._policy = copy.copy(policy) if policy else AdaptivePolicy()
+        self._reporter = progress
+        # The AMIs pending, by the connection to poll them with
+        self._pending = {}
+        self._missing = {}
+        self._progress = {}
+        self._errors = {}
+        self._lost = []
+        self._failed = []
+
+    def __len__(self):
+        return sum(len(ami_ids) for ami_ids in self._pending.values())
+
+    def add(self, conn, ami_id):
+        ''' Starts tracking an AMI in the region of the given connection '''
+
+        region = conn.region.name
+        self._pending.setdefault(conn, set()).add(ami_id)
+        self._missing[(region, ami_id)] = 0
+        self._progress[(region, ami_id)] = CopyProgress()
+
+    def remove(self, region, ami_id):
+        ''' Stops tracking an AMI '''
+
+        for conn, ami_ids in self._pending.items():
+            if conn.region.name == region and ami_id in ami_ids:
+                ami_ids.discard(ami_id)
+                if not ami_ids:
+                    del self._pending[conn]
+        self._missing.pop((region, ami_id), None)
+        self._progress.pop((region, ami_id), None)
+
+    def lost(self):
+        ''' Returns the (region, AMI ID) of each AMI given up on because it could
+        not be found, since this was last called '''
+
+        lost, self._lost = self._lost, []
+        return lost
+
+    def failed(self):
+        ''' Returns the (region, AMI ID, error) of each AMI given up on because
+        its region could not be polled, since this was last called '''
+
+        failed, self._failed = self._failed, []
+        return failed
+
+    def poll(self):
+        ''' Polls each region once and returns the images that became available or failed '''
+
+        finished = []
+        for conn, ami_ids in self._pending.items():
+            region = conn.region.name
+            try:
+                # Filter on image-id rather than passing image_ids, so a copy
+                # that is not visible yet does not fail the call for the region.
+                # Copies are owned by the account that made them, and without
+                # an owner EC2 searches every public image too
+                images = conn.get_all_images(owners=['self'], filters={'image-id': list(ami_ids)})
+            except Exception as e:
+                self._policy.throttled()
+                if is_throttling_error(e):
+                    log.debug('Throttled polling %s, backing off', region)
+                    continue
+                self._errors[conn] = self._errors.get(conn, 0) + 1
+                if self._errors[conn] < self.max_failed_polls:
+                    log.warning('Polling %s failed, backing off: %s', region, e)
+                    continue
+                log.error('Polling %s failed %d times in a row, giving up on %s: %s',
+                          region, self._errors.pop(conn), ', '.join(sorted(ami_ids)), e)
+                for ami_id in list(ami_ids):
+                    self.remove(region, ami_id)
+                    self._failed.append((region, ami_id, e))
+                    self._report('failed', region, ami_id)
+                continue
+            self._errors.pop(conn, None)
+            found = dict((image.id, image) for image in images)
+
+            in_progress = {}
+            for ami_id in list(ami_ids):
+                image = found.get(ami_id)
+                if image is None:
+                    self._missing[(region, ami_id)] += 1
+                    if self._missing[(region, ami_id)] >= self.max_missing_polls:
+                        self.remove(region, ami_id)
+                        self._lost.append((region, ami_id))
+                        self._report('lost', region, ami_id)
+                    log.debug("%s in %s not visible yet", ami_id, region)
+                elif image.state in ('available', 'failed'):
+                    ami_ids.discard(ami_id)
+                    del self._missing[(region, ami_id)]
+                    del self._progress[(region, ami_id)]
+                    finished.append(image)
+                    self._report(image.state, region, ami_id)
+                else:
+                    if self._reporter is None:
+                        log.info("%s in %s not available, waiting...", ami_id, region)
+                    snapshot_id = root_snapshot_id(image)
+                    if snapshot_id:
+                        in_progress[snapshot_id] = ami_id
+
+            if not ami_ids:
+                self._pending.pop(conn, None)
+            elif in_progress and (self._policy.uses_progress or self._reporter is not None):
+                self._poll_progress(conn, in_progress)
+            for ami_id in in_progress.values():
+                self._report('progress', region, ami_id)
+
+        return finished
+
+    def _report(self, event, region, ami_id):
+        if self._reporter is None:
+            return
+        progress = self._progress.get((region, ami_id))
+        if progress is None:
+            self._reporter.event(event, region, ami_id)
+        else:
+            self._reporter.event(event, region, ami_id, percent=progress.percent, rate=progress.rate(), eta=progress.eta())
+
+    def _poll_progress(self, conn, in_progress):
+        ''' Updates copy progress from one DescribeSnapshots call for the region '''
+
+        region = conn.region.name
+        try:
+            snapshots = conn.get_all_snapshots(filters={'snapshot-id': list(in_progress)})
+        except Exception as e:
+            # Progress only informs the poll interval and what is reported,
+            # so the copies are still waited for without it
+            if is_throttling_error(e):
+                self._policy.throttled()
+            else:
+                log.warning('Polling copy progress in %s failed: %s', region, e)
+            return
+        for snapshot in snapshots:
+            progress = self._progress[(region, in_progress[snapshot.id])]
+            progress.update(parse_progress(snapshot.progress))
+            log.debug('%s in %s is %s%% copied', in_progress[snapshot.id], region, progress.percent)
+
+    def next_delay(self):
+        ''' How long to sleep before the next poll, according to the poll policy '''
+
+        return self._policy.next_delay([progress.eta() for progress in self._progress.values()])
+
+    def wait(self):
+        ''' Yields each image as soon as it is available or failed, until none are pending '''
+
+        while self._pending:
+            for image in self.poll():
+                yield image
+            for region, ami_id in self.lost():
+                raise AmiNotFoundException(ami_id, region)
+            for region, ami_id, error in self.failed():
+                raise error
+            if self._pending:
+                time.sleep(self.next_delay())
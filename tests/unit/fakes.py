@@ -0,0 +1,83 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+class FakeClock(object):
+    ''' A clock that stands still unless moved, by setting now, by sleeping, or
+    by step on every reading '''
+
+    def __init__(self, now=1000.0, step=0):
+        self.now = now
+        self.step = step
+        self.slept = 0
+
+    def __call__(self):
+        self.now += self.step
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept += seconds
+        self.now += seconds
+
+
+class FakeRegion(object):
+    def __init__(self, name):
+        self.name = name
+
+
+class FakeAttribute(object):
+    def __init__(self, attrs):
+        self.attrs = attrs
+
+
+class FakeImage(object):
+    ''' An image that moves through the given states, one per poll '''
+
+    def __init__(self, ami_id, states=('available', )):
+        self.id = ami_id
+        self._states = list(states)
+        self.state = None
+
+    def tick(self):
+        if self._states:
+            self.state = self._states.pop(0)
+
+
+class FakeConnection(object):
+    ''' A connection to one region holding the given images, which records
+    the operations called on it and the owners last polled for. Its first
+    DescribeImages calls raise the given errors, one each '''
+
+    def __init__(self, region, images=(), errors=()):
+        self.region = FakeRegion(region)
+        self.images = dict((image.id, image) for image in images)
+        self.errors = list(errors)
+        self.calls = []
+        self.owners = None
+
+    def get_all_images(self, image_ids=None, owners=None, filters=None):
+        self.calls.append('DescribeImages')
+        self.owners = owners
+        if self.errors:
+            raise self.errors.pop(0)
+        for image in self.images.values():
+            image.tick()
+        if isinstance(image_ids, basestring):
+            image_ids = [image_ids]
+        image_ids = image_ids or filters['image-id']
+        return [self.images[ami_id] for ami_id in image_ids if ami_id in self.images]
+
+    def get_image_attribute(self, ami_id, attribute):
+        self.calls.append('DescribeImageAttribute')
+        return FakeAttribute({'groups': ['all']})
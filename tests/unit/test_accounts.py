@@ -0,0 +1,115 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+from boto.exception import EC2ResponseError
+
+from distami import cli
+from distami.accounts import Account, AccountPool, AssumeRoleBackend
+from distami.core import Distami
+from distami.exceptions import *
+from distami.journal import Journal
+from distami.permissions import PermissionPlan
+from distami.pipeline import Pipeline
+from distami.polling import FixedPolicy
+from distami.registry import Registry
+from distami.simulator import SimulatedEC2
+from tests.unit.fakes import FakeClock
+
+
+class AccountTests(unittest.TestCase):
+    def test_parse(self):
+        account = Account.parse('arn:aws:iam::123412341234:role/distami')
+        self.assertEqual((account.account_id, account.role_arn), ('123412341234', 'arn:aws:iam::123412341234:role/distami'))
+        account = Account.parse(' prod:987698769876 ')
+        self.assertEqual((account.account_id, account.profile), ('987698769876', 'prod'))
+        for spec in ('prod', 'prod:1234', 'arn:aws:iam::123412341234:user/bob'):
+            self.assertRaises(DistamiException, Account.parse, spec)
+
+
+class AssumeRoleBackendTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.ec2 = SimulatedEC2()
+        self.assumed = []
+        self.backend = AssumeRoleBackend('arn:aws:iam::222222222222:role/distami', backend=self.ec2,
+                                         assume_role=self.assume_role, connect=self.connect, clock=self.clock)
+
+    def assume_role(self, role_arn, session_name, duration):
+        self.assumed.append(role_arn)
+        return ('key-%d' % len(self.assumed), 'secret', 'token', self.clock() + duration)
+
+    def connect(self, region, credentials):
+        return self.ec2.account('222222222222').connect(region)
+
+    def test_credentials_are_cached_until_they_are_about_to_expire(self):
+        first = self.backend.credentials()
+        self.backend.connect('us-east-1')
+        self.backend.connect('us-west-1')
+        self.assertEqual(len(self.assumed), 1)
+        self.clock.now += 3600 - 300
+        self.assertNotEqual(self.backend.credentials(), first)
+        self.assertEqual(len(self.assumed), 2)
+
+    def test_connections_switch_to_renewed_credentials(self):
+        conn = self.backend.connect('us-east-1')
+        conn.get_all_images(owners=['self'])
+        self.assertEqual(self.ec2.calls['Connect'], 1)
+        self.clock.now += 3600
+        conn.get_all_images(owners=['self'])
+        self.assertEqual(self.ec2.calls['Connect'], 2)
+        self.assertEqual(len(self.assumed), 2)
+
+    def test_unknown_region(self):
+        self.assertIs(self.backend.connect('not-a-real-region'), None)
+        self.assertEqual(self.backend.regions(), self.ec2.regions())
+
+
+class CrossAccountTests(unittest.TestCase):
+    def setUp(self):
+        self.ec2 = SimulatedEC2()
+        source_id = self.ec2.add_image('us-east-1', tags={'Name': 'my-ami'}, data_volumes=1)
+        self.distami = Distami(source_id, 'us-east-1', registry=Registry(backend=self.ec2))
+        self.accounts = [Account('222222222222', profile='staging'), Account('333333333333', profile='prod')]
+        self.pool = AccountPool(self.accounts, lambda account: self.ec2.account(account.account_id))
+        self.journal = Journal()
+
+    def share(self, distami, copied_ami_id, region):
+        Distami(copied_ami_id, region, registry=distami.registry).apply_permissions(PermissionPlan(public=True))
+
+    def test_copies_into_every_account_and_region(self):
+        self.distami.apply_permissions(PermissionPlan(account_ids=[account.account_id for account in self.accounts]))
+        tasks = cli.copy_into_accounts([self.distami], self.pool, ['us-east-1', 'us-west-1'])
+        results = Pipeline(self.journal, self.share, FixedPolicy(0), workers=4).run(tasks)
+
+        self.assertTrue(all(result.succeeded for result in results))
+        self.assertEqual(sorted((result.account_id, result.region) for result in results),
+                         [('222222222222', 'us-east-1'), ('222222222222', 'us-west-1'),
+                          ('333333333333', 'us-east-1'), ('333333333333', 'us-west-1')])
+        for result in results:
+            # Each copy belongs to its account, which tagged and shared it
+            conn = self.pool.registry(Account(result.account_id)).connection(result.region)
+            image = conn.get_all_images(owners=['self'], filters={'image-id': [result.ami_id]})[0]
+            self.assertEqual(image.owner_id, result.account_id)
+            self.assertEqual(image.tags['Name'], 'my-ami')
+            self.assertEqual(self.journal.progress(self.distami.ami_id, result.region, result.account_id),
+                             (Journal.SHARED, result.ami_id))
+        self.assertEqual(self.journal.progress(self.distami.ami_id, 'us-west-1'), (None, None))
+
+    def test_copies_fail_unless_the_source_is_shared(self):
+        tasks = cli.copy_into_accounts([self.distami], self.pool, ['us-west-1'])
+        results = Pipeline(self.journal, self.share, FixedPolicy(0)).run(tasks)
+        self.assertFalse(any(result.succeeded for result in results))
+        self.assertTrue(all(isinstance(result.error, EC2ResponseError) for result in results))
@@ -0,0 +1,118 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+
+import threading
+import unittest
+
+from distami.asynchronous import DistamiAsync, Executor, Future, WaitLoop
+from distami.exceptions import *
+from distami.polling import FixedPolicy
+from distami.registry import Registry
+from distami.simulator import SimulatedEC2
+from distami.waiter import AmiWaiter
+
+
+class FutureTests(unittest.TestCase):
+    def test_callbacks(self):
+        future = Future()
+        called = []
+        future.add_done_callback(called.append)
+        self.assertEqual(called, [])
+        future.set_result(1)
+        future.add_done_callback(called.append)
+        self.assertEqual(called, [future, future])
+        self.assertEqual(future.result(), 1)
+
+    def test_exception_and_timeout(self):
+        future = Future()
+        self.assertRaises(DistamiException, future.result, 0.01)
+        future.set_exception(ValueError('broken'))
+        self.assertRaises(ValueError, future.result)
+        self.assertIsInstance(future.exception(), ValueError)
+
+
+class DistamiAsyncTests(unittest.TestCase):
+    def setUp(self):
+        self.ec2 = SimulatedEC2(regions=40, copy_duration=0.05)
+        self.registry = Registry(backend=self.ec2)
+        self.executor = Executor(4)
+        self.wait_loop = WaitLoop(FixedPolicy(0.01))
+
+    def distami(self):
+        source_id = self.ec2.add_image('sim-1', tags={'Name': 'my-ami'})
+        future = DistamiAsync.load(source_id, 'sim-1', registry=self.registry, executor=self.executor,
+                                   wait_loop=self.wait_loop)
+        return future.result(10)
+
+    def test_load_does_not_block(self):
+        source_id = self.ec2.add_image('sim-1')
+        self.ec2.latency = 0.2
+        future = DistamiAsync.load(source_id, 'sim-1', registry=self.registry, executor=self.executor,
+                                   wait_loop=self.wait_loop)
+        self.assertFalse(future.done())
+        self.assertEqual(future.result(10).ami_id, source_id)
+
+    def test_load_failed_ami(self):
+        future = DistamiAsync.load(self.ec2.add_image('sim-1', state='failed'), 'sim-1', registry=self.registry, executor=self.executor,
+                                   wait_loop=self.wait_loop)
+        self.assertIsInstance(future.exception(10), DistamiException)
+
+    def test_many_copies_share_one_wait_thread(self):
+        distami = self.distami()
+        threads = threading.active_count()
+        handles = [distami.copy_to_region(region) for region in self.ec2.regions()[1:]]
+        copied = [handle.result(10) for handle in handles]
+
+        self.assertEqual(copied, [handle.ami_id for handle in handles])
+        self.assertEqual(len(set(copied)), 39)
+        self.assertLessEqual(threading.active_count(), threads + 1)
+        self.assertEqual(self.ec2.calls['CopyImage'], 39)
+        self.assertEqual(self.ec2.calls['CreateTags'], 2 * 39)
+
+    def test_failed_copy(self):
+        distami = self.distami()
+        self.ec2.failure_rate = 1
+        handle = distami.copy_to_region('sim-2')
+        self.assertRaises(DistamiException, handle.result, 10)
+        self.assertTrue(handle.ami_id.startswith('ami-'))
+
+    def test_region_that_cannot_be_polled_does_not_fail_others(self):
+        distami = self.distami()
+        self.ec2.inject('DescribeImages', 'InternalError', region='sim-2', count=AmiWaiter.max_failed_polls)
+        broken, working = distami.copy_to_region('sim-2'), distami.copy_to_region('sim-3')
+        self.assertEqual(broken.exception(10).error_code, 'InternalError')
+        self.assertEqual(working.result(10), working.ami_id)
+
+    def test_copies_over_the_copy_limit_do_not_hold_executor_threads(self):
+        distami = DistamiAsync(self.distami().distami, Executor(2), self.wait_loop)
+        self.ec2.copy_limit = 1
+        self.ec2.copy_duration = 0.2
+        handles = [distami.copy_to_region('sim-2') for _ in range(3)]
+        # Neither thread is left sleeping until the copy limit allows another copy
+        distami.make_ami_public().result(1)
+        copied = [handle.result(10) for handle in handles]
+
+        self.assertEqual(len(set(copied)), 3)
+        self.assertGreater(self.ec2.calls['CopyImage'], 3)
+
+    def test_permissions(self):
+        distami = self.distami()
+        futures = [distami.make_ami_public(), distami.make_snapshot_public(),
+                   distami.share_ami_with_accounts(['111111111111'])]
+        for future in futures:
+            future.result(10)
+        self.assertEqual(self.registry.launch_permissions('sim-1', distami.ami_id),
+                         {'groups': ['all'], 'user_ids': ['111111111111']})
@@ -0,0 +1,45 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import tempfile
+import unittest
+
+from distami import cli
+from distami.exceptions import *
+
+
+class CliTests(unittest.TestCase):
+    def test_read_manifest(self):
+        fd, path = tempfile.mkstemp()
+        with os.fdopen(fd, 'w') as fh:
+            fh.write('# nightly release\nami-1111aaaa\n\n  ami-2222bbbb  \n')
+        try:
+            self.assertEqual(cli.read_manifest(path), ['ami-1111aaaa', 'ami-2222bbbb'])
+        finally:
+            os.remove(path)
+
+    def test_read_missing_manifest(self):
+        self.assertRaises(DistamiException, cli.read_manifest, '/no/such/manifest')
+
+    def test_unique(self):
+        self.assertEqual(cli.unique(['b', 'a', 'b', 'c', 'a']), ['b', 'a', 'c'])
+
+
+    def test_parse_tags(self):
+        self.assertEqual(cli.parse_tags(['team=infra', ' build = 42 ', 'empty=']),
+                         {'team': 'infra', 'build': '42', 'empty': ''})
+        self.assertEqual(cli.parse_tags(None), {})
+        self.assertRaises(DistamiException, cli.parse_tags, ['no-value'])
@@ -0,0 +1,91 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from distami import config
+from distami.backends import BotoBackend
+from distami.exceptions import *
+from tests.unit.fakes import FakeClock
+
+
+class ConfigTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.environ = dict(os.environ)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        os.environ.clear()
+        os.environ.update(self.environ)
+
+    def write(self, text):
+        path = os.path.join(self.directory, 'config')
+        with open(path, 'w') as fh:
+            fh.write(text)
+        return path
+
+    def test_load_config(self):
+        path = self.write('[distami]\nregion = eu-west-1\nexclude = ap-*, sa-east-1\n')
+        settings = config.load_config(path)
+        self.assertEqual(settings['region'], 'eu-west-1')
+        self.assertEqual(config.split_list(settings['exclude']), ['ap-*', 'sa-east-1'])
+        self.assertEqual(config.load_config(os.path.join(self.directory, 'missing')), {})
+        self.assertRaises(DistamiException, config.load_config, self.write('region = eu-west-1\n'))
+
+    def test_default_region(self):
+        os.environ.pop('AWS_DEFAULT_REGION', None)
+        os.environ.pop('AWS_REGION', None)
+        self.assertEqual(config.get_default_region({}), None)
+        self.assertEqual(config.get_default_region({'region': 'eu-west-1'}), 'eu-west-1')
+        os.environ['AWS_DEFAULT_REGION'] = 'us-west-2'
+        self.assertEqual(config.get_default_region({'region': 'eu-west-1'}), 'us-west-2')
+
+    def test_filter_regions(self):
+        regions = ['us-east-1', 'ap-southeast-1', 'us-gov-west-1', 'cn-north-1']
+        self.assertEqual(config.partition_of('cn-north-1'), 'aws-cn')
+        self.assertEqual(config.filter_regions(regions, ['aws']), ['us-east-1', 'ap-southeast-1'])
+        self.assertEqual(config.filter_regions(regions, ['aws', 'aws-us-gov'], ['ap-*']), ['us-east-1', 'us-gov-west-1'])
+
+
+class RegionCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'cache', 'regions.json')
+        self.clock = FakeClock()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_regions_are_cached_until_they_expire(self):
+        backend = BotoBackend(self.path, cache_ttl=60, clock=self.clock)
+        regions = backend.regions()
+        self.assertIn('us-east-1', regions)
+
+        with open(self.path, 'w') as fh:
+            fh.write('{"time": 1000.0, "regions": ["cached-1"]}')
+        self.assertEqual(BotoBackend(self.path, cache_ttl=60, clock=self.clock).regions(), ['cached-1'])
+        self.clock.now += 61
+        self.assertEqual(BotoBackend(self.path, cache_ttl=60, clock=self.clock).regions(), regions)
+
+    def test_corrupt_cache_is_ignored(self):
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, 'w') as fh:
+            fh.write('{"time": 10')
+        self.assertIn('us-east-1', BotoBackend(self.path, clock=self.clock).regions())
@@ -0,0 +1,135 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import unittest
+
+from collections import Counter
+
+from distami.core import Distami
+from distami.index import SOURCE_AMI_TAG, SOURCE_REGION_TAG
+from distami.registry import Registry
+from distami.simulator import SimulatedEC2
+
+
+class DistamiTests(unittest.TestCase):
+    def setUp(self):
+        self.ec2 = SimulatedEC2()
+        # No caching, so the counts show only what Distami itself avoids
+        self.registry = Registry(ttl=0, backend=self.ec2)
+        self.source_id = self.ec2.add_image('us-east-1', tags={'Name': 'my-ami'}, snapshot_tags={'Name': 'my-snap'})
+
+    def distribute(self, regions):
+        ''' Makes the AMI public and copies it to every region, like the CLI does '''
+
+        distami = Distami(self.source_id, 'us-east-1', registry=self.registry)
+        distami.make_ami_public()
+        distami.make_snapshot_public()
+        for region in regions:
+            copied_ami_id = distami.copy_to_region(region)
+            ami_cp = Distami(copied_ami_id, region, registry=self.registry)
+            ami_cp.make_ami_public()
+            ami_cp.make_snapshot_public()
+
+    def test_api_calls_per_distribution(self):
+        self.distribute(['us-west-1', 'us-west-2'])
+
+        # Before the source image and snapshot were kept on the instance, the
+        # same run made 10 DescribeImages and 5 DescribeSnapshots calls, and
+        # before permissions were planned it read them back 3 more times
+        self.assertEqual(self.ec2.calls, Counter({
+            'Connect': 3,
+            'DescribeImages': 5,
+            'DescribeSnapshots': 1,
+            'DescribeImageAttribute': 3,
+            'ModifyImageAttribute': 3,
+            'ModifySnapshotAttribute': 3,
+            'CopyImage': 2,
+            'CreateTags': 4,
+        }))
+
+    def test_permissions_are_only_changed_when_needed(self):
+        distami = Distami(self.source_id, 'us-east-1', registry=self.registry)
+        self.ec2.calls.clear()
+        distami.make_ami_public()
+        distami.make_ami_public()
+        distami.share_ami_with_accounts(['111111111111', '222222222222'])
+        distami.share_ami_with_accounts(['222222222222'])
+        self.assertEqual(self.ec2.calls, Counter({'ModifyImageAttribute': 2}))
+        self.assertEqual(self.registry.launch_permissions('us-east-1', self.source_id),
+                         {'groups': ['all'], 'user_ids': ['111111111111', '222222222222']})
+
+    def test_multi_volume_ami(self):
+        source_id = self.ec2.add_image('us-east-1', tags={'Name': 'my-ami'}, snapshot_tags={'Name': 'my-snap'},
+                                       data_volumes=2)
+        distami = Distami(source_id, 'us-east-1', registry=self.registry)
+        self.assertEqual(list(distami.snapshot_ids), ['/dev/sda1', '/dev/sdb', '/dev/sdc'])
+        self.ec2.calls.clear()
+
+        distami.make_snapshot_public()
+        copied_ami_id = distami.copy_to_region('us-west-1')
+        # Every snapshot is looked up in one call, and the three snapshots of
+        # the copy share their tags so are tagged in one call
+        self.assertEqual(self.ec2.calls['ModifySnapshotAttribute'], 3)
+        self.assertEqual(self.ec2.calls['DescribeSnapshots'], 1)
+        self.assertEqual(self.ec2.calls['CreateTags'], 2)
+
+        copy = Distami(copied_ami_id, 'us-west-1', registry=self.registry)
+        self.assertEqual(len(copy.snapshots), 3)
+        self.assertTrue(all(snapshot.tags['Name'] == 'my-snap' for snapshot in copy.snapshots.values()))
+
+    def test_copies_get_lineage_and_extra_tags(self):
+        distami = Distami(self.source_id, 'us-east-1', registry=self.registry, extra_tags={'team': 'infra'})
+        self.ec2.calls.clear()
+        copied_ami_id = distami.copy_to_region('us-west-1')
+        # The source tags were read when the AMI was loaded, so tagging the
+        # copy takes one call for the AMI and one for its snapshot
+        self.assertEqual(self.ec2.calls['DescribeSnapshots'], 1)
+        self.assertEqual(self.ec2.calls['CreateTags'], 2)
+
+        lineage = {SOURCE_AMI_TAG: self.source_id, SOURCE_REGION_TAG: 'us-east-1', 'team': 'infra'}
+        copy = Distami(copied_ami_id, 'us-west-1', registry=self.registry)
+        self.assertEqual(copy.image.tags, dict(lineage, Name='my-ami'))
+        self.assertEqual(copy.snapshot.tags, dict(lineage, Name='my-snap'))
+
+    def test_untagged_snapshots_get_only_the_lineage(self):
+        source_id = self.ec2.add_image('us-east-1', tags={'Name': 'my-ami'}, data_volumes=2)
+        distami = Distami(source_id, 'us-east-1', registry=self.registry)
+        self.ec2.calls.clear()
+        copied_ami_id = distami.copy_to_region('us-west-1')
+        # One call for the AMI, and one for its three snapshots
+        self.assertEqual(self.ec2.calls['CreateTags'], 2)
+
+        lineage = {SOURCE_AMI_TAG: source_id, SOURCE_REGION_TAG: 'us-east-1'}
+        copy = Distami(copied_ami_id, 'us-west-1', registry=self.registry)
+        self.assertEqual(copy.image.tags, dict(lineage, Name='my-ami'))
+        self.assertTrue(all(snapshot.tags == lineage for snapshot in copy.snapshots.values()))
+
+    def test_snapshot_is_looked_up_once(self):
+        distami = Distami(self.source_id, 'us-east-1', registry=self.registry)
+        distami.make_snapshot_public()
+        self.assertEqual(self.ec2.calls['DescribeSnapshots'], 0)
+        self.assertEqual(distami.snapshot.tags, {'Name': 'my-snap'})
+        self.assertEqual(distami.snapshot.tags, {'Name': 'my-snap'})
+        self.assertEqual(self.ec2.calls['DescribeSnapshots'], 1)
+
+    def test_refresh(self):
+        distami = Distami(self.source_id, 'us-east-1', registry=self.registry)
+        distami.snapshot
+        self.ec2.calls.clear()
+        distami.refresh()
+        distami.snapshot
+        self.assertEqual(self.ec2.calls['DescribeImages'], 1)
+        self.assertEqual(self.ec2.calls['DescribeSnapshots'], 1)
+        self.assertEqual(self.ec2.calls['DescribeImageAttribute'], 1)
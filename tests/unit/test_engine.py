@@ -0,0 +1,66 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import threading
+import time
+import unittest
+
+from distami.engine import ThreadPool, run_in_threads
+from distami.exceptions import *
+
+
+class EngineTests(unittest.TestCase):
+    def test_results_in_region_order(self):
+        results = run_in_threads(lambda region: 'ami-' + region, ['a', 'b', 'c'])
+        self.assertEqual([result.region for result in results], ['a', 'b', 'c'])
+        self.assertEqual([result.ami_id for result in results], ['ami-a', 'ami-b', 'ami-c'])
+        self.assertTrue(all(result.succeeded for result in results))
+        self.assertTrue(all(result.duration >= 0 for result in results))
+
+    def test_errors_are_recorded_per_region(self):
+        def copy(region):
+            if region == 'bad':
+                raise DistamiException('boom')
+            return 'ami-' + region
+
+        results = run_in_threads(copy, ['good', 'bad'])
+        self.assertTrue(results[0].succeeded)
+        self.assertFalse(results[1].succeeded)
+        self.assertIsInstance(results[1].error, DistamiException)
+
+    def test_concurrency_limit(self):
+        lock = threading.Lock()
+        running = [0]
+        peak = [0]
+
+        def copy(region):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.01)
+            with lock:
+                running[0] -= 1
+
+        run_in_threads(copy, [str(i) for i in range(8)], concurrency=3)
+        self.assertEqual(peak[0], 3)
+
+    def test_no_regions(self):
+        self.assertEqual(run_in_threads(lambda region: None, []), [])
+
+    def test_results_carry_the_task(self):
+        tasks = [('ami-%d' % i, region) for i in range(4) for region in ('us-west-1', 'us-west-2')]
+        results = ThreadPool(concurrency=3).run(lambda ami_id, region: ami_id + '-' + region, tasks)
+        self.assertEqual([result.ami_id for result in results], ['%s-%s' % task for task in tasks])
+        self.assertEqual([result.source_ami_id for result in results], [task[0] for task in tasks])
@@ -0,0 +1,70 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from distami.fanout import CopyTimes, parse_affinity, plan_relays
+from distami.fanout import NEAR_COPY_SECONDS, CONTINENT_COPY_SECONDS, FAR_COPY_SECONDS
+
+
+class CopyTimesTests(unittest.TestCase):
+    def test_estimates_from_affinity(self):
+        times = CopyTimes()
+        self.assertEqual(times.estimate('ap-southeast-1', 'ap-southeast-2'), NEAR_COPY_SECONDS)
+        self.assertEqual(times.estimate('us-east-1', 'us-west-2'), CONTINENT_COPY_SECONDS)
+        self.assertEqual(times.estimate('us-east-1', 'eu-west-1'), FAR_COPY_SECONDS)
+
+        times = CopyTimes(affinity=parse_affinity('us-*, ca-*; eu-*'))
+        self.assertEqual(times.estimate('us-east-1', 'ca-central-1'), NEAR_COPY_SECONDS)
+        self.assertEqual(times.estimate('eu-west-1', 'eu-central-1'), NEAR_COPY_SECONDS)
+
+    def test_measurements_are_blended(self):
+        times = CopyTimes(smoothing=0.5)
+        times.record('us-east-1', 'eu-west-1', 1000)
+        self.assertEqual(times.estimate('us-east-1', 'eu-west-1'), 1000)
+        times.record('us-east-1', 'eu-west-1', 2000)
+        self.assertEqual(times.measured('us-east-1', 'eu-west-1'), 1500)
+        self.assertIs(times.measured('eu-west-1', 'us-east-1'), None)
+
+    def test_save_and_load(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'copy_times.json')
+            times = CopyTimes(path)
+            times.load()
+            times.record('us-east-1', 'eu-west-1', 1000)
+            times.save()
+            times = CopyTimes(path)
+            times.load()
+            self.assertEqual(times.measured('us-east-1', 'eu-west-1'), 1000)
+        finally:
+            shutil.rmtree(directory)
+
+
+class PlanRelaysTests(unittest.TestCase):
+    def test_copies_directly_without_measurements(self):
+        regions = ['us-west-1', 'us-west-2', 'eu-west-1', 'ap-southeast-1', 'ap-southeast-2']
+        self.assertEqual(plan_relays('us-east-1', regions, CopyTimes()), {})
+
+    def test_relays_when_measured_faster(self):
+        times = CopyTimes()
+        times.record('us-east-1', 'ap-southeast-1', 1200)
+        times.record('us-east-1', 'ap-southeast-2', 3000)
+        times.record('us-east-1', 'ap-northeast-1', 1300)
+        relays = plan_relays('us-east-1', ['ap-southeast-1', 'ap-southeast-2', 'ap-northeast-1'], times)
+        # 1200 + 300 + 60 through ap-southeast-1 beats 3000 directly
+        self.assertEqual(relays, {'ap-southeast-2': 'ap-southeast-1'})
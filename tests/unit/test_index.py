@@ -0,0 +1,63 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import unittest
+
+from distami.core import Distami
+from distami.index import CopyIndex, SOURCE_AMI_TAG
+from distami.registry import Registry
+from distami.simulator import SimulatedEC2
+
+
+class CopyIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.ec2 = SimulatedEC2()
+        self.registry = Registry(backend=self.ec2)
+        source_id = self.ec2.add_image('us-east-1')
+        self.distami = Distami(source_id, 'us-east-1', registry=self.registry)
+        self.ec2.calls.clear()
+
+    def test_finds_copy_by_name_and_description(self):
+        copied_id = self.ec2.add_image('us-west-1', state='pending')
+        self.ec2.add_image('us-west-1', name='something-else')
+
+        index = CopyIndex([self.distami])
+        index.build(['us-west-1', 'us-west-2'])
+        self.assertEqual(index.find(self.distami.ami_id, 'us-west-1').id, copied_id)
+        self.assertIs(index.find(self.distami.ami_id, 'us-west-2'), None)
+        self.assertEqual(self.ec2.calls['DescribeImages'], 2)
+
+    def test_source_tag_overrides_name(self):
+        self.ec2.add_image('us-west-1', tags={SOURCE_AMI_TAG: 'ami-someone-else'})
+        index = CopyIndex([self.distami])
+        index.build(['us-west-1'])
+        self.assertIs(index.find(self.distami.ami_id, 'us-west-1'), None)
+
+    def test_finds_copy_by_lineage_tag(self):
+        # A copy whose description has been edited since is still a copy
+        copied_ami_id = self.ec2.add_image('us-west-1', description='Edited since',
+                                           tags={SOURCE_AMI_TAG: self.distami.ami_id})
+        index = CopyIndex([self.distami])
+        index.build(['us-west-1'])
+        self.assertEqual(index.find(self.distami.ami_id, 'us-west-1').id, copied_ami_id)
+
+    def test_prefers_available_copy_and_ignores_failed(self):
+        self.ec2.add_image('us-west-1', state='failed')
+        self.ec2.add_image('us-west-1', state='pending')
+        available_id = self.ec2.add_image('us-west-1')
+
+        index = CopyIndex([self.distami])
+        index.build(['us-west-1'])
+        self.assertEqual(index.find(self.distami.ami_id, 'us-west-1').id, available_id)
@@ -0,0 +1,60 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from distami.journal import Journal
+
+
+class JournalTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'state', 'journal.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_unknown_copy(self):
+        self.assertEqual(Journal(self.path).progress('ami-1', 'us-west-1'), (None, None))
+
+    def test_last_step_wins_after_reload(self):
+        journal = Journal(self.path)
+        journal.record('ami-1', 'us-west-1', Journal.STARTED, 'ami-2')
+        journal.record('ami-1', 'us-west-1', Journal.AVAILABLE, 'ami-2')
+        journal.record('ami-1', 'us-west-2', Journal.STARTED, 'ami-3')
+
+        resumed = Journal(self.path)
+        resumed.load()
+        self.assertEqual(resumed.progress('ami-1', 'us-west-1'), (Journal.AVAILABLE, 'ami-2'))
+        self.assertEqual(resumed.progress('ami-1', 'us-west-2'), (Journal.STARTED, 'ami-3'))
+
+    def test_truncated_line_is_skipped(self):
+        Journal(self.path).record('ami-1', 'us-west-1', Journal.STARTED, 'ami-2')
+        with open(self.path, 'a') as fh:
+            fh.write('{"source": "ami-1", "reg')
+
+        resumed = Journal(self.path)
+        resumed.load()
+        self.assertEqual(resumed.progress('ami-1', 'us-west-1'), (Journal.STARTED, 'ami-2'))
+
+    def test_in_memory_journal(self):
+        journal = Journal()
+        journal.record('ami-1', 'us-west-1', Journal.SHARED, 'ami-2')
+        journal.load()
+        self.assertEqual(journal.progress('ami-1', 'us-west-1'), (Journal.SHARED, 'ami-2'))
+        self.assertEqual(os.listdir(self.directory), [])
@@ -0,0 +1,76 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from boto.exception import EC2ResponseError
+
+from distami.core import Distami
+from distami.journal import Journal
+from distami.metrics import InstrumentedBackend, Metrics
+from distami.pipeline import Pipeline
+from distami.polling import FixedPolicy
+from distami.registry import Registry
+from distami.simulator import SimulatedEC2, ec2_error
+from tests.unit.fakes import FakeClock
+
+
+class MetricsTests(unittest.TestCase):
+    def setUp(self):
+        self.metrics = Metrics(clock=FakeClock(step=0.5))
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_timed_records_outcome(self):
+        with self.metrics.timed('us-west-1', 'CopyImage'):
+            pass
+        with self.assertRaises(EC2ResponseError):
+            with self.metrics.timed('us-west-1', 'CopyImage'):
+                raise ec2_error('RequestLimitExceeded', 503)
+
+        stats = self.metrics.stats('us-west-1', 'CopyImage')
+        self.assertEqual(stats.count, 2)
+        self.assertEqual(stats.total, 1.0)
+        self.assertEqual(stats.outcomes, {'ok': 1, 'RequestLimitExceeded': 1})
+        self.assertEqual(stats.retried, 1)
+
+    def test_prometheus(self):
+        self.metrics.record('us-west-1', 'CopyWait', 90)
+        path = os.path.join(self.directory, 'distami.prom')
+        self.metrics.write_prometheus(path)
+        with open(path) as fh:
+            text = fh.read()
+        self.assertIn('distami_operation_seconds_sum{region="us-west-1",operation="CopyWait"} 90.000000\n', text)
+        self.assertIn('distami_operation_total{region="us-west-1",operation="CopyWait",outcome="ok"} 1\n', text)
+
+    def test_every_call_and_stage_is_instrumented(self):
+        ec2 = SimulatedEC2()
+        metrics = Metrics()
+        registry = Registry(backend=InstrumentedBackend(ec2, metrics))
+        distami = Distami(ec2.add_image('us-east-1', tags={'Name': 'my-ami'}), 'us-east-1', registry=registry)
+        Pipeline(Journal(), lambda *args: None, FixedPolicy(0), metrics=metrics).run([(distami, 'us-west-1')])
+
+        operations = dict(((entry['region'], entry['operation']), entry['count'])
+                          for entry in metrics.to_dict()['operations'])
+        for operation, count in ec2.calls.items():
+            self.assertEqual(sum(n for (region, name), n in operations.items() if name == operation), count)
+        for stage in ('CopyWait', 'Tag', 'Share'):
+            self.assertEqual(operations[('us-west-1', stage)], 1)
@@ -0,0 +1,44 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import unittest
+
+from distami.permissions import MAX_ACCOUNTS_PER_CALL, PermissionPlan
+
+
+class PermissionPlanTests(unittest.TestCase):
+    def test_only_missing_accounts_are_added(self):
+        plan = PermissionPlan(account_ids=['3', '1', '2', '1'])
+        self.assertEqual(plan.changes({'user_ids': ['1']}), [('add', ['2', '3'], None)])
+
+    def test_nothing_to_do(self):
+        plan = PermissionPlan(public=True, account_ids=['1'])
+        self.assertEqual(plan.changes({'groups': ['all'], 'user_ids': ['1']}), [])
+        self.assertEqual(PermissionPlan(public=False).changes({}), [])
+
+    def test_accounts_are_chunked(self):
+        account_ids = ['%012d' % n for n in range(MAX_ACCOUNTS_PER_CALL * 2 + 1)]
+        changes = PermissionPlan(public=True, account_ids=account_ids).changes({})
+        self.assertEqual([len(user_ids) for op, user_ids, groups in changes], [MAX_ACCOUNTS_PER_CALL, MAX_ACCOUNTS_PER_CALL, 1])
+        # Making it public rides along with the first chunk
+        self.assertEqual([groups for op, user_ids, groups in changes], [['all'], None, None])
+
+    def test_without_current_permissions_everything_is_changed(self):
+        self.assertEqual(PermissionPlan(public=True).changes(), [('add', None, ['all'])])
+        self.assertEqual(PermissionPlan(public=False).changes(), [('remove', None, ['all'])])
+
+    def test_result(self):
+        plan = PermissionPlan(public=False, account_ids=['2'])
+        self.assertEqual(plan.result({'groups': ['all'], 'user_ids': ['1']}), {'user_ids': ['1', '2']})
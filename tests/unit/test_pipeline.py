@@ -0,0 +1,164 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import unittest
+
+from distami.core import Distami
+from distami.exceptions import *
+from distami.fanout import CopyTimes
+from distami.journal import Journal
+from distami.pipeline import Pipeline
+from distami.polling import FixedPolicy
+from distami.registry import Registry
+from distami.simulator import SimulatedEC2
+from distami.waiter import AmiWaiter
+
+
+class PipelineTests(unittest.TestCase):
+    def setUp(self):
+        self.ec2 = SimulatedEC2()
+        self.registry = Registry(backend=self.ec2)
+        source_id = self.ec2.add_image('us-east-1', tags={'Name': 'my-ami'})
+        self.distami = Distami(source_id, 'us-east-1', registry=self.registry)
+        self.journal = Journal()
+        self.shared = []
+
+    def share(self, distami, copied_ami_id, region):
+        if region == 'ap-northeast-1':
+            raise ValueError('cannot share')
+        self.shared.append((region, copied_ami_id))
+
+    def pipeline(self, **kwargs):
+        return Pipeline(self.journal, self.share, FixedPolicy(0), **kwargs)
+
+    def test_every_copy_goes_through_every_stage(self):
+        regions = ['us-west-1', 'us-west-2', 'eu-west-1']
+        results = self.pipeline(workers=2).run([(self.distami, region) for region in regions])
+
+        self.assertTrue(all(result.succeeded for result in results))
+        self.assertEqual(sorted(self.shared), sorted((result.region, result.ami_id) for result in results))
+        self.assertEqual(self.ec2.calls['CopyImage'], 3)
+        for result in results:
+            self.assertEqual(self.journal.progress(self.distami.ami_id, result.region), (Journal.SHARED, result.ami_id))
+
+    def test_one_failure_does_not_stop_the_rest(self):
+        results = self.pipeline(per_region=1).run([(self.distami, 'ap-northeast-1'), (self.distami, 'us-west-1')])
+        self.assertFalse(results[0].succeeded)
+        self.assertIsInstance(results[0].error, ValueError)
+        self.assertTrue(results[1].succeeded)
+
+    def test_resume_does_not_copy_again(self):
+        tags = dict(self.distami.copy_tags, Name='my-ami')
+        started_id = self.ec2.add_image('us-west-1')
+        tagged_id = self.ec2.add_image('us-west-2', tags=tags)
+        shared_id = self.ec2.add_image('sa-east-1', tags=tags)
+        self.journal.record(self.distami.ami_id, 'us-west-1', Journal.STARTED, started_id)
+        self.journal.record(self.distami.ami_id, 'us-west-2', Journal.TAGGED, tagged_id)
+        self.journal.record(self.distami.ami_id, 'sa-east-1', Journal.SHARED, shared_id)
+        self.ec2.calls.clear()
+
+        tasks = [(self.distami, region) for region in ('us-west-1', 'us-west-2', 'sa-east-1')]
+        results = self.pipeline().run(tasks)
+        self.assertEqual([result.ami_id for result in results], [started_id, tagged_id, shared_id])
+        self.assertEqual(self.ec2.calls['CopyImage'], 0)
+        # Only the copy that was still in progress needs its tags, one call
+        # for the AMI and one for its snapshot
+        self.assertEqual(self.ec2.calls['CreateTags'], 2)
+        # Every copy has its permissions checked, in case they were changed
+        self.assertEqual(sorted(self.shared), sorted(zip(('us-west-1', 'us-west-2', 'sa-east-1'),
+                                                         (started_id, tagged_id, shared_id))))
+
+    def test_resume_copies_again_once_the_copy_has_gone(self):
+        self.journal.record(self.distami.ami_id, 'us-west-1', Journal.SHARED, 'ami-gone')
+        result, = self.pipeline().run([(self.distami, 'us-west-1')])
+        self.assertTrue(result.succeeded)
+        self.assertNotEqual(result.ami_id, 'ami-gone')
+        self.assertEqual(self.ec2.calls['CopyImage'], 1)
+
+    def test_journaled_copy_gets_the_tags_of_each_task(self):
+        shared_id = self.ec2.add_image('us-west-1', tags=dict(self.distami.copy_tags, Name='my-ami'))
+        self.journal.record(self.distami.ami_id, 'us-west-1', Journal.SHARED, shared_id)
+        tagged = Distami(self.distami.ami_id, 'us-east-1', registry=self.registry, extra_tags={'Team': 'web'})
+
+        result, = self.pipeline().run([(tagged, 'us-west-1')])
+        self.assertEqual(result.ami_id, shared_id)
+        self.assertEqual(self.registry.connection('us-west-1').get_all_images([shared_id])[0].tags['Team'], 'web')
+
+    def test_tasks_for_a_copy_in_flight_follow_it(self):
+        # The second task comes along while CopyImage is still being called
+        self.ec2.latency = lambda operation: 0.2 if operation == 'CopyImage' else 0
+        tagged = Distami(self.distami.ami_id, 'us-east-1', registry=self.registry, extra_tags={'Team': 'web'})
+        pipeline = self.pipeline()
+        pipeline.start()
+        try:
+            results = pipeline.submit([(self.distami, 'us-west-1')]) + pipeline.submit([(tagged, 'us-west-1')])
+            self.assertTrue(pipeline.wait(results, 10))
+        finally:
+            pipeline.close()
+
+        self.assertTrue(all(result.succeeded for result in results))
+        self.assertEqual(results[0].ami_id, results[1].ami_id)
+        self.assertEqual(self.ec2.calls['CopyImage'], 1)
+        self.assertEqual(self.shared, [('us-west-1', results[0].ami_id)] * 2)
+        self.assertEqual(self.registry.connection('us-west-1').get_all_images([results[0].ami_id])[0].tags['Team'], 'web')
+
+    def test_tasks_following_a_failed_copy_fail_with_it(self):
+        self.ec2.failure_rate = 1
+        pipeline = self.pipeline()
+        pipeline.start()
+        try:
+            results = pipeline.submit([(self.distami, 'us-west-1')] * 2)
+            self.assertTrue(pipeline.wait(results, 10))
+        finally:
+            pipeline.close()
+        self.assertTrue(all(isinstance(result.error, DistamiException) for result in results))
+        self.assertEqual(self.ec2.calls['CopyImage'], 1)
+
+    def test_region_that_cannot_be_polled_does_not_fail_others(self):
+        self.ec2.inject('DescribeImages', 'InternalError', region='us-west-1', count=AmiWaiter.max_failed_polls)
+        self.ec2.inject('DescribeImages', 'InternalError', region='us-west-2', count=1)
+        results = self.pipeline().run([(self.distami, region) for region in ('us-west-1', 'us-west-2', 'eu-west-1')])
+        self.assertEqual(results[0].error.error_code, 'InternalError')
+        self.assertTrue(results[1].succeeded)
+        self.assertTrue(results[2].succeeded)
+
+    def test_relayed_copy_starts_from_available_copy(self):
+        copy_times = CopyTimes()
+        results = self.pipeline(copy_times=copy_times).run(
+            [(self.distami, 'us-west-2'), (self.distami, 'us-west-1')], {'us-west-2': 'us-west-1'})
+        self.assertTrue(all(result.succeeded for result in results))
+        self.assertEqual([result.copied_from for result in results], ['us-west-1', None])
+        self.assertIsNot(copy_times.measured('us-west-1', 'us-west-2'), None)
+        self.assertIsNot(copy_times.measured('us-east-1', 'us-west-1'), None)
+
+    def test_relayed_copy_falls_back_to_the_source(self):
+        self.ec2.inject('CopyImage', 'InvalidParameterValue', region='us-west-1')
+        results = self.pipeline().run([(self.distami, 'us-west-1'), (self.distami, 'us-west-2')],
+                                      {'us-west-2': 'us-west-1'})
+        self.assertFalse(results[0].succeeded)
+        self.assertTrue(results[1].succeeded)
+        self.assertIs(results[1].copied_from, None)
+
+    def test_region_at_copy_limit_does_not_hold_up_others(self):
+        self.ec2.copy_limit = 1
+        self.ec2.copy_duration = 0.2
+        other = Distami(self.ec2.add_image('us-east-1'), 'us-east-1', registry=self.registry)
+        tasks = [(self.distami, 'us-west-1'), (other, 'us-west-1'), (self.distami, 'us-west-2')]
+        results = self.pipeline().run(tasks)
+
+        self.assertTrue(all(result.succeeded for result in results))
+        # The copy into us-west-2 started while the second copy into
+        # us-west-1 waited for the first to finish
+        self.assertTrue(results[2].finished < results[1].finished)
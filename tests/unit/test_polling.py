@@ -0,0 +1,111 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import unittest
+
+from boto.exception import EC2ResponseError
+
+from distami.polling import *
+from distami.simulator import ec2_error
+from tests.unit.fakes import FakeClock
+
+
+class Flaky(object):
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self, value):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return value
+
+
+class PollingTests(unittest.TestCase):
+    def test_parse_progress(self):
+        self.assertEqual(parse_progress('45%'), 45)
+        self.assertEqual(parse_progress('100%'), 100)
+        self.assertEqual(parse_progress(''), None)
+
+    def test_eta_from_progress_rate(self):
+        clock = FakeClock()
+        progress = CopyProgress(clock)
+        self.assertEqual(progress.eta(), None)
+        progress.update(20)
+        self.assertEqual(progress.eta(), None)
+        clock.now += 60
+        progress.update(40)
+        self.assertAlmostEqual(progress.eta(), 180.0)
+        clock.now += 30
+        self.assertAlmostEqual(progress.eta(), 150.0)
+
+    def test_adaptive_polls_near_completion(self):
+        policy = AdaptivePolicy(min_interval=5, max_interval=120, jitter=0)
+        self.assertEqual(policy.next_delay([100.0, None]), 50.0)
+        self.assertEqual(policy.next_delay([4.0]), 5)
+
+    def test_adaptive_backs_off_without_progress(self):
+        policy = AdaptivePolicy(min_interval=5, max_interval=30, jitter=0)
+        delays = [policy.next_delay([None]) for _ in range(4)]
+        self.assertEqual(delays, [5, 10, 20, 30])
+
+    def test_adaptive_backs_off_when_throttled(self):
+        policy = AdaptivePolicy(min_interval=5, max_interval=120, jitter=0)
+        policy.next_delay([None])
+        policy.throttled()
+        self.assertEqual(policy.next_delay([2.0]), 10)
+
+    def test_backoff_is_capped(self):
+        for attempt in range(1, 10):
+            self.assertTrue(0 <= backoff(attempt, base=2, cap=30) <= 30)
+
+    def test_backoff_has_a_floor(self):
+        for attempt in range(1, 10):
+            self.assertTrue(5 <= backoff(attempt, base=5, cap=30, floor=5) <= 30)
+
+    def test_retry_throttled_calls(self):
+        retry = Retry(('RequestLimitExceeded', ), attempts=3, base=0, cap=0)
+        func = Flaky(ec2_error('RequestLimitExceeded'), ec2_error('RequestLimitExceeded'))
+        self.assertEqual(retry(func, 'ok'), 'ok')
+        self.assertEqual(func.calls, 3)
+
+    def test_retry_gives_up(self):
+        retry = Retry(('RequestLimitExceeded', ), attempts=2, base=0, cap=0)
+        func = Flaky(ec2_error('RequestLimitExceeded'), ec2_error('RequestLimitExceeded'))
+        self.assertRaises(EC2ResponseError, retry, func, 'ok')
+        self.assertEqual(func.calls, 2)
+
+    def test_retry_ignores_other_errors(self):
+        retry = Retry(('RequestLimitExceeded', ), attempts=5, base=0, cap=0)
+        func = Flaky(ec2_error('InvalidAMIID.NotFound'))
+        self.assertRaises(EC2ResponseError, retry, func, 'ok')
+        self.assertEqual(func.calls, 1)
+
+    def test_retry_through_inner(self):
+        inner = Retry(('RequestLimitExceeded', ), attempts=3, base=0, cap=0)
+        retry = Retry(('ResourceLimitExceeded', ), attempts=3, base=0, cap=0, inner=inner)
+        func = Flaky(ec2_error('RequestLimitExceeded'), ec2_error('ResourceLimitExceeded'),
+                     ec2_error('RequestLimitExceeded'))
+        self.assertEqual(retry(func, 'ok'), 'ok')
+        self.assertEqual(func.calls, 4)
+
+    def test_copies_are_retried_over_the_copy_limit(self):
+        self.assertTrue('ResourceLimitExceeded' in retry_copy.error_codes)
+        self.assertFalse('ResourceLimitExceeded' in retry_throttled.error_codes)
+
+    def test_throttled_copies_get_the_short_backoff(self):
+        self.assertFalse('RequestLimitExceeded' in retry_copy.error_codes)
+        self.assertTrue(retry_copy.inner is retry_throttled)
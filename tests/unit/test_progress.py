@@ -0,0 +1,89 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+
+import json
+import unittest
+
+from StringIO import StringIO
+
+from distami.polling import FixedPolicy
+from distami.progress import JsonProgress, Progress, TableProgress
+from distami.simulator import SimulatedEC2
+from distami.waiter import AmiWaiter
+from tests.unit.fakes import FakeClock
+
+
+class ProgressTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def test_regions_summary(self):
+        progress = Progress(stall_after=300, clock=self.clock)
+        progress.event('started', 'us-west-1', 'ami-1', 'ami-source')
+        progress.event('started', 'us-west-1', 'ami-2', 'ami-source')
+        progress.event('progress', 'us-west-1', 'ami-1', percent=40, rate=0.1, eta=600)
+        progress.event('progress', 'us-west-1', 'ami-2', percent=70, rate=0.2, eta=150)
+        progress.event('failed', 'eu-west-1', None, 'ami-source')
+
+        eu, west = progress.regions()
+        self.assertEqual((west['copies'], west['finished'], west['percent'], west['eta']), (2, 0, 40, 600))
+        self.assertEqual((eu['copies'], eu['failed']), (1, 1))
+
+    def test_stalled(self):
+        progress = Progress(stall_after=300, clock=self.clock)
+        progress.event('progress', 'us-west-1', 'ami-1', percent=40)
+        self.clock.now += 301
+        progress.event('progress', 'us-west-1', 'ami-1', percent=40)
+        self.assertTrue(progress.regions()[0]['stalled'])
+        progress.event('progress', 'us-west-1', 'ami-1', percent=41)
+        self.assertFalse(progress.regions()[0]['stalled'])
+
+    def test_json(self):
+        stream = StringIO()
+        progress = JsonProgress(stream, clock=self.clock)
+        progress.event('started', 'us-west-1', 'ami-1', 'ami-source')
+        progress.event('shared', 'us-west-1', 'ami-1')
+        events = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual([event['event'] for event in events], ['started', 'shared'])
+        self.assertEqual(events[1]['source_ami_id'], 'ami-source')
+        self.assertEqual(events[1]['percent'], 100)
+
+    def test_table(self):
+        stream = StringIO()
+        progress = TableProgress(stream, clock=self.clock)
+        progress.event('progress', 'us-west-1', 'ami-1', percent=50, rate=0.5, eta=100)
+        progress.close()
+        lines = stream.getvalue().splitlines()
+        self.assertEqual(lines[-2].split(), ['us-west-1', '0/1', '50%', '30.0%/m', '0:01:40', 'copying'])
+        self.assertEqual(lines[-1], '0 of 1 copies finished')
+
+
+class WaiterProgressTests(unittest.TestCase):
+    def test_waiter_reports_snapshot_progress(self):
+        clock = FakeClock()
+        ec2 = SimulatedEC2(copy_duration=100, clock=clock)
+        conn = ec2.connect('us-west-1')
+        copied_id = conn.copy_image('us-east-1', ec2.add_image('us-east-1')).image_id
+
+        progress = Progress(clock=clock)
+        waiter = AmiWaiter(FixedPolicy(0), progress)
+        waiter.add(conn, copied_id)
+        clock.now += 25
+        waiter.poll()
+        self.assertEqual(progress.copies()[0]['percent'], 25)
+        clock.now += 75
+        waiter.poll()
+        self.assertEqual(progress.copies()[0]['state'], 'tagging')
@@ -0,0 +1,132 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+from distami.exceptions import *
+from distami.index import SOURCE_AMI_TAG
+from distami.prune import Pruner, RateLimit, RetentionPolicy, format_plan
+from distami.registry import Registry
+from distami.simulator import SimulatedEC2
+from tests.unit.fakes import FakeClock
+
+DAY = 24 * 60 * 60
+NOW = 1500000000.0
+
+
+class PruneTests(unittest.TestCase):
+    def setUp(self):
+        self.ec2 = SimulatedEC2(regions=['us-east-1', 'us-west-1', 'us-west-2'])
+        self.registry = Registry(backend=self.ec2)
+        self.pruner = Pruner(self.registry, rate=0)
+
+    def copy(self, region, days_old, name='my-ami', source='ami-source', state='available', **tags):
+        tags.setdefault('Name', name)
+        tags[SOURCE_AMI_TAG] = source
+        return self.ec2.add_image(region, name=name, tags=dict((key, value) for key, value in tags.items() if value),
+                                  created=NOW - days_old * DAY, data_volumes=1, state=state)
+
+    def policy(self, **kwargs):
+        return RetentionPolicy(clock=lambda: NOW, **kwargs)
+
+    def test_keep_last_per_name_in_each_region(self):
+        old, middle, new = [self.copy('us-west-1', days) for days in (30, 20, 10)]
+        # The only copies with their Name in their region
+        self.copy('us-west-1', 40, name='other-ami')
+        self.copy('us-west-2', 50)
+        plan = self.pruner.plan(['us-west-1', 'us-west-2'], self.policy(keep_last=2))
+        self.assertEqual([item.ami_id for item in plan], [old])
+
+    def test_untagged_copies_are_grouped_by_source(self):
+        # AMI names are unique, so each build of a source has its own
+        old, new = [self.copy('us-west-1', days, name='my-ami-%d' % days, Name=None) for days in (30, 10)]
+        other = self.copy('us-west-1', 40, name='other-ami', source='ami-other', Name=None)
+        plan = self.pruner.plan(['us-west-1'], self.policy(keep_last=1))
+        self.assertEqual([item.ami_id for item in plan], [old])
+        self.assertEqual(sorted(self.ec2.images()), sorted([old, new, other]))
+
+    def test_group_by_another_tag(self):
+        old, new = [self.copy('us-west-1', days, name='my-ami-%d' % days, source='ami-%d' % days, family='my-ami')
+                    for days in (30, 10)]
+        plan = self.pruner.plan(['us-west-1'], self.policy(keep_last=1, group_by='family'))
+        self.assertEqual([item.ami_id for item in plan], [old])
+        self.assertEqual(self.pruner.plan(['us-west-1'], self.policy(keep_last=1)), [])
+
+    def test_keep_days(self):
+        old = self.copy('us-west-1', 30)
+        self.copy('us-west-1', 5)
+        plan = self.pruner.plan(['us-west-1'], self.policy(keep_days=7))
+        self.assertEqual([item.ami_id for item in plan], [old])
+        # Either rule keeps a copy
+        self.assertEqual(self.pruner.plan(['us-west-1'], self.policy(keep_last=2, keep_days=7)), [])
+
+    def test_failed_copies_do_not_count_towards_keep_last(self):
+        old, new = [self.copy('us-west-1', days) for days in (30, 20)]
+        failed = self.copy('us-west-1', 10, state='failed')
+        plan = self.pruner.plan(['us-west-1'], self.policy(keep_last=2))
+        self.assertEqual([item.ami_id for item in plan], [failed])
+        # Failed copies are never kept, however new
+        plan = self.pruner.plan(['us-west-1'], self.policy(keep_last=1, keep_days=45))
+        self.assertEqual([item.ami_id for item in plan], [failed])
+
+    def test_families_with_a_copy_in_flight_keep_their_available_copies(self):
+        self.copy('us-west-1', 30)
+        failed = self.copy('us-west-1', 20, state='failed')
+        self.copy('us-west-1', 0, state='pending')
+        old = self.copy('us-west-1', 40, name='other-ami')
+        self.copy('us-west-1', 10, name='other-ami')
+        plan = self.pruner.plan(['us-west-1'], self.policy(keep_last=1))
+        self.assertEqual([item.ami_id for item in plan], [old, failed])
+
+    def test_only_copies_are_pruned(self):
+        self.ec2.add_image('us-east-1', created=NOW - 100 * DAY)
+        self.ec2.add_image('us-west-1', state='pending', tags={SOURCE_AMI_TAG: 'ami-source'}, created=NOW - 100 * DAY)
+        self.assertEqual(self.pruner.plan(['us-east-1', 'us-west-1'], self.policy(keep_days=1)), [])
+
+    def test_prune_deletes_images_and_snapshots(self):
+        doomed = [self.copy(region, 30) for region in ('us-west-1', 'us-west-2')]
+        kept = self.copy('us-west-1', 1)
+        plan = self.pruner.plan(['us-west-1', 'us-west-2'], self.policy(keep_days=7))
+        self.assertEqual([item.ami_id for item in plan], doomed)
+        self.assertEqual(len(format_plan(plan).splitlines()), 2)
+        self.assertEqual(self.pruner.prune(plan), [])
+
+        self.assertEqual(self.ec2.images(), [kept])
+        self.assertEqual(self.ec2.calls['DeregisterImage'], 2)
+        self.assertEqual(self.ec2.calls['DeleteSnapshot'], 4)
+        self.assertEqual(self.ec2.calls['DescribeImages'], 2)
+
+    def test_one_failure_does_not_stop_the_rest(self):
+        first = self.copy('us-west-1', 30)
+        self.copy('us-west-1', 20)
+        self.ec2.inject('DeregisterImage', 'InvalidAMIID.Unavailable')
+        plan = self.pruner.plan(['us-west-1'], self.policy(keep_days=7))
+        failed = self.pruner.prune(plan)
+        self.assertEqual([item.ami_id for item in failed], [first])
+        self.assertEqual(self.ec2.images(), [first])
+
+    def test_policy_needs_a_rule(self):
+        self.assertRaises(DistamiException, RetentionPolicy)
+
+    def test_policy_keeps_at_least_the_last_copy(self):
+        self.assertRaises(DistamiException, RetentionPolicy, keep_last=0)
+
+
+class RateLimitTests(unittest.TestCase):
+    def test_spaces_out_calls(self):
+        clock = FakeClock(NOW)
+        limit = RateLimit(4, clock, clock.sleep)
+        for _ in range(5):
+            limit.wait()
+        self.assertEqual(clock.slept, 1)
@@ -0,0 +1,64 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import unittest
+
+from distami.exceptions import *
+from distami.registry import Registry
+from tests.unit.fakes import FakeClock, FakeConnection, FakeImage
+
+
+class RegistryTests(unittest.TestCase):
+    def setUp(self):
+        self.conns = []
+        self.clock = FakeClock(0)
+        self.registry = Registry(ttl=60, backend=self, clock=self.clock)
+
+    def connect(self, region):
+        if region == 'not-a-real-region':
+            return None
+        conn = FakeConnection(region, [FakeImage('ami-1')])
+        self.conns.append(conn)
+        return conn
+
+    def test_one_connection_per_region(self):
+        conn = self.registry.connection('us-east-1')
+        self.assertIs(self.registry.connection('us-east-1'), conn)
+        self.assertIsNot(self.registry.connection('us-west-1'), conn)
+        self.assertEqual(len(self.conns), 2)
+
+    def test_unknown_region(self):
+        self.assertRaises(DistamiException, self.registry.connection, 'not-a-real-region')
+
+    def test_lookups_are_cached_until_ttl(self):
+        image = self.registry.image('us-east-1', 'ami-1')
+        self.assertIs(self.registry.image('us-east-1', 'ami-1'), image)
+        self.assertEqual(self.conns[0].calls, ['DescribeImages'])
+
+        self.clock.now = 61
+        self.registry.image('us-east-1', 'ami-1')
+        self.assertEqual(self.conns[0].calls, ['DescribeImages', 'DescribeImages'])
+
+    def test_invalidate_by_kind(self):
+        self.registry.image('us-east-1', 'ami-1')
+        self.registry.launch_permissions('us-east-1', 'ami-1')
+        self.registry.invalidate('us-east-1', 'ami-1', 'launch_permissions')
+        self.registry.image('us-east-1', 'ami-1')
+        self.registry.launch_permissions('us-east-1', 'ami-1')
+        self.assertEqual(self.conns[0].calls, ['DescribeImages', 'DescribeImageAttribute', 'DescribeImageAttribute'])
+
+        self.registry.invalidate('us-east-1', 'ami-1')
+        self.registry.image('us-east-1', 'ami-1')
+        self.assertEqual(self.conns[0].calls[-1], 'DescribeImages')
@@ -0,0 +1,164 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import threading
+import unittest
+import urllib2
+
+from distami.exceptions import *
+from distami.journal import Journal
+from distami.polling import FixedPolicy
+from distami.registry import Registry
+from distami.service import Job, Service, serve
+from distami.simulator import SimulatedEC2
+
+
+class ServiceTests(unittest.TestCase):
+    def setUp(self):
+        self.ec2 = SimulatedEC2(copy_duration=0.2)
+        self.registry = Registry(backend=self.ec2)
+        self.journal = Journal()
+        self.service = Service(self.registry, FixedPolicy(0.05), self.journal, workers=2, exclude=['ap-*'])
+
+    def submit(self, **spec):
+        spec.setdefault('ami_ids', [self.ec2.add_image('us-east-1', tags={'Name': 'my-ami'})])
+        spec.setdefault('region', 'us-east-1')
+        return self.service.submit(spec)
+
+    def test_job_copies_and_shares(self):
+        job = self.submit(to=['us-west-1', 'us-west-2'], accounts=['123412341234'])
+        self.assertTrue(job.wait(10))
+        self.assertEqual(job.state, Job.SUCCEEDED)
+        status = job.to_dict()
+        self.assertEqual([copy['state'] for copy in status['copies']], ['succeeded', 'succeeded'])
+        for copy in status['copies']:
+            conn = self.registry.connection(copy['region'])
+            self.assertEqual(conn.get_image_attribute(copy['ami_id']).attrs, {'user_ids': ['123412341234']})
+
+    def test_jobs_use_the_journal_and_region_filters(self):
+        job = self.submit(to='all')
+        self.assertTrue(job.wait(10))
+        regions = [copy.region for copy in job.copies]
+        self.assertTrue('us-west-1' in regions)
+        self.assertFalse(any(region.startswith('ap-') for region in regions))
+        for copy in job.copies:
+            self.assertEqual(self.journal.progress(copy.source_ami_id, copy.region), (Journal.SHARED, copy.ami_id))
+
+    def polls(self, jobs):
+        ''' DescribeImages calls made polling the copies of some jobs that
+        each copy an AMI to every region '''
+
+        ec2 = SimulatedEC2(copy_duration=0.3)
+        service = Service(Registry(backend=ec2), FixedPolicy(0.05), workers=jobs)
+        specs = [{'ami_ids': [ec2.add_image('us-east-1')], 'region': 'us-east-1'} for _ in range(jobs)]
+        submitted = [service.submit(spec) for spec in specs]
+        self.assertTrue(all(job.wait(10) and job.state == Job.SUCCEEDED for job in submitted))
+        return ec2.calls['DescribeImages'] - jobs
+
+    def test_concurrent_jobs_share_polling(self):
+        # Every poll covers the copies of all the jobs, so four jobs at once
+        # cost about what one does, rather than four times as much
+        self.assertLess(self.polls(4), 2 * self.polls(1))
+
+    def test_later_jobs_apply_their_own_permissions_and_tags(self):
+        source_id = self.ec2.add_image('us-east-1', tags={'Name': 'my-ami'})
+        first = self.submit(ami_ids=[source_id], to=['us-west-1'], accounts=['123412341234'])
+        self.assertTrue(first.wait(10))
+        second = self.submit(ami_ids=[source_id], to=['us-west-1'], accounts=['432143214321'], tags={'Team': 'web'})
+        self.assertTrue(second.wait(10))
+
+        self.assertEqual(second.state, Job.SUCCEEDED)
+        copied_ami_id = second.copies[0].ami_id
+        self.assertEqual(copied_ami_id, first.copies[0].ami_id)
+        self.assertEqual(self.ec2.calls['CopyImage'], 1)
+        conn = self.registry.connection('us-west-1')
+        self.assertTrue('432143214321' in conn.get_image_attribute(copied_ami_id).attrs['user_ids'])
+        self.assertEqual(conn.get_all_images([copied_ami_id])[0].tags['Team'], 'web')
+
+    def test_deleted_copies_are_copied_again(self):
+        source_id = self.ec2.add_image('us-east-1', tags={'Name': 'my-ami'})
+        first = self.submit(ami_ids=[source_id], to=['us-west-1'])
+        self.assertTrue(first.wait(10))
+        self.registry.connection('us-west-1').deregister_image(first.copies[0].ami_id)
+        second = self.submit(ami_ids=[source_id], to=['us-west-1'])
+        self.assertTrue(second.wait(10))
+
+        self.assertEqual(second.state, Job.SUCCEEDED)
+        self.assertNotEqual(second.copies[0].ami_id, first.copies[0].ami_id)
+        self.assertEqual(self.ec2.calls['CopyImage'], 2)
+
+    def test_concurrent_jobs_make_one_copy(self):
+        source_id = self.ec2.add_image('us-east-1', tags={'Name': 'my-ami'})
+        # Both jobs get as far as copying while CopyImage is still being called
+        self.ec2.latency = lambda operation: 0.5 if operation == 'CopyImage' else 0
+        jobs = [self.submit(ami_ids=[source_id], to=['us-west-1'], tags={'Job': str(n)}) for n in range(2)]
+        self.assertTrue(all(job.wait(10) and job.state == Job.SUCCEEDED for job in jobs))
+        self.assertEqual(jobs[0].copies[0].ami_id, jobs[1].copies[0].ami_id)
+        self.assertEqual(self.ec2.calls['CopyImage'], 1)
+
+    def test_failed_job(self):
+        job = self.submit(ami_ids=[self.ec2.add_image('us-east-1', state='failed')], to='none')
+        self.assertTrue(job.wait(10))
+        self.assertEqual(job.state, Job.FAILED)
+        self.assertTrue(job.error)
+
+    def test_invalid_jobs(self):
+        valid = {'ami_ids': ['ami-1'], 'region': 'us-east-1'}
+        for invalid in [{'region': 'us-east-1'}, dict(valid, to=5), dict(valid, ami_ids=[1]),
+                        dict(valid, accounts='123412341234'), dict(valid, accounts=['1234']),
+                        dict(valid, tags=['x']), dict(valid, tags={'team': 5})]:
+            self.assertRaises(DistamiException, self.service.submit, invalid)
+        self.assertEqual(self.service.jobs(), [])
+        self.assertEqual(self.submit(to='none').id, '1')
+
+
+class ServerTests(unittest.TestCase):
+    def setUp(self):
+        self.ec2 = SimulatedEC2()
+        self.service = Service(Registry(backend=self.ec2), FixedPolicy(0.01), workers=1)
+        self.server = serve(self.service, ('127.0.0.1', 0))
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def request(self, path, body=None):
+        data = json.dumps(body) if body is not None else None
+        try:
+            response = urllib2.urlopen(self.url + path, data)
+        except urllib2.HTTPError as e:
+            return e.code, json.loads(e.read())
+        return response.getcode(), json.loads(response.read())
+
+    def test_submit_and_get_status(self):
+        source_id = self.ec2.add_image('us-east-1')
+        status, job = self.request('/jobs', {'ami_ids': [source_id], 'region': 'us-east-1', 'to': ['us-west-1']})
+        self.assertEqual(status, 202)
+        self.assertTrue(self.service.job(job['id']).wait(10))
+
+        status, job = self.request('/jobs/%s' % job['id'])
+        self.assertEqual((status, job['state']), (200, 'succeeded'))
+        self.assertEqual(job['copies'][0]['region'], 'us-west-1')
+        self.assertEqual(self.request('/jobs')[1], [job])
+
+    def test_errors(self):
+        self.assertEqual(self.request('/jobs/42')[0], 404)
+        self.assertEqual(self.request('/jobs', {'region': 'us-east-1'})[0], 400)
+        self.assertEqual(self.request('/jobs', {'ami_ids': [None], 'region': 'us-east-1'})[0], 400)
+        self.assertEqual(self.request('/jobs')[1], [])
@@ -0,0 +1,101 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+
+import unittest
+
+from boto.exception import EC2ResponseError
+
+from distami import utils
+from distami.core import Distami
+from distami.journal import Journal
+from distami.pipeline import Pipeline
+from distami.polling import FixedPolicy
+from distami.registry import Registry
+from distami.simulator import SimulatedEC2
+from tests.unit.fakes import FakeClock
+
+
+class SimulatorTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.ec2 = SimulatedEC2(regions=['us-east-1', 'us-west-1'], copy_duration=100, clock=self.clock)
+        self.source_id = self.ec2.add_image('us-east-1', tags={'Name': 'my-ami'})
+        self.west = self.ec2.connect('us-west-1')
+
+    def test_copy_takes_copy_duration(self):
+        copied_id = self.west.copy_image('us-east-1', self.source_id).image_id
+        image = self.west.get_all_images(filters={'image-id': [copied_id]})[0]
+        self.assertEqual(image.state, 'pending')
+        self.clock.now += 50
+        snapshot_id = image.block_device_mapping[image.root_device_name].snapshot_id
+        self.assertEqual(self.west.get_all_snapshots(filters={'snapshot-id': [snapshot_id]})[0].progress, '50%')
+        self.clock.now += 50
+        self.assertEqual(self.west.get_all_images(copied_id)[0].state, 'available')
+
+    def test_unknown_resources_and_regions(self):
+        self.assertIs(self.ec2.connect('not-a-real-region'), None)
+        self.assertRaises(EC2ResponseError, self.west.get_all_images, self.source_id)
+        self.assertEqual(self.west.get_all_images(filters={'image-id': [self.source_id]}), [])
+        self.assertRaises(EC2ResponseError, self.west.copy_image, 'us-west-1', self.source_id)
+
+    def test_injected_errors(self):
+        self.ec2.inject('CopyImage', 'ResourceLimitExceeded', count=2)
+        for _ in range(2):
+            with self.assertRaises(EC2ResponseError) as cm:
+                self.west.copy_image('us-east-1', self.source_id)
+            self.assertEqual(cm.exception.error_code, 'ResourceLimitExceeded')
+        self.west.copy_image('us-east-1', self.source_id)
+        self.assertEqual(self.ec2.calls['CopyImage'], 3)
+
+    def test_copy_limit(self):
+        self.ec2.copy_limit = 1
+        self.west.copy_image('us-east-1', self.source_id)
+        self.assertRaises(EC2ResponseError, self.west.copy_image, 'us-east-1', self.source_id)
+        self.clock.now += 100
+        self.west.copy_image('us-east-1', self.source_id)
+
+    def test_throttling_is_repeatable(self):
+        def throttled(seed):
+            ec2 = SimulatedEC2(throttle_rate=0.5, seed=seed)
+            conn = ec2.connect('us-east-1')
+            for _ in range(20):
+                try:
+                    conn.get_all_images(owners=['self'])
+                except EC2ResponseError as e:
+                    self.assertEqual(e.error_code, 'RequestLimitExceeded')
+            return ec2.throttles['DescribeImages']
+
+        self.assertEqual(throttled(1), throttled(1))
+        self.assertTrue(0 < throttled(1) < 20)
+
+    def test_regions(self):
+        self.assertEqual(SimulatedEC2(regions=3).regions(), ['sim-1', 'sim-2', 'sim-3'])
+        self.assertEqual(utils.get_regions_to_copy_to('us-east-1', self.ec2), ['us-west-1'])
+
+
+class SimulatedDistributionTests(unittest.TestCase):
+    def test_pipeline_across_many_regions(self):
+        ec2 = SimulatedEC2(regions=30, copy_duration=0.01, failure_rate=0.1, seed=7)
+        registry = Registry(backend=ec2)
+        distami = Distami(ec2.add_image('sim-1'), 'sim-1', registry=registry)
+        regions = ec2.regions()[1:]
+
+        results = Pipeline(Journal(), lambda *args: None, FixedPolicy(0.01), workers=4).run(
+            [(distami, region) for region in regions])
+        failed = [result for result in results if not result.succeeded]
+        self.assertTrue(0 < len(failed) < len(regions))
+        self.assertEqual(ec2.calls['CopyImage'], len(regions))
+        self.assertEqual(len(ec2.images()), len(regions) + 1)
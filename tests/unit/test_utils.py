@@ -15,9 +15,25 @@
 import unittest
 
 from distami import utils
+from distami.backends import BotoBackend
+from distami.exceptions import *
+from distami.simulator import SimulatedEC2
+from tests.unit.fakes import FakeClock
 
 class UtilTests(unittest.TestCase):
     def test_get_regions_to_copy_to(self):
         all_public_regions = ['ap-southeast-1', 'ap-southeast-2', 'ap-northeast-1', 'us-east-1', 'us-west-1', 'us-west-2', 'sa-east-1', 'eu-west-1', 'eu-central-1']
-        regions = utils.get_regions_to_copy_to('not-a-real-region')
+        regions = utils.get_regions_to_copy_to('not-a-real-region', BotoBackend())
         self.assertItemsEqual(regions, all_public_regions)
+
+    def test_get_regions_to_copy_to_in_other_partitions(self):
+        regions = utils.get_regions_to_copy_to('us-east-1', BotoBackend(), partitions=['aws', 'aws-us-gov'], exclude=['ap-*'])
+        self.assertItemsEqual(regions, ['us-west-1', 'us-west-2', 'sa-east-1', 'eu-west-1', 'eu-central-1', 'us-gov-west-1'])
+        self.assertEqual(utils.get_regions_to_copy_to('cn-north-1', BotoBackend()), [])
+
+    def test_get_ami_waits_at_least_as_long_as_fixed_retries(self):
+        clock = FakeClock()
+        ec2 = SimulatedEC2(regions=1)
+        conn = ec2.connect(ec2.regions()[0])
+        self.assertRaises(DistamiException, utils.get_ami, conn, 'ami-missing', clock.sleep)
+        self.assertTrue(clock.slept >= 20)
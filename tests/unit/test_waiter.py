@@ -0,0 +1,80 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import unittest
+
+from distami.exceptions import *
+from distami.polling import FixedPolicy
+from distami.simulator import ec2_error
+from distami.waiter import AmiWaiter
+from tests.unit.fakes import FakeConnection, FakeImage
+
+
+class AmiWaiterTests(unittest.TestCase):
+    def test_one_call_per_region_per_poll(self):
+        conn = FakeConnection('us-west-1', [FakeImage('ami-1', ['pending', 'available']),
+                                            FakeImage('ami-2', ['pending', 'pending', 'available'])])
+        waiter = AmiWaiter(FixedPolicy(0))
+        waiter.add(conn, 'ami-1')
+        waiter.add(conn, 'ami-2')
+        self.assertEqual(len(waiter), 2)
+
+        finished = [image.id for image in waiter.wait()]
+        self.assertEqual(finished, ['ami-1', 'ami-2'])
+        self.assertEqual(len(conn.calls), 3)
+        self.assertEqual(len(waiter), 0)
+
+    def test_polls_only_own_images(self):
+        conn = FakeConnection('us-west-1', [FakeImage('ami-1', ['available'])])
+        waiter = AmiWaiter(FixedPolicy(0))
+        waiter.add(conn, 'ami-1')
+        waiter.poll()
+        self.assertEqual(conn.owners, ['self'])
+
+    def test_failed_images_are_returned(self):
+        conn = FakeConnection('us-west-2', [FakeImage('ami-1', ['failed'])])
+        waiter = AmiWaiter(FixedPolicy(0))
+        waiter.add(conn, 'ami-1')
+        self.assertEqual([image.state for image in waiter.poll()], ['failed'])
+
+    def test_missing_image_gives_up(self):
+        conn = FakeConnection('eu-west-1', [])
+        waiter = AmiWaiter(FixedPolicy(0))
+        waiter.add(conn, 'ami-missing')
+        self.assertRaises(DistamiException, list, waiter.wait())
+        self.assertEqual(len(conn.calls), AmiWaiter.max_missing_polls)
+
+    def test_failed_poll_is_retried(self):
+        conn = FakeConnection('us-west-1', [FakeImage('ami-1')], errors=[ec2_error('InternalError', 500)])
+        waiter = AmiWaiter(FixedPolicy(0))
+        waiter.add(conn, 'ami-1')
+        self.assertEqual([image.id for image in waiter.wait()], ['ami-1'])
+        self.assertEqual(len(conn.calls), 2)
+
+    def test_failing_region_gives_up_only_on_its_own_images(self):
+        error = ec2_error('InternalError', 500)
+        broken = FakeConnection('us-west-1', [FakeImage('ami-1')], errors=[error] * AmiWaiter.max_failed_polls)
+        working = FakeConnection('us-west-2', [FakeImage('ami-2', ['pending'] * 10 + ['available'])])
+        waiter = AmiWaiter(FixedPolicy(0))
+        waiter.add(broken, 'ami-1')
+        waiter.add(working, 'ami-2')
+
+        for _ in range(AmiWaiter.max_failed_polls - 1):
+            waiter.poll()
+            self.assertEqual(waiter.failed(), [])
+        waiter.poll()
+        self.assertEqual(waiter.failed(), [('us-west-1', 'ami-1', error)])
+        self.assertEqual(len(waiter), 1)
+        self.assertEqual([image.id for image in waiter.wait()], ['ami-2'])